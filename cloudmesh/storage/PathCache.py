@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PathCache(object):
+    """
+        Least recently used cache whose entries expire after ttl seconds.
+
+        The providers use it to remember the ids of paths and names, e.g.
+        the Box provider maps paths to items and folder ids to the items
+        in the folder. The cache is shared by the threads of a provider.
+
+        Example:
+
+            cache = PathCache(ttl=60, size=10000)
+            cache.set('data/2019', folder)
+            folder = cache.get('data/2019')
+            cache.invalidate_prefix('data')
+    """
+
+    def __init__(self, ttl=60, size=10000):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        returns the cached value of a key
+
+        :param key: the key
+        :return: the value, None if the key is not cached or has expired
+        """
+        with self.lock:
+            if key in self.entries:
+                cached, value = self.entries[key]
+                if time.monotonic() - cached < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """
+        caches the value of a key, the least recently used keys are
+        removed if the cache holds more than size keys
+
+        :param key: the key
+        :param value: the value
+        """
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        removes a key from the cache
+
+        :param key: the key
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_prefix(self, path):
+        """
+        removes a path and all paths below it from the cache
+
+        :param path: the path
+        """
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key == path or key.startswith(path + '/')]:
+                del self.entries[key]
+
+    def clear(self):
+        """
+        removes all keys from the cache
+        """
+        with self.lock:
+            self.entries.clear()
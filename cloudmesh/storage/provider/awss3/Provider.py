@@ -1,11 +1,149 @@
+import fnmatch
+import hashlib
+import itertools
 import os
-import stat
-import boto3
+import threading
 import botocore
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from datetime import timezone
+from email.utils import format_datetime
 from cloudmesh.abstractclass.StorageABC import StorageABC
 from cloudmesh.common.util import HEADING
 from pprint import pprint
+from s3transfer.utils import ChunksizeAdjuster
 from cloudmesh.common.console import Console
+from cloudmesh.storage.provider.awss3.Registry import Registry
+from cloudmesh.storage.provider.awss3.RemoteFile import RemoteFile
+from cloudmesh.storage.util import merge_settings
+from cloudmesh.storage.util import raise_failed
+from cloudmesh.storage.util import read_checkpoint
+from cloudmesh.storage.util import size_in_bytes
+from cloudmesh.storage.util import write_checkpoint
+
+#
+# The transfer settings can be set in the yaml file of the service
+#
+# cloudmesh:
+#   storage:
+#     awss3:
+#       transfer:
+#         multipart_threshold: 8MB
+#         multipart_chunksize: 8MB
+#         max_concurrency: 10
+#         max_workers: 8
+#         max_pool_connections: 80
+#
+# multipart_threshold and multipart_chunksize are sizes in bytes or
+# strings such as 64MB. max_concurrency is the number of threads that
+# transfer the parts of a single file and max_workers is the number of
+# files that are transferred at the same time. max_pool_connections is
+# the size of the connection pool of the S3 client, it defaults to
+# max_workers * max_concurrency and is only read from the yaml file.
+#
+TRANSFER_DEFAULTS = {
+    'multipart_threshold': 8 * 1024 ** 2,
+    'multipart_chunksize': 8 * 1024 ** 2,
+    'max_concurrency': 10,
+    'max_workers': 8,
+    'max_pool_connections': None
+}
+
+# suffix of the checkpoint file of a ranged download and the size of the
+# buffers in which downloaded bytes are written to disk
+CHECKPOINT_SUFFIX = '.cmdownload'
+DOWNLOAD_BUFFER = 1024 ** 2
+
+# the smallest part S3 accepts in a multipart upload
+MIN_PART_SIZE = 5 * 1024 ** 2
+
+
+def read_parts(stream, size):
+    """
+    splits a file like object or an iterator of bytes into parts of the
+    given size, only the last part may be smaller
+
+    :param stream: a file like object or an iterator of bytes
+    :param size: the size of the parts in bytes
+    :return: iterator of bytes
+    """
+    if hasattr(stream, 'read'):
+        while True:
+            data = stream.read(size)
+            if not data:
+                return
+            while len(data) < size:
+                # raw streams and sockets may return less than asked for
+                more = stream.read(size - len(data))
+                if not more:
+                    break
+                data += more
+            yield data
+    else:
+        buffer = bytearray()
+        for data in stream:
+            buffer.extend(data)
+            while len(buffer) >= size:
+                yield bytes(buffer[:size])
+                del buffer[:size]
+        if len(buffer) > 0:
+            yield bytes(buffer)
+
+
+def glob_prefix(pattern):
+    """
+    returns the part of a glob pattern before the first wildcard
+
+    :param pattern: a glob pattern such as data-*.csv
+    :return: the literal prefix
+    """
+    for i, c in enumerate(pattern):
+        if c in '*?[':
+            return pattern[:i]
+    return pattern
+
+
+def local_etag(filename, multipart_threshold, multipart_chunksize):
+    """
+    computes the ETag S3 reports for a file uploaded with the given
+    multipart settings. Files below the threshold are uploaded in one
+    request and their ETag is the MD5 of the content. Larger files are
+    uploaded in parts and the ETag is the MD5 of the concatenated MD5
+    digests of the parts followed by the number of parts. The part size
+    is adjusted like s3transfer does it, parts are at least 5MB and a
+    file has at most 10000 parts.
+
+    :param filename: the local file
+    :param multipart_threshold: the multipart threshold in bytes
+    :param multipart_chunksize: the configured part size in bytes
+    :return: the quoted ETag
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        if size < multipart_threshold:
+            md5 = hashlib.md5()
+            for block in iter(lambda: f.read(DOWNLOAD_BUFFER), b''):
+                md5.update(block)
+            return '"{etag}"'.format(etag=md5.hexdigest())
+
+        multipart_chunksize = ChunksizeAdjuster().adjust_chunksize(
+            multipart_chunksize, size)
+        digests = []
+        for part in range((size + multipart_chunksize - 1) //
+                          multipart_chunksize):
+            md5 = hashlib.md5()
+            remaining = multipart_chunksize
+            while remaining > 0:
+                block = f.read(min(remaining, DOWNLOAD_BUFFER))
+                if not block:
+                    break
+                md5.update(block)
+                remaining -= len(block)
+            digests.append(md5.digest())
+        return '"{etag}-{parts}"'.format(
+            etag=hashlib.md5(b''.join(digests)).hexdigest(),
+            parts=len(digests))
 
 
 class Provider(StorageABC):
@@ -13,23 +151,48 @@ class Provider(StorageABC):
     def __init__(self, service=None, config="~/.cloudmesh/cloudmesh4.yaml"):
         super().__init__(service=service, config=config)
         self.container_name = self.credentials['container']
-        self.s3_resource = boto3.resource('s3',
-                                          aws_access_key_id=self.credentials[
-                                              'access_key_id'],
-                                          aws_secret_access_key=
-                                          self.credentials['secret_access_key'],
-                                          region_name=self.credentials['region']
-                                          )
-        self.s3_client = boto3.client('s3',
-                                      aws_access_key_id=self.credentials[
-                                          'access_key_id'],
-                                      aws_secret_access_key=self.credentials[
-                                          'secret_access_key'],
-                                      region_name=self.credentials['region']
-                                      )
+        spec = self.config["cloudmesh.storage"][service]
+        self.transfer = dict(TRANSFER_DEFAULTS)
+        self.transfer = self.transfer_settings(spec.get('transfer'))
+        # by default there are enough connections for all files and all
+        # their parts in flight
+        pool_size = self.transfer['max_pool_connections'] or \
+            self.transfer['max_workers'] * self.transfer['max_concurrency']
+        # the clients come from the registry and are only created when
+        # the first request is made
+        self.client_args = {
+            'access_key_id': self.credentials['access_key_id'],
+            'secret_access_key': self.credentials['secret_access_key'],
+            'region': self.credentials['region'],
+            'max_pool_connections': pool_size
+        }
         self.directory_marker_file_name = 'marker.txt'
         self.storage_dict = {}
 
+    @property
+    def s3_client(self):
+        return Registry.client(**self.client_args)
+
+    @property
+    def s3_resource(self):
+        return Registry.resource(**self.client_args)
+
+    # function to merge the transfer section of the yaml file with the
+    # values given for a single call
+    def transfer_settings(self, transfer=None):
+        settings = merge_settings(self.transfer, transfer)
+        for key in ['multipart_threshold', 'multipart_chunksize']:
+            settings[key] = size_in_bytes(settings[key])
+        return settings
+
+    # boto3 config for the multipart part of an upload or download
+    def transfer_config(self, settings):
+        return TransferConfig(
+            multipart_threshold=settings['multipart_threshold'],
+            multipart_chunksize=settings['multipart_chunksize'],
+            max_concurrency=settings['max_concurrency'],
+            use_threads=settings['max_concurrency'] > 1)
+
     def update_dict(self, elements, kind=None):
         # this is an internal function for building dict object
         d = []
@@ -91,11 +254,93 @@ class Provider(StorageABC):
                     'last-modified'],
             "contentLength":
                 metadata['ResponseMetadata']['HTTPHeaders'][
-                    'content-length']
+                    'content-length'],
+            "eTag": metadata['ETag']
+        }
+
+        return info
+
+    # Function to extract obj dict from an entry of a ListObjectsV2
+    # response, it carries the same information as a head call
+    def extract_object_dict(self, obj, filename=None):
+        info = {
+            "fileName": filename or obj['Key'],
+            "lastModificationDate":
+                format_datetime(
+                    obj['LastModified'].astimezone(timezone.utc),
+                    usegmt=True),
+            "contentLength": str(obj['Size']),
+            "eTag": obj['ETag']
         }
 
         return info
 
+    # generator over the pages of a ListObjectsV2 listing, the filtering
+    # by prefix and delimiter is done by S3 and not on the client
+    def list_pages(self, prefix, delimiter=None, page_size=1000):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        params = {
+            'Bucket': self.container_name,
+            'Prefix': prefix,
+            'PaginationConfig': {'PageSize': page_size}
+        }
+        if delimiter is not None:
+            params['Delimiter'] = delimiter
+        for page in paginator.paginate(**params):
+            yield page
+
+    # the prefix of the keys below a directory. The trailing '/' keeps
+    # siblings such as dir10/b.txt or dir1.txt out of the keys of dir1
+    def directory_prefix(self, directory):
+        if len(directory) == 0:
+            return ''
+        return directory.rstrip('/') + '/'
+
+    # the listed object whose key is exactly key, None if there is none.
+    # Every other key starting with key sorts after it, so the first key
+    # of the listing is enough
+    def file_object(self, key):
+        response = self.s3_client.list_objects_v2(
+            Bucket=self.container_name, Prefix=key, MaxKeys=1)
+        objs = response.get('Contents', [])
+        if len(objs) > 0 and objs[0]['Key'] == key:
+            return objs[0]
+        return None
+
+    # generator over the objects of one level, these are the object named
+    # like the prefix as well as the direct children if the prefix is a
+    # directory. The delimiter lets S3 fold everything below the next '/'
+    # into CommonPrefixes, so only the keys of this level are transferred
+    def list_level(self, prefix):
+        # d/ is the directory d, its children are listed below
+        prefix = prefix.rstrip('/')
+        sub_dirs = []
+        for page in self.list_pages(prefix, delimiter='/'):
+            for obj in page.get('Contents', []):
+                # dir1.txt shares the prefix of dir1 but is a sibling
+                if len(prefix) == 0 or obj['Key'] == prefix:
+                    yield obj
+            for common_prefix in page.get('CommonPrefixes', []):
+                sub_dirs.append(common_prefix['Prefix'])
+
+        if prefix + '/' in sub_dirs:
+            # the prefix is a directory, list its direct children
+            for page in self.list_pages(prefix + '/', delimiter='/'):
+                for obj in page.get('Contents', []):
+                    yield obj
+
+    # a directory exists if at least one key starts with its name and a
+    # slash, which costs one request with MaxKeys=1
+    def directory_exists(self, directory):
+        response = self.s3_client.list_objects_v2(
+            Bucket=self.container_name, Prefix=directory + '/', MaxKeys=1)
+        return response['KeyCount'] > 0
+
+    # directory placeholders and marker files are not reported as files
+    def is_listed_file(self, key):
+        return not key.endswith('/') and \
+            os.path.basename(key) != self.directory_marker_file_name
+
     # function to create a directory
     def create_dir(self, service=None, directory=None):
         """
@@ -114,23 +359,19 @@ class Provider(StorageABC):
         self.storage_dict['directory'] = directory
         dir_files_list = []
 
-        # obj = list(self.s3_resource.Bucket(self.container_name).objects.filter(Prefix=filePath))
-        obj = list(self.s3_resource.Bucket(self.container_name).objects.filter(
-            Prefix=file_path + '/'))
-
-        if len(obj) == 0:
-            # markerObject = self.s3_resource.Object(self.container_name, filePath).put(Body=fileContent)
-            markerObject = self.s3_resource.Object(
-                self.container_name, self.massage_path(
-                    directory) + '/' + self.directory_marker_file_name
-            ).put(Body=fileContent)
+        # a single key is enough to know that the directory exists, no
+        # matter how many objects it contains
+        if not self.directory_exists(file_path):
+            marker_key = file_path + '/' + self.directory_marker_file_name
+            self.s3_client.put_object(Bucket=self.container_name,
+                                      Key=marker_key, Body=fileContent)
 
             # make head call to extract meta data
             # and derive obj dict
             metadata = self.s3_client.head_object(
-                Bucket=self.container_name, Key=self.massage_path(directory) + '/' + self.directory_marker_file_name)
+                Bucket=self.container_name, Key=marker_key)
             dir_files_list.append(self.extract_file_dict(
-                self.massage_path(directory) + '/',
+                file_path + '/',
                 metadata)
             )
 
@@ -163,90 +404,29 @@ class Provider(StorageABC):
         self.storage_dict['source'] = source
         self.storage_dict['recursive'] = recursive
 
-        objs = list(self.s3_resource.Bucket(self.container_name).objects.all())
-
         dir_files_list = []
         trimmed_source = self.massage_path(source)
 
         if not recursive:
-            # call will not be recursive and need to look only in the specified directory
-            for obj in objs:
-                if obj.key.startswith(self.massage_path(trimmed_source)):
-                    # print(obj.key)
-                    file_name = obj.key.replace(self.directory_marker_file_name,
-                                                '')
-                    if file_name[-1] == '/':
-                        # Its a directory
-                        '''
-                        if (fileName.replace(trimmedSource,'').count('/') == 1):
-                            dirFilesList.append(fileName)
-                        '''
-                        x = 1
-                    else:
-                        # Its a file
-                        if len(file_name.replace(trimmed_source, '')) == 0:
-                            # dir_files_list.append(file_name)
-
-                            # make head call to extract meta data
-                            # and derive obj dict
-                            metadata = self.s3_client.head_object(
-                                Bucket=self.container_name, Key=file_name)
-                            dir_files_list.append(self.extract_file_dict(file_name, metadata))
-
-                        elif (file_name.replace(trimmed_source, '')[
-                                  0] == '/' and file_name.replace(trimmed_source,
-                                                                  '').count('/') == 1):
-                            #dir_files_list.append(file_name)
-
-                            # make head call to extract meta data
-                            # and derive obj dict
-                            metadata = self.s3_client.head_object(
-                                Bucket=self.container_name, Key=file_name)
-                            dir_files_list.append(self.extract_file_dict(file_name, metadata))
-
-                        elif (file_name.replace(trimmed_source, '')[
-                                  0] != '/' and file_name.replace(trimmed_source,
-                                                                  '').count('/') == 0):
-                            #dir_files_list.append(file_name)
-
-                            # make head call to extract meta data
-                            # and derive obj dict
-                            metadata = self.s3_client.head_object(
-                                Bucket=self.container_name, Key=file_name)
-                            dir_files_list.append(self.extract_file_dict(file_name, metadata))
-
-                    # print(fileName)
-        else:
-            # call will be recursive and need to look recursively in the specified directory as well
-            for obj in objs:
-                if obj.key.startswith(self.massage_path(trimmed_source)):
-                    # print(obj.key)
-                    file_name = obj.key.replace(self.directory_marker_file_name,
-                                                '')
-                    if file_name[-1] == '/':
-                        # Its a directory
-                        '''
-                        if (fileName.replace(trimmedSource,'').count('/') == 1):
-                            dirFilesList.append(fileName)
-                        '''
-                        x = 1
-                    else:
-                        # its a file
-                        #dir_files_list.append(file_name)
-
-                        # make head call to extract meta data
-                        # and derive obj dict
-                        metadata = self.s3_client.head_object(
-                            Bucket=self.container_name, Key=file_name)
-                        dir_files_list.append(self.extract_file_dict(file_name, metadata))
-                    # print(fileName)
-        '''
-        if len(dirFilesList) == 0:
-            #print("No files found in directory")
-            self.storage_dict['message'] = ''
+            # call will not be recursive and need to look only in the
+            # specified directory
+            for obj in self.list_level(trimmed_source):
+                if self.is_listed_file(obj['Key']):
+                    dir_files_list.append(self.extract_object_dict(obj))
         else:
-            self.storage_dict['message'] = dirFilesList
-        '''
+            # call will be recursive and need to look recursively in the
+            # specified directory as well
+            for page in self.list_pages(
+                    self.directory_prefix(trimmed_source)):
+                for obj in page.get('Contents', []):
+                    if self.is_listed_file(obj['Key']):
+                        dir_files_list.append(self.extract_object_dict(obj))
+
+            if len(dir_files_list) == 0 and len(trimmed_source) > 0:
+                # the source may be a file
+                obj = self.file_object(trimmed_source)
+                if obj is not None and self.is_listed_file(obj['Key']):
+                    dir_files_list.append(self.extract_object_dict(obj))
 
         self.storage_dict['objlist'] = dir_files_list
         pprint(self.storage_dict)
@@ -278,82 +458,58 @@ class Provider(StorageABC):
         #recursive = True
 
         try:
-            file_obj = self.s3_client.get_object(Bucket=self.container_name,
-                                                 Key=trimmed_source)
+            # the head call tells if the source is a file and returns
+            # the metadata for the obj dict at the same time
+            file_obj = self.s3_client.head_object(Bucket=self.container_name,
+                                                  Key=trimmed_source)
         except botocore.exceptions.ClientError as e:
             # object not found
             x = 1
 
         if file_obj:
             # Its a file and can be deleted
+            dir_files_list.append(self.extract_file_dict(trimmed_source, file_obj))
 
-            # make head call to extract meta data
-            # and derive obj dict
-            metadata = self.s3_client.head_object(
-                Bucket=self.container_name, Key=trimmed_source)
-            dir_files_list.append(self.extract_file_dict(trimmed_source, metadata))
-
-            blob = self.s3_resource.Object(self.container_name, trimmed_source).delete()
+            self.s3_client.delete_object(Bucket=self.container_name,
+                                         Key=trimmed_source)
 
             # print('File deleted')
             self.storage_dict['message'] = 'Source Deleted'
 
-        else:
-            # Search for a directory
-            all_objs = list(
-                self.s3_resource.Bucket(self.container_name).objects.filter(
-                    Prefix=trimmed_source))
+        elif recursive is True:
+            # Search for a directory and delete everything below it
+            dir_files_list, errors = self.delete_prefix(
+                self.directory_prefix(trimmed_source))
 
-            total_all_objs = len(all_objs)
+            if len(dir_files_list) == 0 and len(errors) == 0:
+                self.storage_dict['message'] = 'Source Not Found'
+            elif len(errors) > 0:
+                self.storage_dict['message'] = 'Source partially deleted'
+            else:
+                self.storage_dict['message'] = 'Source Deleted'
+            self.storage_dict['errors'] = errors
 
-            if total_all_objs == 0:
+        else:
+            # Search for a directory, two keys are enough to know if the
+            # directory holds anything but its marker file
+            marker_key = trimmed_source + '/' + self.directory_marker_file_name
+            objs = self.s3_client.list_objects_v2(
+                Bucket=self.container_name, Prefix=trimmed_source + '/',
+                MaxKeys=2).get('Contents', [])
+
+            if len(objs) == 0:
                 self.storage_dict['message'] = 'Source Not Found'
 
-            elif total_all_objs > 0 and recursive is True:
-                for obj in all_objs:
-                    # if obj.key.startswith(self.massage_path(trimmedSource)):
-
-                    # make head call to extract meta data
-                    # and derive obj dict
-                    if os.path.basename(obj.key) != self.directory_marker_file_name:
-                        metadata = self.s3_client.head_object(
-                            Bucket=self.container_name, Key=obj.key)
-                        dir_files_list.append(self.extract_file_dict(obj.key, metadata))
-                    else:
-                        metadata = self.s3_client.head_object(
-                            Bucket=self.container_name, Key=obj.key)
-                        dir_files_list.append(self.extract_file_dict(obj.key.replace(os.path.basename(obj.key),''),
-                                                                     metadata))
-
-                    self.s3_resource.Object(self.container_name,
-                                            obj.key).delete()
-                    #dir_files_list.append(obj.key)
+            elif len(objs) == 1 and objs[0]['Key'] == marker_key:
+                dir_files_list.append(self.extract_object_dict(
+                    objs[0], filename=trimmed_source + '/'))
 
+                self.s3_client.delete_object(Bucket=self.container_name,
+                                             Key=marker_key)
                 self.storage_dict['message'] = 'Source Deleted'
-
-            elif total_all_objs > 0 and recursive is False:
-                # check if marker file exists in this directory
-                marker_obj_list = list(
-                    self.s3_resource.Bucket(self.container_name).objects.filter(
-                        Prefix=trimmed_source + '/' + self.directory_marker_file_name))
-                marker_exits = False
-                if len(marker_obj_list) == 1:
-                    marker_exits = True
-
-                if marker_exits is True and total_all_objs == 1:
-
-                    metadata = self.s3_client.head_object(
-                        Bucket=self.container_name, Key=trimmed_source + '/' + self.directory_marker_file_name)
-                    dir_files_list.append(self.extract_file_dict(trimmed_source + '/',
-                                                                 metadata))
-
-                    self.s3_resource.Object(self.container_name,
-                                            trimmed_source + '/' + self.directory_marker_file_name).delete()
-                    self.storage_dict['message'] = 'Source Deleted'
-                else:
-                    self.storage_dict[
-                        'message'] = 'Source has child objects. Please delete child objects first or use recursive option'
-
+            else:
+                self.storage_dict[
+                    'message'] = 'Source has child objects. Please delete child objects first or use recursive option'
 
         self.storage_dict['objlist'] = dir_files_list
         pprint(self.storage_dict)
@@ -361,8 +517,64 @@ class Provider(StorageABC):
         #return self.storage_dict
         return dictObj
 
+    # function to delete all objects below a prefix with DeleteObjects.
+    # Every page of the listing holds at most 1000 keys which is also the
+    # limit of a single DeleteObjects request, so each page is handed to
+    # the thread pool as one batch while the listing continues
+    def delete_prefix(self, prefix):
+        deleted = []
+        errors = []
+        batches = []
+        with ThreadPoolExecutor(max_workers=self.transfer['max_workers']) as executor:
+            for page in self.list_pages(prefix):
+                objs = page.get('Contents', [])
+                if len(objs) > 0:
+                    batches.append(
+                        executor.submit(self.delete_batch, objs))
+            for batch in batches:
+                batch_deleted, batch_errors = batch.result()
+                deleted.extend(batch_deleted)
+                errors.extend(batch_errors)
+        return deleted, errors
+
+    # function to delete one batch of listed objects, the obj dicts are
+    # derived from the listing and keys that S3 could not delete are
+    # reported as errors
+    def delete_batch(self, objs):
+        response = self.s3_client.delete_objects(
+            Bucket=self.container_name,
+            Delete={
+                'Objects': [{'Key': obj['Key']} for obj in objs],
+                'Quiet': True
+            })
+
+        errors = []
+        failed = set()
+        for error in response.get('Errors', []):
+            failed.add(error['Key'])
+            errors.append({
+                "fileName": error['Key'],
+                "code": error.get('Code'),
+                "message": error.get('Message')
+            })
+            Console.error("{key} could not be deleted: {message}".format(
+                key=error['Key'], message=error.get('Message')))
+
+        deleted = []
+        for obj in objs:
+            if obj['Key'] in failed:
+                continue
+            if os.path.basename(obj['Key']) == self.directory_marker_file_name:
+                deleted.append(self.extract_object_dict(
+                    obj, filename=obj['Key'].replace(
+                        os.path.basename(obj['Key']), '')))
+            else:
+                deleted.append(self.extract_object_dict(obj))
+        return deleted, errors
+
     # function to upload file or directory
-    def put(self, service=None, source=None, destination=None, recursive=False):
+    def put(self, service=None, source=None, destination=None, recursive=False,
+            transfer=None, incremental=False):
         """
         puts the source on the service
         :param service: the name of the service in the yaml file
@@ -370,6 +582,11 @@ class Provider(StorageABC):
         :param destination: the destination which either can be a directory or file
         :param recursive: in case of directory the recursive referes to all
                           subdirectories in the specified source
+        :param transfer: dict overwriting the transfer settings of the yaml
+                         file for this call
+        :param incremental: if True files whose size and ETag match the
+                            object in the bucket are not uploaded again,
+                            each dict then has a skipped attribute
         :return: dict
         """
 
@@ -385,7 +602,10 @@ class Provider(StorageABC):
         is_source_file = os.path.isfile(trimmed_source)
         is_source_dir = os.path.isdir(trimmed_source)
 
+        settings = self.transfer_settings(transfer)
+
         files_uploaded = []
+        files_to_upload = []
 
         if is_source_file is True:
             # print('file flow')
@@ -399,92 +619,50 @@ class Provider(StorageABC):
                 is_trimmed_destination_file = True
                 #print('dot_operator found')
 
-            #print('is_trimmed_destination_file  :')
-            #print(is_trimmed_destination_file)
-
             if is_trimmed_destination_file:
-                blob_obj = self.s3_client.upload_file(trimmed_source, self.container_name,
-                                                  trimmed_destination)
-
-
-                # make head call since file upload does not return
-                # obj dict to extract meta data
-                metadata = self.s3_client.head_object(
-                    Bucket=self.container_name, Key=trimmed_destination)
-                files_uploaded.append(self.extract_file_dict(trimmed_destination, metadata))
-
+                destination_key = trimmed_destination
+            elif len(trimmed_destination) == 0:
+                destination_key = os.path.basename(trimmed_source)
             else:
+                destination_key = trimmed_destination + '/' + os.path.basename(trimmed_source)
 
-                destination_key = ''
-                if len(trimmed_destination) == 0:
-                    destination_key = os.path.basename(trimmed_source)
-                else:
-                    destination_key = trimmed_destination + '/' + os.path.basename(trimmed_source)
-
-                blob_obj = self.s3_client.upload_file(trimmed_source, self.container_name,
-                                                      destination_key)
-
-                # make head call since file upload does not return
-                # obj dict to extract meta data
-                metadata = self.s3_client.head_object(
-                    Bucket=self.container_name, Key=destination_key)
-                files_uploaded.append(self.extract_file_dict(destination_key,metadata))
-
-            self.storage_dict['message'] = 'Source uploaded'
+            files_to_upload.append((trimmed_source, destination_key))
         elif is_source_dir is True:
             # Look if its a directory
             # print('dir flow')
-            #files_uploaded = []
             if recursive is False:
                 # get files in the directory and upload to destination dir
                 dirfiles = next(os.walk(trimmed_source))[2]
 
                 for file in dirfiles:
-                    self.s3_client.upload_file(trimmed_source + '/' + file,
-                                               self.container_name,
-                                               trimmed_destination + '/' + file)
-                    #files_uploaded.append(trimmed_destination + '/' + file)
-
-                    # make head call since file upload does not return
-                    # obj dict to extract meta data
-                    metadata = self.s3_client.head_object(
-                        Bucket=self.container_name, Key=trimmed_destination + '/' + file)
-                    files_uploaded.append(self.extract_file_dict(trimmed_destination + '/' + file, metadata))
-
+                    files_to_upload.append(
+                        (trimmed_source + '/' + file,
+                         trimmed_destination + '/' + file))
             else:
                 # get the directories with in the folder as well and upload
-                files_to_upload = []
                 for (dirpath, dirnames, filenames) in os.walk(trimmed_source):
                     for fileName in filenames:
-                        # print(self.massage_path(dirpath)+'/'+fileName)
+                        file = self.massage_path(dirpath) + '/' + fileName
                         files_to_upload.append(
-                            self.massage_path(dirpath) + '/' + fileName)
-
-                for file in files_to_upload:
-                    self.s3_client.upload_file(file,
-                                               self.container_name,
-                                               trimmed_destination + '/' + self.massage_path(
-                                                   file.replace(trimmed_source,
-                                                                '')))
-
-                    '''
-                    files_uploaded.append(
-                    trimmed_destination + '/' + self.massage_path(
-                        file.replace(trimmed_source, '')))
-                    '''
-
-                    # make head call since file upload does not return
-                    # obj dict to extract meta data
-                    metadata = self.s3_client.head_object(
-                        Bucket=self.container_name, Key=trimmed_destination + '/' + self.massage_path(
-                                                   file.replace(trimmed_source,'')
-                        )
-                    )
-                    files_uploaded.append(self.extract_file_dict(
-                        trimmed_destination + '/' + self.massage_path(
-                            file.replace(trimmed_source,'')
-                        )
-                        , metadata))
+                            (file,
+                             trimmed_destination + '/' + self.massage_path(
+                                 file[len(trimmed_source):])))
+
+        if is_source_file is True or is_source_dir is True:
+            files_skipped = []
+            if incremental:
+                files_to_upload, files_skipped = self.changed_files(
+                    files_to_upload, settings)
+
+            files_uploaded = self.upload_files(files_to_upload, settings)
+
+            if incremental:
+                # the skipped files are part of the result and marked
+                for entry in files_uploaded:
+                    entry['skipped'] = False
+                for entry in files_skipped:
+                    entry['skipped'] = True
+                files_uploaded = files_uploaded + files_skipped
 
             #self.storage_dict['filesUploaded'] = files_uploaded
             self.storage_dict['message'] = 'Source uploaded'
@@ -498,10 +676,219 @@ class Provider(StorageABC):
         #return self.storage_dict
         return dictObj
 
+    # function to find the (filename, key) pairs that differ from the
+    # bucket. The common prefix of the keys is listed once and local
+    # checksums are only computed for files whose size matches the
+    # object, using max_workers threads. It returns the files that need
+    # to be uploaded and the obj dicts of the skipped files
+    def changed_files(self, files, settings):
+        if len(files) == 0:
+            return [], []
+
+        prefix = os.path.commonprefix([key for filename, key in files])
+        remote = {}
+        for page in self.list_pages(prefix):
+            for obj in page.get('Contents', []):
+                remote[obj['Key']] = obj
+
+        candidates = []
+        changed = []
+        for filename, key in files:
+            obj = remote.get(key)
+            if obj is not None and obj['Size'] == os.path.getsize(filename):
+                candidates.append((filename, key, obj))
+            else:
+                changed.append((filename, key))
+
+        skipped = []
+        with ThreadPoolExecutor(
+                max_workers=settings['max_workers']) as executor:
+            etags = executor.map(
+                lambda candidate: local_etag(
+                    candidate[0],
+                    settings['multipart_threshold'],
+                    settings['multipart_chunksize']),
+                candidates)
+            for (filename, key, obj), etag in zip(candidates, etags):
+                if etag == obj['ETag']:
+                    skipped.append(self.extract_object_dict(obj))
+                else:
+                    changed.append((filename, key))
+        return changed, skipped
+
+    # function to upload a single file with the multipart settings of
+    # the transfer config
+    def upload_file(self, filename, key, settings):
+        self.s3_client.upload_file(filename, self.container_name, key,
+                                   Config=self.transfer_config(settings))
+
+        # make head call since file upload does not return
+        # obj dict to extract meta data
+        metadata = self.s3_client.head_object(
+            Bucket=self.container_name, Key=key)
+        return self.extract_file_dict(key, metadata)
+
+    # function to upload a list of (filename, key) pairs. The files are
+    # uploaded by max_workers threads that all use the same client and
+    # thus the same connection pool
+    def upload_files(self, files, settings):
+        with ThreadPoolExecutor(
+                max_workers=settings['max_workers']) as executor:
+            uploads = [executor.submit(self.upload_file, filename, key,
+                                       settings)
+                       for filename, key in files]
+            return [upload.result() for upload in uploads]
+
+    # function to upload the content of a file like object or an iterator
+    # of bytes without a local file
+    def put_stream(self, destination=None, stream=None, transfer=None):
+        """
+        puts the content of a stream on the service. The stream is split
+        into parts of multipart_chunksize bytes that are uploaded by
+        max_concurrency threads. The next part is read while the others
+        are uploaded, so at most max_concurrency + 1 parts are held in
+        memory at any time.
+
+        :param destination: the key of the object
+        :param stream: a file like object or an iterator of bytes
+        :param transfer: dict overwriting the transfer settings of the yaml
+                         file for this call
+        :return: dict
+        """
+        self.storage_dict['action'] = 'put_stream'
+        self.storage_dict['destination'] = destination
+
+        key = self.massage_path(destination)
+        settings = self.transfer_settings(transfer)
+        # S3 rejects parts below 5MB except for the last one
+        chunksize = max(settings['multipart_chunksize'], MIN_PART_SIZE)
+
+        parts = read_parts(stream, chunksize)
+        first = next(parts, b'')
+        second = next(parts, None)
+
+        if second is None:
+            # everything fits into a single part
+            self.s3_client.put_object(Bucket=self.container_name, Key=key,
+                                      Body=first)
+        else:
+            parts = itertools.chain([first, second], parts)
+            # the parts are only referenced by the chain and the uploads
+            first = second = None
+            upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.container_name, Key=key)['UploadId']
+            try:
+                completed = self.upload_parts(key, upload_id, parts,
+                                              settings['max_concurrency'])
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.container_name, Key=key, UploadId=upload_id,
+                    MultipartUpload={'Parts': completed})
+            except BaseException:
+                self.s3_client.abort_multipart_upload(
+                    Bucket=self.container_name, Key=key, UploadId=upload_id)
+                raise
+
+        metadata = self.s3_client.head_object(
+            Bucket=self.container_name, Key=key)
+        self.storage_dict['message'] = 'Source uploaded'
+        self.storage_dict['objlist'] = [self.extract_file_dict(key, metadata)]
+        pprint(self.storage_dict)
+        dictObj = self.update_dict(self.storage_dict['objlist'])
+        return dictObj
+
+    # function to upload the parts of a multipart upload, the semaphore
+    # blocks reading the next part while max_concurrency parts are in
+    # flight
+    def upload_parts(self, key, upload_id, parts, max_concurrency):
+        in_flight = threading.BoundedSemaphore(max_concurrency)
 
+        def upload_part(number, data):
+            try:
+                response = self.s3_client.upload_part(
+                    Bucket=self.container_name, Key=key, UploadId=upload_id,
+                    PartNumber=number, Body=data)
+                return {'PartNumber': number, 'ETag': response['ETag']}
+            finally:
+                in_flight.release()
+
+        uploads = []
+        pending = set()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for number, data in enumerate(parts, start=1):
+                in_flight.acquire()
+                uploads.append(executor.submit(upload_part, number, data))
+                # fail early instead of reading the whole stream
+                pending = raise_failed(pending | {uploads[-1]})
+            return [upload.result() for upload in uploads]
+
+    # function to read an object as an iterator of chunks
+    def get_stream(self, source=None, chunksize=DOWNLOAD_BUFFER):
+        """
+        gets the content of an object as an iterator of bytes, only one
+        chunk is held in memory at a time
+
+        :param source: the key of the object
+        :param chunksize: the size of the chunks in bytes
+        :return: iterator of bytes
+        """
+        response = self.s3_client.get_object(
+            Bucket=self.container_name, Key=self.massage_path(source))
+        return response['Body'].iter_chunks(chunksize)
+
+    # function to read a part of an object
+    def read_range(self, source=None, offset=0, length=None, etag=None):
+        """
+        reads length bytes starting at offset from an object without
+        downloading the rest of it
+
+        :param source: the key of the object
+        :param offset: the first byte to read
+        :param length: the number of bytes, None reads to the end
+        :param etag: if given the request fails with PreconditionFailed
+                     when the object no longer has this ETag
+        :return: bytes
+        """
+        if length is None:
+            byte_range = 'bytes={start}-'.format(start=offset)
+        elif length <= 0:
+            return b''
+        else:
+            byte_range = 'bytes={start}-{end}'.format(
+                start=offset, end=offset + length - 1)
+        arguments = {}
+        if etag is not None:
+            arguments['IfMatch'] = etag
+        response = self.s3_client.get_object(
+            Bucket=self.container_name, Key=self.massage_path(source),
+            Range=byte_range, **arguments)
+        return response['Body'].read()
+
+    # function to open an object as a read only file
+    def open(self, source=None, block_size=1024 ** 2, cache_blocks=16,
+             readahead=4):
+        """
+        opens an object as a seekable read only file object that only
+        fetches the bytes that are read. All reads are made from the
+        version of the object that was opened, a read after the object
+        was overwritten fails with PreconditionFailed
+
+        :param source: the key of the object
+        :param block_size: the size of the blocks that are fetched
+        :param cache_blocks: the number of blocks kept in memory
+        :param readahead: the number of blocks fetched in advance when
+                          the file is read sequentially
+        :return: RemoteFile
+        """
+        key = self.massage_path(source)
+        metadata = self.s3_client.head_object(
+            Bucket=self.container_name, Key=key)
+        return RemoteFile(self, key, metadata['ContentLength'],
+                          etag=metadata['ETag'], block_size=block_size, cache_blocks=cache_blocks,
+                          readahead=readahead)
 
     # function to download file or directory
-    def get(self, service=None, source=None, destination=None, recursive=False):
+    def get(self, service=None, source=None, destination=None, recursive=False,
+            transfer=None):
         """
        gets the source from the service
         :param service: the name of the service in the yaml file
@@ -509,6 +896,8 @@ class Provider(StorageABC):
         :param destination: the destination which either can be a directory or file
         :param recursive: in case of directory the recursive refers to all
                           subdirectories in the specified source
+        :param transfer: dict overwriting the transfer settings of the yaml
+                         file for this call
         :return: dict
         """
         self.storage_dict['service'] = service
@@ -520,56 +909,35 @@ class Provider(StorageABC):
         trimmed_source = self.massage_path(source)
         trimmed_destination = self.massage_path(destination)
 
+        settings = self.transfer_settings(transfer)
+
         file_obj = ''
 
         try:
-            file_obj = self.s3_client.get_object(Bucket=self.container_name,
-                                                 Key=trimmed_source)
-            #print(file_obj)
+            # the head call is enough to find out if the source is a file
+            file_obj = self.s3_client.head_object(Bucket=self.container_name,
+                                                  Key=trimmed_source)
         except botocore.exceptions.ClientError as e:
             # object not found
             x = 1
 
         files_downloaded = []
 
-        is_target_file = os.path.isfile(trimmed_destination)
         is_target_dir = os.path.isdir(trimmed_destination)
 
-        '''
-        print('is_target_file')
-        print(is_target_file)
-        print('is_target_dir')
-        print(is_target_dir)
-        '''
-
         if file_obj:
             # Its a file and can be downloaded
-            # print('downloading file..')
-            # print(os.path.basename(trimmedSource))
+            if is_target_dir:
+                filename = trimmed_destination + '/' + os.path.basename(
+                    trimmed_source)
+            else:
+                filename = trimmed_destination
             try:
-                if is_target_dir:
-                    '''
-                    print('target is directory...')
-                    print('trimmed_destination : '+ trimmed_destination)
-                    print(trimmed_source)
-                    '''
-                    blob = self.s3_resource.Bucket(
-                        self.container_name).download_file(
-                        trimmed_source,
-                        trimmed_destination+'/'+os.path.basename(trimmed_source)
-                    )
-                else:
-                    blob = self.s3_resource.Bucket(
-                        self.container_name).download_file(
-                        trimmed_source, trimmed_destination)
-                # trimmedSource, trimmedDestination + '/' + os.path.basename(trimmedSource))
-                # print('File downloaded')
-
-                # make head call since file download does not return
-                # obj dict to extract meta data
-                metadata = self.s3_client.head_object(
-                    Bucket=self.container_name, Key=trimmed_source)
-                files_downloaded.append(self.extract_file_dict(trimmed_source,metadata))
+                self.download_file(trimmed_source, filename, settings,
+                                   size=file_obj['ContentLength'],
+                                   etag=file_obj['ETag'])
+                files_downloaded.append(
+                    self.extract_file_dict(trimmed_source, file_obj))
 
                 self.storage_dict['message'] = 'Source downloaded'
             except FileNotFoundError as e:
@@ -577,118 +945,39 @@ class Provider(StorageABC):
 
         else:
             # Search for a directory
-            all_objs = list(
-                self.s3_resource.Bucket(self.container_name).objects.filter(
-                    Prefix=trimmed_source))
-
-            total_all_objs = len(all_objs)
-
-            # print('total_allObjs : '+str(total_allObjs))
+            if recursive is False:
+                objs = self.list_level(trimmed_source)
+            else:
+                objs = (obj
+                        for page in self.list_pages(
+                            self.directory_prefix(trimmed_source))
+                        for obj in page.get('Contents', []))
 
-            if total_all_objs == 0:
+            files_to_download = []
+            for obj in objs:
+                if not self.is_listed_file(obj['Key']):
+                    continue
+                folder_path = os.path.dirname(
+                    self.massage_path(obj['Key'][len(trimmed_source):]))
+                if len(folder_path) > 0:
+                    folder_path = folder_path + '/'
+                    os.makedirs(trimmed_destination + '/' + folder_path,
+                                exist_ok=True)
+                files_to_download.append(
+                    (obj, trimmed_destination + '/' + folder_path +
+                     os.path.basename(obj['Key'])))
+
+            if len(files_to_download) == 0:
                 self.storage_dict['message'] = 'Source Not Found'
+            else:
+                try:
+                    files_downloaded = self.download_files(files_to_download,
+                                                           settings)
+                    self.storage_dict['message'] = 'Source downloaded'
+                except FileNotFoundError as e:
+                    self.storage_dict['message'] = 'Destination not found'
 
-            elif total_all_objs > 0 and recursive is False:
-                # print('directory found and recursive is false')
-                #files_downloaded = []
-                for obj in all_objs:
-                    if os.path.basename(obj.key) != self.directory_marker_file_name:
-                        if self.massage_path(
-                                obj.key.replace(trimmed_source, '')).count('/') == 0:
-                            try:
-                                blob = self.s3_resource.Bucket(
-                                    self.container_name).download_file(
-                                    obj.key,
-                                    trimmed_destination + '/' + os.path.basename(
-                                        obj.key))
-                                # trimmedSource, trimmedDestination + '/' + os.path.basename(trimmedSource))
-                                # print('File downloaded')
-
-                                # make head call since file download does not return
-                                # obj dict to extract meta data
-                                metadata = self.s3_client.head_object(
-                                    Bucket=self.container_name, Key=obj.key)
-                                files_downloaded.append(self.extract_file_dict(obj.key, metadata))
-
-                                self.storage_dict[
-                                    'message'] = 'Source downloaded'
-                                #files_downloaded.append(obj.key)
-                            except FileNotFoundError as e:
-                                self.storage_dict[
-                                    'message'] = 'Destination not found'
-
-                self.storage_dict['filesDownloaded'] = files_downloaded
-
-            elif total_all_objs > 0 and recursive is True:
-                # print('directory found and recursive is True')
-                files_downloaded = []
-                for obj in all_objs:
-                    # print(obj.key)
-                    if os.path.basename(
-                            obj.key) != self.directory_marker_file_name and obj.key[-1] != '/':
-                        if self.massage_path(obj.key.replace(trimmed_source, '')).count('/') == 0:
-                            try:
-                                blob = self.s3_resource.Bucket(
-                                    self.container_name).download_file(
-                                    obj.key,
-                                    trimmed_destination + '/' + os.path.basename(
-                                        obj.key))
-                                # trimmedSource, trimmedDestination + '/' + os.path.basename(trimmedSource))
-                                # print('File downloaded')
-
-                                # make head call since file download does not return
-                                # obj dict to extract meta data
-                                metadata = self.s3_client.head_object(
-                                    Bucket=self.container_name, Key=obj.key)
-                                files_downloaded.append(self.extract_file_dict(obj.key, metadata))
-
-                                self.storage_dict[
-                                    'message'] = 'Source downloaded'
-                                #files_downloaded.append(obj.key)
-                            except FileNotFoundError as e:
-                                self.storage_dict[
-                                    'message'] = 'Destination not found'
-                        else:
-
-                            folder_path = self.massage_path(
-                                obj.key.replace(trimmed_source, '').replace(
-                                    os.path.basename(obj.key), '')
-                            )
-                            # print('folderPath  : '+folderPath)
-                            try:
-                                os.makedirs(
-                                    trimmed_destination + '/' + folder_path,
-                                    0o777)
-                                # os.chmod(trimmedDestination+'/'+folderPath, stat.S_IRWXO)
-                                x = 1
-                            except FileExistsError as e:
-                                # print('Error :')
-                                # print(e)
-                                os.chmod(trimmed_destination + '/' + folder_path,
-                                         stat.S_IRWXO)
-                                x = 1
-
-                            try:
-                                blob = self.s3_resource.Bucket(
-                                    self.container_name).download_file(
-                                    # obj.key, trimmedDestination + '/' + os.path.basename(obj.key))
-                                    obj.key,
-                                    trimmed_destination + '/' + folder_path + os.path.basename(
-                                        obj.key))
-                                # print('File downloaded')
-
-                                # make head call since file download does not return
-                                # obj dict to extract meta data
-                                metadata = self.s3_client.head_object(
-                                    Bucket=self.container_name, Key=obj.key)
-                                files_downloaded.append(self.extract_file_dict(obj.key, metadata))
-
-                                self.storage_dict[
-                                    'message'] = 'Source downloaded'
-                                #files_downloaded.append(obj.key)
-                            except FileNotFoundError as e:
-                                self.storage_dict[
-                                    'message'] = 'Destination not found'
+            self.storage_dict['filesDownloaded'] = files_downloaded
 
         self.storage_dict['objlist'] = files_downloaded
 
@@ -698,6 +987,102 @@ class Provider(StorageABC):
         #return self.storage_dict
         return dictObj
 
+    # function to download a list of (listed obj, filename) pairs with
+    # max_workers threads, the obj dicts are derived from the listing
+    def download_files(self, files, settings):
+        with ThreadPoolExecutor(
+                max_workers=settings['max_workers']) as executor:
+            downloads = [executor.submit(self.download_file, obj['Key'],
+                                         filename, settings,
+                                         size=obj['Size'], etag=obj['ETag'])
+                         for obj, filename in files]
+            for download in downloads:
+                download.result()
+        return [self.extract_object_dict(obj) for obj, filename in files]
+
+    # function to download a single object. Objects below the multipart
+    # threshold are read with a single GET, larger ones are split into
+    # multipart_chunksize byte ranges that max_concurrency threads write
+    # into a preallocated file. Finished ranges are recorded in a
+    # checkpoint file next to the destination so that an interrupted
+    # download continues where it stopped
+    def download_file(self, key, filename, settings, size=None, etag=None):
+        if size is None or etag is None:
+            metadata = self.s3_client.head_object(
+                Bucket=self.container_name, Key=key)
+            size = metadata['ContentLength']
+            etag = metadata['ETag']
+
+        if size < settings['multipart_threshold']:
+            response = self.s3_client.get_object(
+                Bucket=self.container_name, Key=key)
+            with open(filename, 'wb') as f:
+                for chunk in response['Body'].iter_chunks(DOWNLOAD_BUFFER):
+                    f.write(chunk)
+            return
+
+        chunksize = settings['multipart_chunksize']
+        checkpoint_file = filename + CHECKPOINT_SUFFIX
+        checkpoint = read_checkpoint(checkpoint_file)
+        if checkpoint is None or \
+                checkpoint['key'] != key or \
+                checkpoint['etag'] != etag or \
+                checkpoint['size'] != size or \
+                checkpoint['chunksize'] != chunksize or \
+                not os.path.isfile(filename):
+            checkpoint = {
+                'key': key,
+                'etag': etag,
+                'size': size,
+                'chunksize': chunksize,
+                'done': []
+            }
+            with open(filename, 'wb') as f:
+                f.truncate(size)
+            write_checkpoint(checkpoint_file, checkpoint)
+
+        done = set(checkpoint['done'])
+        parts = [part for part in range((size + chunksize - 1) // chunksize)
+                 if part not in done]
+
+        with ThreadPoolExecutor(
+                max_workers=settings['max_concurrency']) as executor:
+            ranges = {executor.submit(self.download_range, key, filename,
+                                      etag, part * chunksize,
+                                      min(size, (part + 1) * chunksize)): part
+                      for part in parts}
+            try:
+                for download in as_completed(ranges):
+                    download.result()
+                    checkpoint['done'].append(ranges[download])
+                    write_checkpoint(checkpoint_file, checkpoint)
+            except BaseException:
+                # the ranges that have not started are not fetched, the
+                # ones that finished in the meantime are recorded so that
+                # the next get() does not fetch them again
+                executor.shutdown(cancel_futures=True)
+                done = set(checkpoint['done'])
+                for download, part in ranges.items():
+                    if part not in done and not download.cancelled() and \
+                            download.exception() is None:
+                        checkpoint['done'].append(part)
+                write_checkpoint(checkpoint_file, checkpoint)
+                raise
+
+        os.remove(checkpoint_file)
+
+    # function to fetch the bytes start to end - 1 of an object and to write
+    # them at the same offset of filename. IfMatch makes sure all ranges
+    # come from the same version of the object
+    def download_range(self, key, filename, etag, start, end):
+        response = self.s3_client.get_object(
+            Bucket=self.container_name, Key=key, IfMatch=etag,
+            Range='bytes={start}-{end}'.format(start=start, end=end - 1))
+        with open(filename, 'r+b') as f:
+            f.seek(start)
+            for chunk in response['Body'].iter_chunks(DOWNLOAD_BUFFER):
+                f.write(chunk)
+
     # function to search a file or directory and list its attributes
     def search(self, service=None, directory=None, filename=None,
                recursive=False):
@@ -705,7 +1090,7 @@ class Provider(StorageABC):
         gets the destination and copies it in source
         :param service: the name of the service in the yaml file
         :param directory: the directory which either can be a directory or file
-        :param filename: filename
+        :param filename: filename, it may be a glob pattern such as *.txt
         :param recursive: in case of directory the recursive referes to all
                           subdirectories in the specified source
         :return: dict
@@ -716,56 +1101,7 @@ class Provider(StorageABC):
         self.storage_dict['filename'] = filename
         self.storage_dict['recursive'] = recursive
 
-        # filePath = self.joinFileNameDir(filename, directory)
-        file_path = ''
-        len_dir = len(self.massage_path(directory))
-        if len_dir > 0:
-            file_path = self.massage_path(directory) + '/' + filename
-        else:
-            file_path = filename
-
-        #print('file_path : ' +file_path )
-
-        info_list = []
-        objs = []
-
-        if (len_dir > 0) and recursive is False:
-            objs = list(
-                self.s3_resource.Bucket(self.container_name).objects.filter(
-                    Prefix=file_path))
-        elif (len_dir == 0) and recursive is False:
-            objs = list(
-                self.s3_resource.Bucket(self.container_name).objects.filter(
-                    Prefix=file_path))
-            # objs = list(self.s3_resource.Bucket(self.container_name).objects.all())
-        elif (len_dir > 0) and recursive is True:
-            objs = list(
-                self.s3_resource.Bucket(self.container_name).objects.filter(
-                    Prefix=self.massage_path(directory)))
-        elif (len_dir == 0) and recursive is True:
-            objs = list(
-                self.s3_resource.Bucket(self.container_name).objects.all())
-
-        if len(objs) > 0:
-            for obj in objs:
-                # if self.splitToList(obj.key)[-1] == filename:
-                if os.path.basename(obj.key) == filename:
-                    # print(obj.key)
-                    metadata = self.s3_client.head_object(
-                        Bucket=self.container_name, Key=obj.key)
-                    # print(metadata)
-                    info = {
-                        "fileName": obj.key,
-                        # "creationDate" : metadata['ResponseMetadata']['HTTPHeaders']['date'],
-                        "lastModificationDate":
-                            metadata['ResponseMetadata']['HTTPHeaders'][
-                                'last-modified'],
-                        "contentLength":
-                            metadata['ResponseMetadata']['HTTPHeaders'][
-                                'content-length']
-                    }
-                    # pprint(info)
-                    info_list.append(info)
+        info_list = list(self.find(directory, filename, recursive))
 
         self.storage_dict['objlist'] = info_list
 
@@ -778,3 +1114,43 @@ class Provider(StorageABC):
         dictObj = self.update_dict(self.storage_dict['objlist'])
         #return self.storage_dict
         return dictObj
+
+    # generator over the obj dicts of the files in directory whose name
+    # matches filename. The pages of the listing are matched as they
+    # arrive, so the first match is returned before the listing is
+    # complete. A pattern containing a '/' is matched against the path
+    # relative to the directory, otherwise against the basename
+    def find(self, directory=None, filename=None, recursive=False):
+        """
+        finds the files matching a name or glob pattern
+
+        :param directory: the directory to search in
+        :param filename: a filename or a glob pattern such as *.txt
+        :param recursive: if True subdirectories are searched as well
+        :return: iterator of dict
+        """
+        trimmed_directory = self.massage_path(directory)
+        if len(trimmed_directory) > 0:
+            trimmed_directory = trimmed_directory.rstrip('/') + '/'
+
+        by_path = '/' in filename
+        literal = glob_prefix(filename)
+
+        if recursive is False or by_path:
+            # the literal part of the pattern is part of every key that
+            # can match, so S3 filters on it
+            prefix = trimmed_directory + literal
+        else:
+            prefix = trimmed_directory
+        delimiter = None if recursive else '/'
+
+        for page in self.list_pages(prefix, delimiter=delimiter):
+            for obj in page.get('Contents', []):
+                if not self.is_listed_file(obj['Key']):
+                    continue
+                if by_path:
+                    name = obj['Key'][len(trimmed_directory):]
+                else:
+                    name = os.path.basename(obj['Key'])
+                if fnmatch.fnmatchcase(name, filename):
+                    yield self.extract_object_dict(obj)
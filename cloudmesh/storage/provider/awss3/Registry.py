@@ -0,0 +1,105 @@
+import threading
+
+import boto3
+import botocore.config
+
+
+class Registry(object):
+    """
+        Process wide registry of boto3 sessions and S3 clients.
+
+        Creating a client resolves endpoints and parses the service
+        models, which takes tens of milliseconds, and a new client starts
+        with an empty connection pool. All providers that use the same
+        credentials, region and pool size therefore share one client.
+        Clients are thread safe and are shared between threads, resources
+        are not and are kept per thread.
+    """
+
+    lock = threading.Lock()
+    sessions = {}
+    clients = {}
+    local = threading.local()
+
+    @classmethod
+    def key(cls, access_key_id, secret_access_key, region,
+            max_pool_connections):
+        return (access_key_id, secret_access_key, region,
+                max_pool_connections)
+
+    @classmethod
+    def session(cls, access_key_id, secret_access_key, region):
+        key = (access_key_id, secret_access_key, region)
+        with cls.lock:
+            if key not in cls.sessions:
+                cls.sessions[key] = boto3.session.Session(
+                    aws_access_key_id=access_key_id,
+                    aws_secret_access_key=secret_access_key,
+                    region_name=region)
+            return cls.sessions[key]
+
+    @classmethod
+    def client(cls, access_key_id=None, secret_access_key=None, region=None,
+               max_pool_connections=10):
+        """
+        returns the shared S3 client, it is created on first use
+
+        :param access_key_id: the aws access key id
+        :param secret_access_key: the aws secret access key
+        :param region: the region of the bucket
+        :param max_pool_connections: the size of the connection pool
+        :return: botocore client
+        """
+        key = cls.key(access_key_id, secret_access_key, region,
+                      max_pool_connections)
+        client = cls.clients.get(key)
+        if client is None:
+            session = cls.session(access_key_id, secret_access_key, region)
+            with cls.lock:
+                if key not in cls.clients:
+                    # the session is not thread safe, creating the
+                    # client is therefore done while holding the lock
+                    cls.clients[key] = session.client(
+                        's3',
+                        config=botocore.config.Config(
+                            max_pool_connections=max_pool_connections))
+                client = cls.clients[key]
+        return client
+
+    @classmethod
+    def resource(cls, access_key_id=None, secret_access_key=None,
+                 region=None, max_pool_connections=10):
+        """
+        returns the S3 resource of the calling thread, it is created on
+        first use
+
+        :param access_key_id: the aws access key id
+        :param secret_access_key: the aws secret access key
+        :param region: the region of the bucket
+        :param max_pool_connections: the size of the connection pool
+        :return: boto3 resource
+        """
+        key = cls.key(access_key_id, secret_access_key, region,
+                      max_pool_connections)
+        if not hasattr(cls.local, 'resources'):
+            cls.local.resources = {}
+        resource = cls.local.resources.get(key)
+        if resource is None:
+            session = cls.session(access_key_id, secret_access_key, region)
+            with cls.lock:
+                resource = session.resource(
+                    's3',
+                    config=botocore.config.Config(
+                        max_pool_connections=max_pool_connections))
+            cls.local.resources[key] = resource
+        return resource
+
+    @classmethod
+    def clear(cls):
+        """
+        removes all sessions and clients from the registry
+        """
+        with cls.lock:
+            cls.sessions.clear()
+            cls.clients.clear()
+        cls.local.resources = {}
@@ -0,0 +1,131 @@
+import io
+from collections import OrderedDict
+
+
+class RemoteFile(io.RawIOBase):
+    """
+        Seekable read only file object for an S3 object.
+
+        Only the bytes that are read are fetched with ranged GET requests.
+        The object is divided into blocks of block_size bytes and the
+        last cache_blocks blocks are kept in memory. When blocks are read
+        one after another the next readahead blocks are fetched with the
+        same request.
+
+        Example:
+
+            with provider.open('/data/file.parquet') as f:
+                f.seek(-8, os.SEEK_END)
+                footer = f.read(8)
+    """
+
+    def __init__(self, provider, key, size, etag=None, block_size=1024 ** 2,
+                 cache_blocks=16, readahead=4):
+        super().__init__()
+        self.provider = provider
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.block_size = block_size
+        self.cache_blocks = max(cache_blocks, readahead + 1)
+        self.readahead = readahead
+        self.position = 0
+        self.cache = OrderedDict()
+        self.last_block = None
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("invalid whence {whence}".format(whence=whence))
+        if position < 0:
+            raise ValueError("negative seek position {position}".format(
+                position=position))
+        self.position = position
+        return self.position
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+
+        data = bytearray()
+        while self.position < end:
+            block = self.position // self.block_size
+            start = self.position - block * self.block_size
+            chunk = self.block(block)[start:start + end - self.position]
+            data.extend(chunk)
+            self.position += len(chunk)
+        return bytes(data)
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def block(self, index):
+        """
+        returns the content of a block from the cache or from S3
+
+        :param index: the number of the block
+        :return: bytes
+        """
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            self.last_block = index
+            return self.cache[index]
+
+        last = index
+        if self.last_block is not None and index == self.last_block + 1:
+            # sequential access, fetch the following blocks as well
+            blocks = (self.size + self.block_size - 1) // self.block_size
+            last = min(index + self.readahead, blocks - 1)
+            while last > index and last in self.cache:
+                last -= 1
+
+        start = index * self.block_size
+        end = min((last + 1) * self.block_size, self.size)
+        data = self.provider.read_range(self.key, start, end - start,
+                                        etag=self.etag)
+        self.requests += 1
+        if len(data) != end - start:
+            raise IOError("{key}: expected {expected} bytes at offset "
+                          "{start}, got {got}".format(key=self.key,
+                                                      expected=end - start,
+                                                      start=start,
+                                                      got=len(data)))
+
+        for i in range(index, last + 1):
+            offset = (i - index) * self.block_size
+            self.cache[i] = data[offset:offset + self.block_size]
+            self.cache.move_to_end(i)
+        while len(self.cache) > self.cache_blocks:
+            self.cache.popitem(last=False)
+
+        self.last_block = index
+        return self.cache[index]
+
+    def close(self):
+        self.cache.clear()
+        super().close()
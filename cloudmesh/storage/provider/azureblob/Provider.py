@@ -1,25 +1,175 @@
+import base64
+import copy
+import hashlib
 import os
-import re
+import threading
+import time
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from pprint import pprint
 
+from azure.common import AzureException
+from azure.common import AzureMissingResourceHttpError
 from azure.storage.blob import BlockBlobService
+from azure.storage.blob.models import BlobBlock
+from azure.storage.blob.models import BlobPrefix
+from azure.storage.blob.models import ContentSettings
 from cloudmesh.common.console import Console
 from cloudmesh.common.util import HEADING
 from cloudmesh.common.util import path_expand
 from cloudmesh.storage.StorageABC import StorageABC
+from cloudmesh.storage.util import checkpoint_path
+from cloudmesh.storage.util import merge_settings
+from cloudmesh.storage.util import raise_failed
+from cloudmesh.storage.util import read_checkpoint
+from cloudmesh.storage.util import size_in_bytes
+from cloudmesh.storage.util import write_checkpoint
+
+#
+# The transfer settings can be set in the yaml file of the service
+#
+# cloudmesh:
+#   storage:
+#     azureblob:
+#       transfer:
+#         block_size: 4MB
+#         single_put_size: 64MB
+#         single_get_size: 32MB
+#         max_connections: 2
+#         max_workers: 8
+#         delete_workers: 32
+#
+# Blobs larger than single_put_size are uploaded in blocks of block_size
+# bytes, blobs larger than single_get_size are downloaded in ranges.
+# max_connections is the number of connections used for the blocks or
+# ranges of a single blob and max_workers is the number of files that
+# are transferred at the same time. Folders are deleted in batches of
+# DELETE_BATCH blobs by delete_workers threads.
+#
+TRANSFER_DEFAULTS = {
+    'block_size': 4 * 1024 ** 2,
+    'single_put_size': 64 * 1024 ** 2,
+    'single_get_size': 32 * 1024 ** 2,
+    'max_connections': 2,
+    'max_workers': 8,
+    'delete_workers': 32
+}
+
+DELETE_BATCH = 256
+
+#
+# The properties of blobs are cached for cache_ttl seconds, the cache
+# holds at most CACHE_SIZE blobs
+#
+# cloudmesh:
+#   storage:
+#     azureblob:
+#       cache_ttl: 60
+#
+CACHE_TTL = 60
+CACHE_SIZE = 10000
+
+#
+# Large blobs are transferred with checkpoints. An upload records the
+# blocks the service has received in a file in CHECKPOINT_DIR, a
+# download records the number of bytes written in a file next to the
+# destination. An interrupted transfer continues from the checkpoint.
+# Downloads are read in ranges of RANGE_SIZE bytes, the service returns
+# the MD5 of ranges up to 4MB.
+#
+CHECKPOINT_DIR = '~/.cloudmesh/azureblob'
+UPLOAD_CHECKPOINT = '.cmupload'
+DOWNLOAD_CHECKPOINT = '.cmdownload'
+RANGE_SIZE = 4 * 1024 ** 2
+MAX_BLOCKS = 50000
 
 
 class Provider(StorageABC):
 
     def __init__(self, service=None, config="~/.cloudmesh/cloudmesh4.yaml"):
         super().__init__(service=service, config=config)
-        self.storage_service = BlockBlobService(
-            account_name=self.credentials['account_name'],
-            account_key=self.credentials['account_key'])
+        if 'connection_string' in self.credentials:
+            # e.g. to use the Azurite emulator
+            self.storage_service = BlockBlobService(
+                connection_string=self.credentials['connection_string'])
+        else:
+            self.storage_service = BlockBlobService(
+                account_name=self.credentials['account_name'],
+                account_key=self.credentials['account_key'])
         self.container = self.credentials['container']
         self.cloud = service
         self.service = service
 
+        spec = self.config["cloudmesh.storage"][service]
+        self.transfer = merge_settings(TRANSFER_DEFAULTS, spec.get('transfer'))
+        for key in ['block_size', 'single_put_size', 'single_get_size']:
+            self.transfer[key] = size_in_bytes(self.transfer[key])
+        # the block sizes are attributes of the blob service
+        self.storage_service.MAX_BLOCK_SIZE = self.transfer['block_size']
+        self.storage_service.MAX_SINGLE_PUT_SIZE = \
+            self.transfer['single_put_size']
+        self.storage_service.MAX_SINGLE_GET_SIZE = \
+            self.transfer['single_get_size']
+
+        self.cache_ttl = spec.get('cache_ttl', CACHE_TTL)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.cache_hits = 0
+        self.storage_service.request_callback = self.count_request
+
+    def count_request(self, request):
+        # Internal callback of the blob service, counts the requests
+        with self.lock:
+            self.requests += 1
+
+    def reset_counters(self):
+        """
+        sets the request and cache hit counters to zero
+        """
+        with self.lock:
+            self.requests = 0
+            self.cache_hits = 0
+
+    def blob_properties(self, blob_name):
+        # Internal function to get the properties of a blob, None if the
+        # blob does not exist. The answer is cached, so that cloud_path
+        # and the operation that follows it share a single request. A
+        # copy is returned as update_dict modifies its elements
+        if blob_name == '':
+            return None
+        with self.lock:
+            if blob_name in self.cache:
+                cached, blob = self.cache[blob_name]
+                if time.monotonic() - cached < self.cache_ttl:
+                    self.cache.move_to_end(blob_name)
+                    self.cache_hits += 1
+                    return copy.deepcopy(blob)
+        try:
+            blob = self.storage_service.get_blob_properties(self.container,
+                                                            blob_name)
+        except AzureMissingResourceHttpError:
+            blob = None
+        self.cache_blob(blob_name, blob)
+        return copy.deepcopy(blob)
+
+    def cache_blob(self, blob_name, blob):
+        # Internal function to cache the properties of a blob, None
+        # records that the blob does not exist
+        with self.lock:
+            self.cache[blob_name] = (time.monotonic(), copy.deepcopy(blob))
+            self.cache.move_to_end(blob_name)
+            while len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+    def invalidate(self, blob_name):
+        # Internal function to remove a blob that this process changed
+        # from the cache
+        with self.lock:
+            self.cache.pop(blob_name, None)
+
     def update_dict(self, elements, kind=None):
         # this is an internal function for building dict object
         d = []
@@ -55,7 +205,7 @@ class Provider(StorageABC):
         src_file = srv_path
         if srv_path.startswith('/'):
             src_file = srv_path[1:]
-        if self.storage_service.exists(self.container, src_file):
+        if self.blob_properties(src_file) is not None:
             b_file = os.path.basename(srv_path)
             if srv_path.startswith('/'):
                 b_folder = os.path.dirname(src_file)
@@ -66,13 +216,33 @@ class Provider(StorageABC):
                 b_file = os.path.basename(srv_path)
         return b_file, b_folder
 
+    def blob_prefix(self, blob_folder):
+        # Internal function to determine the listing prefix of a folder
+        if blob_folder is None or blob_folder.strip('/') == '':
+            return ''
+        return blob_folder.strip('/') + '/'
+
+    def list_folder(self, blob_folder, recursive=False):
+        # Internal generator over the blobs of a folder. The service filters
+        # by prefix and the next page is only requested when the previous
+        # one is consumed. Without recursive the delimiter folds the content
+        # of subfolders into a single BlobPrefix entry per subfolder
+        delimiter = None if recursive else '/'
+        for blob in self.storage_service.list_blobs(
+                self.container, prefix=self.blob_prefix(blob_folder),
+                delimiter=delimiter):
+            if not isinstance(blob, BlobPrefix):
+                self.cache_blob(blob.name, blob)
+            yield blob
+
     def local_path(self, source_path):
         src_path = path_expand(source_path)
         if src_path[0] not in [".", "/", "~"]:
             src_path = os.path.join(os.getcwd(), source_path)
         return src_path
 
-    def get(self, service=None, source=None, destination=None, recursive=False):
+    def get(self, service=None, source=None, destination=None, recursive=False,
+            keep_structure=False):
         """
         Downloads file from Destination(Service) to Source(local)
 
@@ -80,6 +250,9 @@ class Provider(StorageABC):
         :param destination: the destination can be a directory or file
         :param recursive: in case of directory the recursive refers to all
                           subdirectories in the specified source
+        :param keep_structure: in case of a recursive directory download the
+                               subdirectories are recreated in the source,
+                               otherwise all files are placed in the source
         :return: dict
 
         """
@@ -101,26 +274,22 @@ class Provider(StorageABC):
             if blob_folder is None:
                 # file only specified
                 if not recursive:
-                    if self.storage_service.exists(self.container, blob_file):
+                    if self.blob_properties(blob_file) is not None:
                         download_path = os.path.join(src_path, blob_file)
                         obj_list.append(
-                            self.storage_service.get_blob_to_path(self.container,
-                                                          blob_file,
-                                                          download_path))
+                            self.download_file(blob_file, download_path))
                     else:
                         return Console.error(
                             "File does not exist: {file}".format(
                                 file=blob_file))
                 else:
                     file_found = False
-                    get_gen = self.storage_service.list_blobs(self.container)
+                    get_gen = self.list_folder(None, recursive=True)
                     for blob in get_gen:
                         if os.path.basename(blob.name) == blob_file:
                             download_path = os.path.join(src_path, blob_file)
                             obj_list.append(
-                                self.storage_service.get_blob_to_path(self.container,
-                                                              blob.name,
-                                                              download_path))
+                                self.download_file(blob.name, download_path))
                             file_found = True
                     if not file_found:
                         return Console.error(
@@ -130,46 +299,26 @@ class Provider(StorageABC):
                 if blob_file is None:
                     # Folder only specified
                     if not recursive:
-                        file_found = False
-                        get_gen = self.storage_service.list_blobs(self.container)
-                        for blob in get_gen:
-                            if os.path.dirname(blob.name) == blob_folder:
-                                download_path = os.path.join(src_path,
-                                                             os.path.basename(
-                                                                 blob.name))
-                                obj_list.append(self.storage_service.get_blob_to_path(
-                                    self.container, blob.name, download_path))
-                                file_found = True
-                        if not file_found:
-                            return Console.error(
-                                "Directory does not exist: {directory}".format(
-                                    directory=blob_folder))
+                        get_gen = (blob for blob in self.list_folder(blob_folder)
+                                   if not isinstance(blob, BlobPrefix))
                     else:
-                        file_found = False
-                        srch_gen = self.storage_service.list_blobs(self.container)
-                        for blob in srch_gen:
-                            if (os.path.dirname(blob.name) == blob_folder) or \
-                                (os.path.commonpath([blob.name,
-                                                     blob_folder]) == blob_folder):
-                                download_path = os.path.join(src_path,
-                                                             os.path.basename(
-                                                                 blob.name))
-                                obj_list.append(self.storage_service.get_blob_to_path(
-                                    self.container, blob.name, download_path))
-                                file_found = True
-                        if not file_found:
-                            return Console.error(
-                                "Directory does not exist: {directory}".format(
-                                    directory=blob_folder))
+                        get_gen = self.list_folder(blob_folder,
+                                                   recursive=True)
+                    obj_list = self.download_files(
+                        get_gen, src_path, self.blob_prefix(blob_folder),
+                        keep_structure=keep_structure)
+                    if len(obj_list) == 0:
+                        return Console.error(
+                            "Directory does not exist: {directory}".format(
+                                directory=blob_folder))
                 else:
                     # SOURCE is specified with Directory and file
                     if not recursive:
-                        if self.storage_service.exists(self.container, destination[1:]):
+                        if self.blob_properties(destination[1:]) is not None:
                             download_path = os.path.join(src_path, blob_file)
                             obj_list.append(
-                                self.storage_service.get_blob_to_path(self.container,
-                                                              destination[1:],
-                                                              download_path))
+                                self.download_file(destination[1:],
+                                                   download_path))
                         else:
                             return Console.error(
                                 "File does not exist: {file}".format(
@@ -181,6 +330,127 @@ class Provider(StorageABC):
         pprint(dict_obj)
         return dict_obj
 
+    def download_files(self, blobs, src_path, prefix, keep_structure=False):
+        # Internal function to download the blobs with max_workers threads.
+        # The downloads are submitted while the listing is read, so the
+        # first files are transferred before the last page is listed.
+        # Without keep_structure a/x.txt and b/x.txt have the same
+        # download path, they are downloaded one after another in the
+        # order of the listing so that the last one is kept
+        with ThreadPoolExecutor(
+                max_workers=self.transfer['max_workers']) as executor:
+            downloads = []
+            last = {}
+            for blob in blobs:
+                if keep_structure:
+                    download_path = os.path.join(
+                        src_path, *blob.name[len(prefix):].split('/'))
+                else:
+                    download_path = os.path.join(src_path,
+                                                 os.path.basename(blob.name))
+                previous = last.get(download_path)
+                if previous is None:
+                    download = executor.submit(self.download_file,
+                                               blob.name, download_path)
+                else:
+                    download = executor.submit(self.download_after, previous,
+                                               blob.name, download_path)
+                last[download_path] = download
+                downloads.append(download)
+            return [download.result() for download in downloads]
+
+    def download_after(self, previous, blob_name, download_path):
+        # Internal function to download a blob once the download of
+        # another blob to the same path has finished. The previous
+        # download was submitted first, so it already has a thread
+        wait([previous])
+        return self.download_file(blob_name, download_path)
+
+    def download_file(self, blob_name, download_path):
+        # Internal function to download a single blob, blobs larger than
+        # single_get_size are read as ranges over max_connections
+        # connections
+        os.makedirs(os.path.dirname(download_path), exist_ok=True)
+        blob = self.blob_properties(blob_name)
+        if blob is not None and \
+                blob.properties.content_length > \
+                self.transfer['single_get_size']:
+            self.download_ranges(blob, download_path)
+            return blob
+        blob = self.storage_service.get_blob_to_path(
+            self.container, blob_name, download_path,
+            max_connections=self.transfer['max_connections'])
+        self.cache_blob(blob_name, blob)
+        return blob
+
+    def download_ranges(self, blob, download_path):
+        # Internal function to download a large blob in ranges. The ranges
+        # are read by max_connections threads and written in order, so
+        # the MD5 of the blob is computed while the data arrives and the
+        # checkpoint only needs the number of bytes written
+        size = blob.properties.content_length
+        etag = blob.properties.etag
+        checkpoint_file = download_path + DOWNLOAD_CHECKPOINT
+        checkpoint = read_checkpoint(checkpoint_file)
+        md5 = hashlib.md5()
+
+        if checkpoint is not None and checkpoint.get('etag') == etag and \
+                os.path.isfile(download_path):
+            # continue the download, the bytes already written are read
+            # once to restore the MD5
+            offset = checkpoint['offset']
+            with open(download_path, 'r+b') as f:
+                f.truncate(offset)
+                for data in iter(lambda: f.read(RANGE_SIZE), b''):
+                    md5.update(data)
+        else:
+            offset = 0
+            open(download_path, 'wb').close()
+
+        max_connections = self.transfer['max_connections']
+        with open(download_path, 'r+b') as f, ThreadPoolExecutor(
+                max_workers=max_connections) as executor:
+            f.seek(offset)
+            pending = deque()
+            for start in range(offset, size, RANGE_SIZE):
+                pending.append(executor.submit(
+                    self.read_range, blob.name, start,
+                    min(RANGE_SIZE, size - start), etag))
+                if len(pending) < max_connections:
+                    continue
+                offset = self.write_range(f, pending.popleft().result(),
+                                          md5, offset, checkpoint_file, etag)
+            while pending:
+                offset = self.write_range(f, pending.popleft().result(),
+                                          md5, offset, checkpoint_file, etag)
+
+        os.remove(checkpoint_file)
+        content_md5 = blob.properties.content_settings.content_md5
+        if content_md5 is not None and \
+                base64.b64encode(md5.digest()).decode() != content_md5:
+            os.remove(download_path)
+            raise ValueError(
+                "Content-MD5 mismatch: {blob}".format(blob=blob.name))
+
+    def read_range(self, blob_name, start, length, etag):
+        # Internal function to read length bytes at start of a blob,
+        # if_match makes sure all ranges come from the same version and
+        # validate_content checks the MD5 of the range
+        return self.storage_service.get_blob_to_bytes(
+            self.container, blob_name, start_range=start,
+            end_range=start + length - 1, if_match=etag,
+            validate_content=True).content
+
+    def write_range(self, f, data, md5, offset, checkpoint_file, etag):
+        # Internal function to append a range to the download and to
+        # record it in the checkpoint
+        f.write(data)
+        f.flush()
+        md5.update(data)
+        offset += len(data)
+        write_checkpoint(checkpoint_file, {'etag': etag, 'offset': offset})
+        return offset
+
     def put(self, service=None, source=None, destination=None, recursive=False):
         """
         Uploads file from Source(local) to Destination(Service)
@@ -195,7 +465,7 @@ class Provider(StorageABC):
 
         HEADING()
         # Determine service path - file or folder
-        if self.storage_service.exists(self.container, destination[1:]):
+        if self.blob_properties(destination[1:]) is not None:
             return Console.error("Directory does not exist: {directory}".format(
                 directory=destination))
         else:
@@ -206,55 +476,30 @@ class Provider(StorageABC):
         src_path = self.local_path(source)
 
         if os.path.isdir(src_path) or os.path.isfile(src_path):
-            dict_obj = []
             if os.path.isfile(src_path):
                 # File only specified
-                upl_path = src_path
                 if blob_folder == '':
                     upl_file = os.path.basename(src_path)
                 else:
                     upl_file = blob_folder + '/' + os.path.basename(src_path)
-                obj = self.storage_service.create_blob_from_path(self.container,
-                                                         upl_file, upl_path)
-                # Build dict object here with local file properties
-                entry = obj.__dict__
-                entry["cm"] = {}
-                entry["cm"]["kind"] = "storage"
-                entry["cm"]["cloud"] = self.cloud
-                entry["cm"]["name"] = upl_file
-                entry["cm"]["created"] = obj.last_modified.isoformat()
-                entry["cm"]["updated"] = obj.last_modified.isoformat()
-                entry["cm"]["size"] = os.stat(upl_path).st_size
-                del obj.last_modified
-                dict_obj.append(entry)
+                files = [(src_path, upl_file)]
             else:
-                # Folder only specified - Upload all files from folder
+                # Folder only specified - Upload all files from folder and
+                # its subfolders
                 if recursive:
-                    for file in os.listdir(src_path):
-                        if os.path.isfile(os.path.join(src_path, file)):
-                            upl_path = os.path.join(src_path, file)
-                            if blob_folder == '':
-                                upl_file = file
-                            else:
-                                upl_file = blob_folder + '/' + file
-                            obj = self.storage_service.create_blob_from_path(
-                                self.container, upl_file, upl_path)
-                            # Build dict object here with local file properties
-                            entry = obj.__dict__
-                            entry["cm"] = {}
-                            entry["cm"]["kind"] = "storage"
-                            entry["cm"]["cloud"] = self.cloud
-                            entry["cm"]["name"] = upl_file
-                            entry["cm"][
-                                "created"] = obj.last_modified.isoformat()
-                            entry["cm"][
-                                "updated"] = obj.last_modified.isoformat()
-                            entry["cm"]["size"] = os.stat(upl_path).st_size
-                            del obj.last_modified
-                            dict_obj.append(entry)
+                    files = []
+                    for upl_path in self.walk(src_path):
+                        rel_path = os.path.relpath(upl_path, src_path).replace(
+                            os.sep, '/')
+                        if blob_folder == '':
+                            upl_file = rel_path
+                        else:
+                            upl_file = blob_folder + '/' + rel_path
+                        files.append((upl_path, upl_file))
                 else:
                     return Console.error(
                         "Source is a folder, recursive expected in arguments")
+            dict_obj = self.upload_files(files)
         else:
             return Console.error(
                 "Directory or File does not exist: {directory}".format(
@@ -262,6 +507,127 @@ class Provider(StorageABC):
         pprint(dict_obj)
         return dict_obj
 
+    def walk(self, path):
+        # Internal generator over all files below path
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.walk(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+
+    def upload_files(self, files):
+        # Internal function to upload (local path, blob name) pairs with
+        # max_workers threads, each blob is uploaded in blocks of
+        # block_size bytes over max_connections connections
+        with ThreadPoolExecutor(
+                max_workers=self.transfer['max_workers']) as executor:
+            uploads = [executor.submit(self.upload_file, upl_path, upl_file)
+                       for upl_path, upl_file in files]
+            return [upload.result() for upload in uploads]
+
+    def upload_file(self, upl_path, upl_file):
+        # Internal function to upload a single file, the dict object is
+        # built from the local file properties and the transfer time
+        start = time.perf_counter()
+        size = os.stat(upl_path).st_size
+        if size > self.transfer['single_put_size']:
+            obj = self.upload_blocks(upl_path, upl_file)
+        else:
+            obj = self.storage_service.create_blob_from_path(
+                self.container, upl_file, upl_path,
+                max_connections=self.transfer['max_connections'])
+        seconds = time.perf_counter() - start
+        self.invalidate(upl_file)
+
+        entry = obj.__dict__
+        entry["cm"] = {}
+        entry["cm"]["kind"] = "storage"
+        entry["cm"]["cloud"] = self.cloud
+        entry["cm"]["name"] = upl_file
+        entry["cm"]["created"] = obj.last_modified.isoformat()
+        entry["cm"]["updated"] = obj.last_modified.isoformat()
+        entry["cm"]["size"] = size
+        entry["cm"]["seconds"] = seconds
+        # bytes per second
+        entry["cm"]["throughput"] = size / seconds if seconds > 0 else None
+        del obj.last_modified
+        return entry
+
+    def upload_blocks(self, upl_path, upl_file):
+        # Internal function to upload a large file in blocks of block_size
+        # bytes with max_connections threads. The file is read once, the
+        # MD5 of the whole file is computed while reading and stored as
+        # Content-MD5 when the block list is committed. Each block that
+        # the service received is appended to the checkpoint, a restart
+        # only sends the blocks that are missing
+        stat = os.stat(upl_path)
+        block_size = self.transfer['block_size']
+        if (stat.st_size + block_size - 1) // block_size > MAX_BLOCKS:
+            raise ValueError(
+                "{file} needs more than {n} blocks, increase the "
+                "block_size".format(file=upl_path, n=MAX_BLOCKS))
+
+        source = {'container': self.container, 'blob': upl_file,
+                  'file': os.path.abspath(upl_path), 'size': stat.st_size,
+                  'mtime': stat.st_mtime, 'block_size': block_size}
+        checkpoint_file = checkpoint_path(CHECKPOINT_DIR, source,
+                                          UPLOAD_CHECKPOINT)
+
+        done = set()
+        if os.path.isfile(checkpoint_file):
+            with open(checkpoint_file) as f:
+                recorded = {line.strip() for line in f}
+            try:
+                # uncommitted blocks are kept by the service for a week
+                block_list = self.storage_service.get_block_list(
+                    self.container, upl_file, block_list_type='uncommitted')
+                done = recorded & {block.id for block in
+                                   block_list.uncommitted_blocks}
+            except AzureMissingResourceHttpError:
+                pass
+
+        max_connections = self.transfer['max_connections']
+        in_flight = threading.BoundedSemaphore(max_connections)
+        lock = threading.Lock()
+
+        def put_block(block_id, data):
+            try:
+                self.storage_service.put_block(self.container, upl_file,
+                                               data, block_id,
+                                               validate_content=True)
+                with lock, open(checkpoint_file, 'a') as f:
+                    f.write(block_id + '\n')
+            finally:
+                in_flight.release()
+
+        md5 = hashlib.md5()
+        block_ids = []
+        uploads = []
+        pending = set()
+        with open(upl_path, 'rb') as f, ThreadPoolExecutor(
+                max_workers=max_connections) as executor:
+            for data in iter(lambda: f.read(block_size), b''):
+                md5.update(data)
+                block_id = '{index:08d}'.format(index=len(block_ids))
+                block_ids.append(block_id)
+                if block_id in done:
+                    continue
+                in_flight.acquire()
+                uploads.append(executor.submit(put_block, block_id, data))
+                # fail early instead of reading the whole file
+                pending = raise_failed(pending | {uploads[-1]})
+            for upload in uploads:
+                upload.result()
+
+        obj = self.storage_service.put_block_list(
+            self.container, upl_file,
+            [BlobBlock(id=block_id) for block_id in block_ids],
+            content_settings=ContentSettings(
+                content_md5=base64.b64encode(md5.digest()).decode()))
+        os.remove(checkpoint_file)
+        return obj
+
     def delete(self, service=None, source=None, recursive=False):
         """
         Deletes the source from cloud service
@@ -279,34 +645,39 @@ class Provider(StorageABC):
         obj_list = []
         if blob_folder is None:
             # SOURCE specified is File only
-            if self.storage_service.exists(self.container, blob_file):
-                blob_prop = self.storage_service.get_blob_properties(self.container,
-                                                             blob_file)
+            blob_prop = self.blob_properties(blob_file)
+            if blob_prop is not None:
                 obj_list.append(blob_prop)
                 self.storage_service.delete_blob(self.container, blob_file)
+                self.invalidate(blob_file)
             else:
                 return Console.error(
                     "File does not exist: {file}".format(file=blob_file))
         else:
             if blob_file is None:
                 # SOURCE specified is Folder only
-                del_gen = self.storage_service.list_blobs(self.container)
-                file_del = False
-                for blob in del_gen:
-                    if os.path.commonpath([blob.name, blob_folder]) == blob_folder:
-                        obj_list.append(blob)
-                        self.storage_service.delete_blob(self.container, blob.name)
-                        file_del = True
-                if not file_del:
+                del_gen = self.list_folder(blob_folder, recursive=True)
+                obj_list, errors = self.delete_blobs(del_gen)
+                if len(obj_list) == 0:
                     return Console.error(
                         "File does not exist: {file}".format(file=blob_folder))
+                dict_obj = self.update_dict(obj_list)
+                for entry in dict_obj:
+                    if entry["cm"]["name"] in errors:
+                        entry["cm"]["error"] = errors[entry["cm"]["name"]]
+                        Console.error(
+                            "File not deleted: {file}: {error}".format(
+                                file=entry["cm"]["name"],
+                                error=entry["cm"]["error"]))
+                pprint(dict_obj)
+                return dict_obj
             else:
                 # Source specified is both file and directory
-                if self.storage_service.exists(self.container, source[1:]):
-                    blob_prop = self.storage_service.get_blob_properties(self.container,
-                                                                 source[1:])
+                blob_prop = self.blob_properties(source[1:])
+                if blob_prop is not None:
                     obj_list.append(blob_prop)
                     self.storage_service.delete_blob(self.container, source[1:])
+                    self.invalidate(source[1:])
                 else:
                     return Console.error(
                         "File does not exist: {file}".format(file=blob_file))
@@ -314,6 +685,40 @@ class Provider(StorageABC):
         pprint(dict_obj)
         return dict_obj
 
+    def delete_blobs(self, blobs):
+        # Internal function to delete the blobs in batches of DELETE_BATCH
+        # blobs. The batches are submitted while the listing is read and
+        # delete_workers threads delete the blobs of the batches, a failed
+        # blob does not stop the other deletes
+        def delete_batch(batch):
+            errors = {}
+            for blob in batch:
+                try:
+                    self.storage_service.delete_blob(self.container,
+                                                     blob.name)
+                except AzureException as e:
+                    errors[blob.name] = str(e)
+                self.invalidate(blob.name)
+            return errors
+
+        obj_list = []
+        errors = {}
+        with ThreadPoolExecutor(
+                max_workers=self.transfer['delete_workers']) as executor:
+            deletes = []
+            batch = []
+            for blob in blobs:
+                obj_list.append(blob)
+                batch.append(blob)
+                if len(batch) == DELETE_BATCH:
+                    deletes.append(executor.submit(delete_batch, batch))
+                    batch = []
+            if len(batch) > 0:
+                deletes.append(executor.submit(delete_batch, batch))
+            for delete in deletes:
+                errors.update(delete.result())
+        return obj_list, errors
+
     def create_dir(self, service=None, directory=None):
         """
         Creates a directory in the cloud service
@@ -329,6 +734,7 @@ class Provider(StorageABC):
             data = b' '
             blob_name = directory[1:] + '/dummy.txt'
             self.storage_service.create_blob_from_bytes(self.container, blob_name, data)
+            self.invalidate(blob_name)
             blob_cre.append(
                 self.storage_service.get_blob_to_bytes(self.container, blob_name))
             dict_obj = self.update_dict(blob_cre)
@@ -349,30 +755,22 @@ class Provider(StorageABC):
         """
 
         HEADING()
-        srch_gen = self.storage_service.list_blobs(self.container)
         obj_list = []
         if not recursive:
             srch_file = os.path.join(directory[1:], filename)
-            file_found = False
-            for blob in srch_gen:
-                if blob.name == srch_file:
-                    obj_list.append(blob)
-                    file_found = True
-            if not file_found:
+            blob_prop = self.blob_properties(srch_file)
+            if blob_prop is not None:
+                obj_list.append(blob_prop)
+            else:
                 return Console.error(
                     "File does not exist: {file}".format(file=srch_file))
         else:
             file_found = False
+            srch_gen = self.list_folder(directory[1:], recursive=True)
             for blob in srch_gen:
-                if re.search('/', blob.name) is not None:
-                    if os.path.basename(blob.name) == filename:
-                        if os.path.commonpath([blob.name, directory[1:]]) == directory[1:]:
-                            obj_list.append(blob)
-                            file_found = True
-                else:
-                    if blob.name == os.path.join(directory[1:], filename):
-                        obj_list.append(blob)
-                        file_found = True
+                if os.path.basename(blob.name) == filename:
+                    obj_list.append(blob)
+                    file_found = True
             if not file_found:
                 return Console.error(
                     "File does not exist: {file}".format(file=filename))
@@ -403,18 +801,15 @@ class Provider(StorageABC):
         if blob_folder is None:
             # SOURCE specified is File only
             if not recursive:
-                if self.storage_service.exists(self.container, blob_file):
-                    blob_prop = self.storage_service.get_blob_properties(self.container,
-                                                                 blob_file)
-                    blob_size = self.storage_service.get_blob_properties(self.container,
-                                                                 blob_file).properties.content_length
+                blob_prop = self.blob_properties(blob_file)
+                if blob_prop is not None:
                     obj_list.append(blob_prop)
                 else:
                     return Console.error(
                         "File does not exist: {file}".format(file=blob_file))
             else:
                 file_found = False
-                srch_gen = self.storage_service.list_blobs(self.container)
+                srch_gen = self.list_folder(None, recursive=True)
                 for blob in srch_gen:
                     if os.path.basename(blob.name) == blob_file:
                         obj_list.append(blob)
@@ -427,29 +822,24 @@ class Provider(StorageABC):
                 # SOURCE specified is Directory only
                 if not recursive:
                     file_found = False
-                    srch_gen = self.storage_service.list_blobs(self.container)
+                    srch_gen = self.list_folder(blob_folder)
                     for blob in srch_gen:
-                        if os.path.dirname(blob.name) == blob_folder:
+                        if isinstance(blob, BlobPrefix):
+                            # subfolder
+                            fold_list.append(blob.name.rstrip('/'))
+                        else:
                             obj_list.append(blob)
-                            file_found = True
-                        if blob_folder == '' and re.search('/', blob.name):
-                            srch_fold = os.path.dirname(blob.name).split('/')[0]
-                            file_found = True
-                            if srch_fold not in fold_list:
-                                fold_list.append(srch_fold)
+                        file_found = True
                     if not file_found:
                         return Console.error(
                             "Directory does not exist: {directory}".format(
                                 directory=blob_folder))
                 else:
                     file_found = False
-                    srch_gen = self.storage_service.list_blobs(self.container)
+                    srch_gen = self.list_folder(blob_folder, recursive=True)
                     for blob in srch_gen:
-                        if (os.path.dirname(blob.name) == blob_folder) or \
-                            (os.path.commonpath(
-                                [blob.name, blob_folder]) == blob_folder):
-                            obj_list.append(blob)
-                            file_found = True
+                        obj_list.append(blob)
+                        file_found = True
                     if not file_found:
                         return Console.error(
                             "Directory does not exist: {directory}".format(
@@ -457,12 +847,8 @@ class Provider(StorageABC):
             else:
                 # SOURCE is specified with Directory and file
                 if not recursive:
-                    if self.storage_service.exists(self.container, source[1:]):
-                        blob_prop = self.storage_service.get_blob_properties(
-                            self.container, source[1:])
-                        blob_size = self.storage_service.get_blob_properties(
-                            self.container,
-                            source[1:]).properties.content_length
+                    blob_prop = self.blob_properties(source[1:])
+                    if blob_prop is not None:
                         obj_list.append(blob_prop)
                     else:
                         return Console.error(
@@ -471,8 +857,22 @@ class Provider(StorageABC):
                 else:
                     return Console.error(
                         "Invalid arguments, recursive not applicable")
-        dict_obj = self.update_dict(obj_list)
+        dict_obj = self.update_dict(obj_list) + self.folder_dict(fold_list)
         pprint(dict_obj)
-        if len(fold_list) > 0:
-            pprint(fold_list)
         return dict_obj
+
+    def folder_dict(self, folders):
+        # Internal function to build the dict objects of subfolders, they
+        # have no blob and no properties
+        d = []
+        for folder in folders:
+            d.append({
+                "name": folder,
+                "cm": {
+                    "kind": "storage",
+                    "cloud": self.cloud,
+                    "name": folder,
+                    "directory": True
+                }
+            })
+        return d
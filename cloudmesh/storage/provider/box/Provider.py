@@ -1,10 +1,80 @@
 from boxsdk import JWTAuth
 from boxsdk import Client
+from boxsdk.exception import BoxAPIException
 from cloudmesh.common.console import Console
 from cloudmesh.common.util import path_expand
-from os.path import basename, join
+from os.path import basename, dirname, join
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from cloudmesh.storage.StorageABC import StorageABC
+from cloudmesh.storage.PathCache import PathCache
+from cloudmesh.storage.util import checkpoint_path
+from cloudmesh.storage.util import merge_settings
+from cloudmesh.storage.util import raise_failed
+from cloudmesh.storage.util import size_in_bytes
+
+#
+# Paths are resolved by walking the folders from the root folder '0'.
+# The items of a path and the items of a folder are cached for
+# cache_ttl seconds, the caches hold at most CACHE_SIZE entries
+#
+# cloudmesh:
+#   storage:
+#     box:
+#       cache_ttl: 60
+#
+CACHE_TTL = 60
+CACHE_SIZE = 10000
+
+#
+# Folders are listed in pages of PAGE_SIZE items, only the FIELDS of
+# the items are requested
+#
+PAGE_SIZE = 1000
+FIELDS = ['type', 'id', 'name', 'size', 'modified_at']
+
+#
+# Files larger than chunked_threshold are uploaded with a chunked upload
+# session, max_connections parts of a file are uploaded at the same
+# time. Box accepts upload sessions for files of at least
+# MIN_CHUNKED_SIZE bytes. max_workers folders are listed at the same
+# time when a folder tree is traversed
+#
+# cloudmesh:
+#   storage:
+#     box:
+#       transfer:
+#         chunked_threshold: 50MB
+#         max_connections: 4
+#         max_workers: 8
+#
+TRANSFER_DEFAULTS = {
+    'chunked_threshold': 50 * 1024 ** 2,
+    'max_connections': 4,
+    'max_workers': 8
+}
+MIN_CHUNKED_SIZE = 20 * 1024 ** 2
+
+#
+# The id of an upload session is kept in a file in CHECKPOINT_DIR until
+# the upload is committed, so that an interrupted upload continues with
+# the parts that are missing
+#
+CHECKPOINT_DIR = '~/.cloudmesh/box'
+UPLOAD_CHECKPOINT = '.cmupload'
+
+#
+# Box answers a commit with 202 while it still processes the parts. The
+# sdk retries it a few times and then returns None, the commit is then
+# repeated every COMMIT_DELAY seconds, at most COMMIT_RETRIES times
+#
+COMMIT_RETRIES = 10
+COMMIT_DELAY = 5
 
 
 def get_id(source, results, source_type):
@@ -34,7 +104,8 @@ def update_dict(elements):
         _elements = [elements]
     d = []
     for element in _elements:
-        entry = element.__dict__
+        # a copy, the elements may be cached by the provider
+        entry = dict(element.__dict__)
         entry["cm"] = {
             "kind": "storage",
             "cloud": 'box',
@@ -62,6 +133,96 @@ class Provider(StorageABC):
         # this needs to be well defined in ~/.cloudmesh/box/ ....
         self.client = Client(self.sdk)
 
+        spec = self.config["cloudmesh.storage"][service]
+        ttl = spec.get('cache_ttl', CACHE_TTL)
+        # path -> item and folder id -> items of the folder
+        self.paths = PathCache(ttl=ttl, size=CACHE_SIZE)
+        self.folders = PathCache(ttl=ttl, size=CACHE_SIZE)
+
+        self.transfer = merge_settings(TRANSFER_DEFAULTS, spec.get('transfer'))
+        self.transfer['chunked_threshold'] = size_in_bytes(
+            self.transfer['chunked_threshold'])
+        if self.transfer['chunked_threshold'] < MIN_CHUNKED_SIZE:
+            raise ValueError(
+                "chunked_threshold must be at least {size} bytes".format(
+                    size=MIN_CHUNKED_SIZE))
+
+    def children(self, folder_id):
+        # Internal function to get the items of a folder, the items are
+        # cached so that repeated calls on the same tree do not list the
+        # folder again. Large folders are read in pages with markers
+        items = self.folders.get(folder_id)
+        if items is None:
+            items = [item for item in self.client.folder(folder_id).get_items(
+                limit=PAGE_SIZE, use_marker=True, fields=FIELDS)]
+            self.folders.set(folder_id, items)
+        return items
+
+    def resolve(self, path):
+        # Internal function to find the item of a path. The path is walked
+        # from the root folder '0', each folder on the way is listed with
+        # children and the items found are cached by their path. Returns
+        # None if the path does not exist
+        path = path.strip('/')
+        if path == '':
+            return self.client.folder('0')
+        item = self.paths.get(path)
+        if item is not None:
+            return item
+        item = self.client.folder('0')
+        walked = []
+        for name in path.split('/'):
+            if item.object_type != 'folder':
+                return None
+            walked.append(name)
+            cached = self.paths.get('/'.join(walked))
+            if cached is None:
+                cached = next((child for child in self.children(item.id)
+                               if child.name == name), None)
+                if cached is None:
+                    return None
+                self.paths.set('/'.join(walked), cached)
+            item = cached
+        return item
+
+    def invalidate(self, path):
+        # Internal function to remove a path that this process changed,
+        # the paths below it and the items of its parent folder from the
+        # cache
+        path = path.strip('/')
+        parent = self.resolve(dirname(path))
+        if parent is not None:
+            self.folders.invalidate(parent.id)
+        item = self.paths.get(path)
+        if item is not None:
+            self.folders.invalidate(item.id)
+        self.paths.invalidate_prefix(path)
+
+    def walk(self, folder_id):
+        # Internal generator over the (path, item) pairs of all items below
+        # a folder, the path is relative to the folder. The tree is walked
+        # breadth first, max_workers folders are listed at the same time
+        # and the items of a folder are yielded as soon as its listing is
+        # complete
+        with ThreadPoolExecutor(
+                max_workers=self.transfer['max_workers']) as executor:
+            pending = {executor.submit(self.children, folder_id): ''}
+            try:
+                while len(pending) > 0:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for listing in done:
+                        parent = pending.pop(listing)
+                        for item in listing.result():
+                            path = join(parent, item.name)
+                            if item.type == 'folder':
+                                pending[executor.submit(
+                                    self.children, item.id)] = path
+                            yield path, item
+            finally:
+                # the caller stopped early
+                for listing in pending:
+                    listing.cancel()
+
     def put(self, service=None, source=None, destination=None, recursive=False):
         """
 
@@ -74,102 +235,180 @@ class Provider(StorageABC):
 
         """
         try:
-            dest = basename(destination)
             sourcepath = change_path(source)
-            sourcebase = basename(sourcepath)
-            uploaded = []
-            if dest == '':
-                files = [item for item in self.client.folder('0').get_items()]
-            else:
-                items = self.client.search().query(dest, type='folder')
-                folders = [item for item in items]
-                folder_id = get_id(dest, folders, 'folder')
-                if folder_id is not None:
-                    files = [item for item in self.client.folder(folder_id).get_items()]
-                else:
-                    Console.error("Destination directory not found")
-                    return
+            folder = self.resolve(destination)
+            if folder is None or folder.object_type != 'folder':
+                Console.error("Destination directory not found")
+                return
+            files = self.children(folder.id)
             if not recursive:
                 if os.path.isfile(sourcepath):
-                    filename = sourcebase
+                    sources = [sourcepath]
                 else:
                     Console.error("Invalid source path.")
                     return
-                file_id = get_id(filename, files, 'file')
-                if file_id is None:
-                    file = self.client.folder('0').upload(sourcepath)
-                    files_dict = update_dict(file)
-                    return files_dict
-                else:
-                    file = self.client.file(file_id).update_contents(sourcepath)
-                    files_dict = update_dict(file)
-                    return files_dict
             else:
-                for s in os.listdir(source):
-                    s_id = get_id(s, files, 'file')
-                    if s_id is None:
-                        file = self.client.folder('0').upload(sourcepath + '/' + s)
-                        uploaded.append(file)
-                    else:
-                        file = self.client.file(s_id).update_contents(sourcepath + '/' + s)
-                        uploaded.append(file)
-                files_dict = update_dict(uploaded)
-                return files_dict
+                sources = [join(sourcepath, s) for s in os.listdir(sourcepath)
+                           if os.path.isfile(join(sourcepath, s))]
+            uploaded = []
+            for s in sources:
+                file_id = get_id(basename(s), files, 'file')
+                uploaded.append(self.upload_file(folder.id, file_id, s))
+                # the cached item of an existing file has its old size
+                self.invalidate(join(destination, basename(s)))
+            files_dict = update_dict(uploaded)
+            return files_dict
         except Exception as e:
             Console.error(e)
 
-    def get(self, service=None, source=None, destination=None, recursive=False):
+    def upload_file(self, folder_id, file_id, sourcepath):
+        # Internal function to upload a file into a folder, file_id is the
+        # id of the file with the same name or None. Small files are sent
+        # with a single request
+        if os.path.getsize(sourcepath) < self.transfer['chunked_threshold']:
+            if file_id is None:
+                return self.client.folder(folder_id).upload(sourcepath)
+            return self.client.file(file_id).update_contents(sourcepath)
+        return self.upload_chunked(folder_id, file_id, sourcepath)
+
+    def upload_chunked(self, folder_id, file_id, sourcepath):
+        # Internal function to upload a large file with a chunked upload
+        # session. The file is read once, the SHA-1 of the file is computed
+        # while reading and max_connections parts are uploaded at the same
+        # time. The session id is kept in a checkpoint file, a restart
+        # only uploads the parts the session does not have
+        stat = os.stat(sourcepath)
+        source = {'folder': folder_id, 'file': file_id,
+                  'path': os.path.abspath(sourcepath), 'size': stat.st_size,
+                  'mtime': stat.st_mtime}
+        checkpoint_file = checkpoint_path(CHECKPOINT_DIR, source,
+                                          UPLOAD_CHECKPOINT)
+
+        session = None
+        parts = {}
+        if os.path.isfile(checkpoint_file):
+            with open(checkpoint_file) as f:
+                session_id = f.read().strip()
+            try:
+                session = self.client.upload_session(session_id).get()
+                parts = {part['offset']: part for part in session.get_parts()}
+            except BoxAPIException:
+                # sessions expire after a week
+                session = None
+                parts = {}
+        if session is None:
+            if file_id is None:
+                session = self.client.folder(folder_id).create_upload_session(
+                    stat.st_size, basename(sourcepath))
+            else:
+                session = self.client.file(file_id).create_upload_session(
+                    stat.st_size)
+            with open(checkpoint_file, 'w') as f:
+                f.write(session.id)
+
+        max_connections = self.transfer['max_connections']
+        in_flight = threading.BoundedSemaphore(max_connections)
+
+        def upload_part(offset, data):
+            try:
+                return session.upload_part_bytes(data, offset, stat.st_size)
+            finally:
+                in_flight.release()
+
+        sha1 = hashlib.sha1()
+        uploads = []
+        pending = set()
+        with open(sourcepath, 'rb') as f, ThreadPoolExecutor(
+                max_workers=max_connections) as executor:
+            offset = 0
+            for data in iter(lambda: f.read(session.part_size), b''):
+                sha1.update(data)
+                if offset not in parts:
+                    in_flight.acquire()
+                    uploads.append(executor.submit(upload_part, offset, data))
+                    # fail early instead of reading the whole file
+                    pending = raise_failed(pending | {uploads[-1]})
+                offset += len(data)
+            for upload in uploads:
+                part = upload.result()
+                parts[part['offset']] = part
+
+        parts = [parts[offset] for offset in sorted(parts)]
+        file = session.commit(sha1.digest(), parts=parts)
+        for attempt in range(COMMIT_RETRIES):
+            if file is not None:
+                break
+            time.sleep(COMMIT_DELAY)
+            file = session.commit(sha1.digest(), parts=parts)
+        if file is None:
+            # the checkpoint is kept, a restart commits the session again
+            raise RuntimeError(
+                "upload session {id} of {path} is still being processed".format(
+                    id=session.id, path=sourcepath))
+        os.remove(checkpoint_file)
+        return file
+
+    def get(self, service=None, source=None, destination=None, recursive=False,
+            keep_structure=False):
         """
 
         downloads file from Box, if recursive is true and source is directory downloads all files in directory
         :param source: cloud file or directory to download
         :param destination: local directory to be downloaded into
         :param recursive: if true download all files in source directory, source must be directory
+        :param keep_structure: if true and recursive is true the subdirectories are downloaded as well and
+                               recreated in destination
         :return: file dict(s) that have been downloaded
 
 
         """
         try:
 
-            target = basename(source)
             dest = change_path(destination)
-            downloads = []
+            item = self.resolve(source)
             if recursive:
-                if target == '':
-                    files = [item for item in self.client.folder('0').get_items()]
+                if item is None or item.object_type != 'folder':
+                    Console.error("Source directory not found.")
+                    return
+                if keep_structure:
+                    items = self.walk(item.id)
                 else:
-                    results = [item for item in self.client.search().query(target, type='folder')]
-                    folder_id = get_id(target, results, 'folder')
-                    if folder_id:
-                        files = [item for item in self.client.folder(folder_id).get_items()]
-                    else:
-                        Console.error("Source directory not found.")
-                        return
-                for f in files:
-                    if f.type == 'file':
-                        file = self.client.file(f.id).get()
-                        full_dest = join(dest, file.name)
-                        with open(full_dest, 'wb') as file_dest:
-                            self.client.file(file.id).download_to(file_dest)
-                            downloads.append(file)
+                    items = ((f.name, f) for f in self.children(item.id))
+                downloads = self.download_files(
+                    (f, join(dest, path)) for path, f in items
+                    if f.type == 'file')
                 files_dict = update_dict(downloads)
                 return files_dict
             else:
-                results = [item for item in self.client.search().query(target)]
-                if not any(result.name == target for result in results):
+                if item is None or item.object_type != 'file':
                     Console.error("Source file not found.")
                 else:
-                    file_id = get_id(target, results, 'file')
-                    if file_id is not None:
-                        file = self.client.file(file_id).get()
-                        full_dest = join(dest, file.name)
-                        with open(full_dest, 'wb') as f:
-                            self.client.file(file.id).download_to(f)
-                            files_dict = update_dict(file)
-                            return files_dict
+                    file = self.client.file(item.id).get()
+                    full_dest = join(dest, file.name)
+                    with open(full_dest, 'wb') as f:
+                        self.client.file(file.id).download_to(f)
+                        files_dict = update_dict(file)
+                        return files_dict
         except Exception as e:
             Console.error(e)
 
+    def download_files(self, files):
+        # Internal function to download (item, local path) pairs with
+        # max_workers threads. The items come from the folder listings, so
+        # no metadata request is made per file, and each file is streamed
+        # to disk. The downloads start while the listing is still read
+        def download(item, full_dest):
+            os.makedirs(dirname(full_dest), exist_ok=True)
+            with open(full_dest, 'wb') as file_dest:
+                self.client.file(item.id).download_to(file_dest)
+            return item
+
+        with ThreadPoolExecutor(
+                max_workers=self.transfer['max_workers']) as executor:
+            downloads = [executor.submit(download, item, full_dest)
+                         for item, full_dest in files]
+            return [download.result() for download in downloads]
+
     def search(self, service=None, directory=None, filename=None, recursive=False):
         """
 
@@ -182,42 +421,21 @@ class Provider(StorageABC):
 
         """
         try:
-            cloud_dir = basename(directory)
-            results = []
-            if cloud_dir == '':
-                files = [item for item in self.client.folder('0').get_items() if item.type == 'file']
-                folders = [item for item in self.client.folder('0').get_items() if item.type == 'folder']
-            else:
-                items = self.client.search().query(cloud_dir, type='folder')
-                folder_id = get_id(cloud_dir, items, 'folder')
-                if not folder_id:
-                    Console.error("Directory not found.")
-                files = [item for item in self.client.folder(folder_id).get_items() if item.type == 'file']
-                folders = [item for item in self.client.folder(folder_id).get_items() if item.type == 'folder']
+            folder = self.resolve(directory)
+            if folder is None or folder.object_type != 'folder':
+                Console.error("Directory not found.")
+                return
             if not recursive:
-                for file in files:
-                    if filename in file.name:
-                        results.append(file)
-                if len(results) > 0:
-                    files_dict = update_dict(results)
-                    return files_dict
-                else:
-                    Console.error("No files found.")
+                items = self.children(folder.id)
             else:
-                while len(folders) > 0:
-                    for folder in folders:
-                        files = [item for item in self.client.folder(folder.id).get_items() if item.type == 'file']
-                        for file in files:
-                            if filename in file.name:
-                                results.append(file)
-                        for item in self.client.folder(folder.id).get_items():
-                            if item.type == 'folder':
-                                folders.append(item)
-                if len(files) > 0:
-                    files_dict = update_dict(results)
-                    return files_dict
-                else:
-                    Console.error("No files found.")
+                items = (item for path, item in self.walk(folder.id))
+            results = [item for item in items
+                       if item.type == 'file' and filename in item.name]
+            if len(results) > 0:
+                files_dict = update_dict(results)
+                return files_dict
+            else:
+                Console.error("No files found.")
         except Exception as e:
             Console.error(e)
 
@@ -236,15 +454,10 @@ class Provider(StorageABC):
             if len(path) == 1:
                 Console.error('Invalid path specified.')
             else:
-                parent = path[len(path) - 2]
-                if parent == '':
-                    folder = self.client.folder('0').create_subfolder(new_dir)
-                    folder_dict = update_dict(folder)
-                    return folder_dict
-                folders = [item for item in self.client.search().query(parent, type='folder')]
-                if len(folders) > 0:
-                    parent = folders[0].id
-                    folder = self.client.folder(parent).create_subfolder(new_dir)
+                parent = self.resolve(dirname(directory))
+                if parent is not None and parent.object_type == 'folder':
+                    folder = self.client.folder(parent.id).create_subfolder(new_dir)
+                    self.invalidate(directory)
                     folder_dict = update_dict(folder)
                     return folder_dict
                 else:
@@ -263,30 +476,16 @@ class Provider(StorageABC):
 
         """
         try:
-            result_list = []
-            path = source.split('/')
-            for i in range(1, len(path) + 1):
-                if path[len(path) - i] == '':
-                    if len(path) - i > 1:
-                        pass
-                    else:
-                        items = self.client.folder('0').get_items()
-                        contents = [item for item in items]
-                        for c in contents:
-                            result_list.append(c)
-                else:
-                    folders = [item for item in self.client.search().query(path[len(path) - i], type='folder')]
-                    folder_id = get_id(path[len(path) - i], folders, 'folder')
-                    if folder_id:
-                        results = self.client.folder(folder_id).get_items()
-                        contents = [result for result in results]
-                        for c in contents:
-                            result_list.append(c)
-                    else:
-                        Console.error("Directory " + path[len(path) - i] + " not found.")
-                if not recursive and i == 1:
-                    list_dict = update_dict(result_list)
-                    return list_dict
+            item = self.resolve(source)
+            if item is None:
+                Console.error("Directory " + source + " not found.")
+                return
+            if item.object_type == 'file':
+                result_list = [item]
+            elif not recursive:
+                result_list = self.children(item.id)
+            else:
+                result_list = [child for path, child in self.walk(item.id)]
             list_dict = update_dict(result_list)
             return list_dict
         except Exception as e:
@@ -302,22 +501,14 @@ class Provider(StorageABC):
 
         """
         try:
-            path = source.strip('/').split('/')
-            name = path[len(path) - 1]
-            items = self.client.search().query(name, type='file')
-            files = [item for item in items]
-            items2 = self.client.search().query(name, type='folder')
-            folders = [item2 for item2 in items2]
-            results = files + folders
-            if not any(result.name == name for result in results):
+            item = self.resolve(source)
+            if item is None or source.strip('/') == '':
                 Console.error("Source not found.")
             else:
-                item_ind = next((index for (index, result) in enumerate(results) if (result.name == name)), None)
-                item_id = results[item_ind].id
-                item_type = results[item_ind].type
-                if item_type == 'folder':
-                    self.client.folder(item_id).delete()
-                elif item_type == 'file':
-                    self.client.file(item_id).delete()
+                if item.type == 'folder':
+                    self.client.folder(item.id).delete()
+                elif item.type == 'file':
+                    self.client.file(item.id).delete()
+                self.invalidate(source)
         except Exception as e:
             Console.error(e)
@@ -1,24 +1,109 @@
-import io
 import json
 import mimetypes
 import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from pathlib import Path
 import argparse
 import httplib2
+from apiclient.errors import HttpError
 from apiclient.http import MediaFileUpload
-from apiclient.http import MediaIoBaseDownload
 from cloudmesh.common.util import path_expand
 from cloudmesh.management.configuration.config import Config
+from cloudmesh.storage.PathCache import PathCache
 from cloudmesh.storage.StorageABC import StorageABC
 from cloudmesh.storage.provider.gdrive.Authentication import Authentication
+from cloudmesh.storage.util import checkpoint_path
+from cloudmesh.storage.util import merge_settings
+from cloudmesh.storage.util import read_checkpoint
+from cloudmesh.storage.util import size_in_bytes
+from cloudmesh.storage.util import write_checkpoint
 from apiclient import discovery
 
+#
+# The transfer settings can be set in the yaml file of the service
+#
+# cloudmesh:
+#   storage:
+#     gdrive:
+#       transfer:
+#         chunksize: 10MB
+#         max_workers: 4
+#
+# Files are downloaded in chunks of chunksize bytes, only one chunk is
+# held in memory. A download is written to a file with the suffix
+# DOWNLOAD_PARTIAL that is renamed when it is complete, an interrupted
+# download continues from the bytes in the partial file. The
+# REVISION_FIELDS of the file are kept next to it in a file with the
+# suffix DOWNLOAD_REVISION, a partial file of another revision is
+# discarded.
+#
+# Files larger than chunksize are uploaded in chunks of chunksize bytes
+# with a resumable upload session, the chunksize must be a multiple of
+# UPLOAD_UNIT. The session URI is kept in a file in CHECKPOINT_DIR until
+# the upload is complete, so that an interrupted upload continues with
+# the bytes the session does not have. max_workers files of a directory
+# are uploaded at the same time.
+#
+TRANSFER_DEFAULTS = {
+    'chunksize': 10 * 1024 ** 2,
+    'max_workers': 4
+}
+DOWNLOAD_PARTIAL = '.cmdownload'
+DOWNLOAD_REVISION = '.cmrevision'
+REVISION_FIELDS = ['md5Checksum', 'headRevisionId']
+UPLOAD_UNIT = 256 * 1024
+CHECKPOINT_DIR = '~/.cloudmesh/gdrive'
+UPLOAD_CHECKPOINT = '.cmupload'
+
+#
+# Drive returns at most PAGE_SIZE files per page
+#
+PAGE_SIZE = 1000
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+#
+# Bulk operations send BATCH_SIZE calls per HTTP request to the batch
+# endpoint. Calls that are rate limited are retried up to BATCH_RETRIES
+# times, the n-th retry waits about BACKOFF * 2 ** n seconds
+#
+BATCH_SIZE = 100
+BATCH_RETRIES = 5
+BACKOFF = 1
+RATE_LIMIT_REASONS = ['rateLimitExceeded', 'userRateLimitExceeded']
+
+#
+# Names are looked up with a Drive query and the file that is found is
+# cached for cache_ttl seconds, the cache holds at most CACHE_SIZE names
+#
+# cloudmesh:
+#   storage:
+#     gdrive:
+#       cache_ttl: 60
+#
+CACHE_TTL = 60
+CACHE_SIZE = 10000
+
+
+def query_string(value):
+    """
+    quotes a value for a Drive query
+
+    :param value: the value, e.g. a file name
+    :return: the value in single quotes with quotes and backslashes escaped
+    """
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
 class Provider(StorageABC):
 
     def __init__(self, service='gdrive', config="~/.cloudmesh/cloudmesh4.yaml"):
         
         super(Provider, self).__init__(service=service, config=config)
-        self.limitFiles = 10000000
         self.scopes = 'https://www.googleapis.com/auth/drive'
         self.clientSecretFile = path_expand(
             '~/.cloudmesh/gdrive/client_secret.json')
@@ -36,6 +121,22 @@ class Provider(StorageABC):
         self.size = None
         self.cloud = service
         self.service = service
+        self.transfer = self.transfer_settings()
+        self.local = threading.local()
+        spec = self.config["cloudmesh.storage"][self.service]
+        # name -> file
+        self.ids = PathCache(ttl=spec.get('cache_ttl', CACHE_TTL),
+                             size=CACHE_SIZE)
+
+    def transfer_settings(self):
+        spec = self.config["cloudmesh.storage"][self.service]
+        settings = merge_settings(TRANSFER_DEFAULTS, spec.get('transfer'))
+        settings['chunksize'] = size_in_bytes(settings['chunksize'])
+        if settings['chunksize'] % UPLOAD_UNIT != 0:
+            raise ValueError(
+                "chunksize must be a multiple of {unit} bytes".format(
+                    unit=UPLOAD_UNIT))
+        return settings
 
     def generate_flags_json(self):
         credentials = self.config.credentials("storage", "gdrive")
@@ -67,221 +168,508 @@ class Provider(StorageABC):
             json.dump(data, fp)
 
     def put(self, service=None, source=None, destination=None, recursive=False):
-        if recursive:
-            if os.path.isdir(source):
-                query_params = "name='" + destination + "' and trashed=false"
-                sourceid = self.driveService.files().list(q=query_params,
-                                                          fields="nextPageToken, files(id, name, mimeType)").execute()
-                file_parent_id = None
-                print(sourceid)
-                if len(sourceid['files']) == 0:
-                    parent_file = self.create_dir(directory=destination)
-                    file_parent_id = parent_file['id']
-                else:
-                    print(sourceid['files'][0]['id'])
-                    file_parent_id = sourceid['files'][0]['id']
-
-                for f in os.listdir(source):
-                    if os.path.isfile(os.path.join(source, f)):
-                        self.upload_file(source=source, filename=f,
-                                         parent_it=file_parent_id)
-            else:
-                query_params = "name='" + destination + "' and trashed=false"
-                sourceid = self.driveService.files().list(q=query_params,
-                                                          fields="nextPageToken, files(id, name, mimeType)").execute()
-                file_parent_id = None
-                print(sourceid)
-                if len(sourceid['files']) == 0:
-                    parent_file = self.create_dir(directory=destination)
-                    file_parent_id = parent_file['id']
-                else:
-                    print(sourceid['files'][0]['id'])
-                    file_parent_id = sourceid['files'][0]['id']
-
-                return self.upload_file(source=None, filename=source, parent_it=file_parent_id)
-        else:
-            if os.path.isdir(source):
-                query_params = "name='" + destination + "' and trashed=false"
-                sourceid = self.driveService.files().list(q=query_params,
-                                                          fields="nextPageToken, files(id, name, mimeType)").execute()
-                file_parent_id = None
-                print(sourceid)
-                if len(sourceid['files']) == 0:
-                    parent_file = self.create_dir(directory=destination)
-                    file_parent_id = parent_file['id']
-                else:
-                    print(sourceid['files'][0]['id'])
-                    file_parent_id = sourceid['files'][0]['id']
-
-                for f in os.listdir(source):
-                    if os.path.isfile(os.path.join(source, f)):
-                        self.upload_file(source=source, filename=f,
-                                         parent_it=file_parent_id)
-            else:
-                query_params = "name='" + destination + "' and trashed=false"
-                sourceid = self.driveService.files().list(q=query_params,
-                                                          fields="nextPageToken, files(id, name, mimeType)").execute()
-                file_parent_id = None
-                print(sourceid)
-                if len(sourceid['files']) == 0:
-                    parent_file = self.create_dir(directory=destination)
-                    file_parent_id = parent_file['id']
-                else:
-                    print(sourceid['files'][0]['id'])
-                    file_parent_id = sourceid['files'][0]['id']
-
-                return self.upload_file(source=None, filename=source, parent_it=file_parent_id)
+        folder = self.find(destination)
+        if folder is None:
+            folder = self.create_dir(directory=destination)
+        if os.path.isdir(source):
+            return self.upload_files(source, folder['id'])
+        return self.upload_file(source=None, filename=source,
+                                parent_it=folder['id'])
 
-    def get(self, service=None, source=None, destination=None, recursive=False):
+    def get(self, service=None, source=None, destination=None, recursive=False,
+            progress=None):
         if not os.path.exists(source):
             os.makedirs(source)
 
-        if recursive:
-            query_params = "name='" + destination + "' and trashed=false"
-            sourceid = self.driveService.files().list(q=query_params,
-                                                      fields="nextPageToken, files(id, name, mimeType)").execute()
-            print(sourceid)
-            file_id = sourceid['files'][0]['id']
-            file_name = sourceid['files'][0]['name']
-            mime_type = sourceid['files'][0]['mimeType']
-            if mime_type == 'application/vnd.google-apps.folder':
-                items = self.list(source=destination, recursive=False)
-                for item in items:
-                    if item['mimeType'] != 'application/vnd.google-apps.folder':
-                        print("dbsakjdjksa")
-                        print(item['mimeType'])
-                        return self.download(source, item['id'], item['name'], item['mimeType'])
-            else:
-                return self.download(source, file_id, file_name, mime_type)
-        else:
-            query_params = "name='" + destination + "' and trashed=false"
-            sourceid = self.driveService.files().list(q=query_params,
-                                                      fields="nextPageToken, files(id, name, mimeType)").execute()
-            print(sourceid)
-            file_id = sourceid['files'][0]['id']
-            file_name = sourceid['files'][0]['name']
-            mime_type = sourceid['files'][0]['mimeType']
-            if mime_type == 'application/vnd.google-apps.folder':
-                items = self.list(source=destination, recursive=False)
-                for item in items:
-                    if item['mimeType'] != 'application/vnd.google-apps.folder':
-                        print("dbsakjdjksa")
-                        print(item['mimeType'])
-                        return self.download_file(source, item['id'], item['name'], item['mimeType'])
-            else:
-                return self.download_file(source, file_id, file_name, mime_type)
+        file = self.find(destination)
+        if file is None:
+            print('No files found.')
+            return None
+        if file['mimeType'] == FOLDER_MIME_TYPE:
+            query_params = "'" + file['id'] + "' in parents and " \
+                           "mimeType != '" + FOLDER_MIME_TYPE + "' and " \
+                           "trashed=false"
+            fields = ', '.join(['id', 'name', 'mimeType'] + REVISION_FIELDS)
+            return [self.download_file(source, item['id'], item['name'],
+                                       item['mimeType'], progress=progress,
+                                       revision=item)
+                    for item in self.list_files(q=query_params,
+                                                fields=fields)]
+        return self.download_file(source, file['id'], file['name'],
+                                  file['mimeType'], progress=progress)
 
     def delete(self, service='gdrive', filename=None,
                recursive=False):  # this is working
-        file_id = ""
-        if recursive:
-            items = Provider.list(self, recursive=True)
-            for i in range(len(items)):
-                if items[i]['name'] == filename:
-                    file_id = items[i]['id']
-
-            try:
-                self.driveService.files().delete(fileId=file_id).execute()
-            except:  # errors.HttpError, error:
-                return 'An error occurred:'  # %s' % error
-        else:
-            items = Provider.list(self, recursive=True)
-            for i in range(len(items)):
-                if items[i]['name'] == filename:
-                    file_id = items[i]['id']
-            try:
-                self.driveService.files().delete(fileId=file_id).execute()
-            except:  # errors.HttpError, error:
-                return 'An error occurred:'  # %s' % error
+        file = self.find(filename)
+        file_id = "" if file is None else file['id']
+        try:
+            self.driveService.files().delete(fileId=file_id).execute()
+        except:  # errors.HttpError, error:
+            return 'An error occurred:'  # %s' % error
+        self.ids.invalidate(filename)
         return "deleted"
 
     def create_dir(self, service='gdrive', directory=None):
         file_metadata = {'name': directory,
                          'mimeType': 'application/vnd.google-apps.folder'}
-        file = self.driveService.files().create(body=file_metadata,
-                                                fields='id').execute()
+        file = self.driveService.files().create(
+            body=file_metadata, fields='id, name, mimeType').execute()
         print('Folder ID: %s' % file.get('id'))
+        self.ids.set(directory, file)
+        return file
+
+    def find(self, name):
+        """
+        finds a file or folder by its name with a Drive query. The file is
+        cached, so that a repeated lookup of the name needs no request
+
+        :param name: the name of the file
+        :return: dict with the id, name and mimeType of the first file with
+                 the name, None if there is no such file
+        """
+        file = self.ids.get(name)
+        if file is None:
+            query_params = "name = " + query_string(name) + \
+                           " and trashed = false"
+            file = next(self.list_files(q=query_params,
+                                        fields='id, name, mimeType',
+                                        page_size=1), None)
+            if file is not None:
+                self.ids.set(name, file)
         return file
 
+    def list_files(self, q=None, fields='id, name, mimeType',
+                   page_size=PAGE_SIZE, http=None):
+        """
+        generator over the files that match a query. The next page is
+        requested with its nextPageToken when the files of the previous
+        page are consumed, so a caller that stops early does not read the
+        other pages
+
+        :param q: the Drive query, None for all files
+        :param fields: the fields of the files that are returned
+        :param page_size: the number of files per page
+        :param http: the authorized connection, None for the connection of
+                     the provider
+        :return: generator of file dicts
+        """
+        page_token = None
+        while True:
+            results = self.driveService.files().list(
+                q=q, pageSize=page_size, pageToken=page_token,
+                fields="nextPageToken, files({fields})".format(
+                    fields=fields)).execute(http=http)
+            for item in results.get('files', []):
+                yield item
+            page_token = results.get('nextPageToken')
+            if page_token is None:
+                return
+
+    def walk(self, folder_id, q=None, fields='id, name, mimeType'):
+        """
+        generator over the files and folders below a folder. The folders
+        are queried breadth first, max_workers folders at the same time,
+        each with the paginated query '<id>' in parents. If q is given
+        Drive only returns the subfolders and the files that match q
+
+        :param folder_id: the id of the folder
+        :param q: a Drive query for the files, e.g. name = 'a.txt'
+        :param fields: the fields of the files that are returned, they
+                       must include mimeType
+        :return: generator of file dicts
+        """
+        def children(parent_id):
+            query_params = query_string(parent_id) + \
+                           " in parents and trashed = false"
+            if q is not None:
+                query_params += " and (mimeType = " + \
+                                query_string(FOLDER_MIME_TYPE) + \
+                                " or (" + q + "))"
+            return list(self.list_files(q=query_params, fields=fields,
+                                        http=self.thread_http()))
+
+        with ThreadPoolExecutor(
+                max_workers=self.transfer['max_workers']) as executor:
+            pending = {executor.submit(children, folder_id)}
+            try:
+                while pending:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for listing in done:
+                        for item in listing.result():
+                            if item['mimeType'] == FOLDER_MIME_TYPE:
+                                pending.add(
+                                    executor.submit(children, item['id']))
+                            yield item
+            finally:
+                # the caller stopped early, the folders that are not
+                # queried yet are skipped
+                for listing in pending:
+                    listing.cancel()
+
+    def execute_batch(self, requests):
+        """
+        executes Drive API calls with the batch endpoint, BATCH_SIZE calls
+        are sent in one HTTP request. Calls that are rate limited are
+        retried with exponential backoff, also if the whole batch request
+        is rate limited. Other errors are returned
+
+        :param requests: list of API calls, e.g.
+                         self.driveService.files().delete(fileId=file_id)
+        :return: list of (response, error) in the order of the requests,
+                 error is None if the call succeeded
+        """
+        results = [None] * len(requests)
+        pending = list(range(len(requests)))
+        for attempt in range(BATCH_RETRIES + 1):
+            retry = []
+
+            def callback(request_id, response, exception):
+                index = int(request_id)
+                if exception is not None and self.rate_limited(exception) \
+                        and attempt < BATCH_RETRIES:
+                    retry.append(index)
+                else:
+                    results[index] = (response, exception)
+
+            for start in range(0, len(pending), BATCH_SIZE):
+                indexes = pending[start:start + BATCH_SIZE]
+                batch = self.driveService.new_batch_http_request(
+                    callback=callback)
+                for index in indexes:
+                    batch.add(requests[index], request_id=str(index))
+                try:
+                    batch.execute()
+                except HttpError as e:
+                    # the batch request itself failed, its calls are
+                    # retried or get its error, the results of the other
+                    # batches are kept
+                    if self.rate_limited(e) and attempt < BATCH_RETRIES:
+                        retry.extend(indexes)
+                    else:
+                        for index in indexes:
+                            results[index] = (None, e)
+            if len(retry) == 0:
+                break
+            time.sleep(BACKOFF * 2 ** attempt + random.uniform(0, 1))
+            pending = sorted(retry)
+        return results
+
+    def rate_limited(self, error):
+        # Internal function to check if a call failed because of the rate
+        # limits of Drive
+        if not isinstance(error, HttpError):
+            return False
+        if error.resp.status == 429:
+            return True
+        if error.resp.status != 403:
+            return False
+        try:
+            errors = json.loads(error.content)['error']['errors']
+        except (ValueError, KeyError, TypeError):
+            return False
+        return any(e.get('reason') in RATE_LIMIT_REASONS for e in errors)
+
+    def delete_files(self, file_ids):
+        """
+        deletes files with batched calls
+
+        :param file_ids: list of file ids
+        :return: list of dicts with the id of each file and the error if
+                 it was not deleted
+        """
+        results = self.execute_batch(
+            [self.driveService.files().delete(fileId=file_id)
+             for file_id in file_ids])
+        deleted = []
+        for file_id, (response, error) in zip(file_ids, results):
+            entry = {'id': file_id}
+            if error is not None:
+                entry['error'] = str(error)
+            deleted.append(entry)
+        return deleted
+
+    def get_files(self, file_ids, fields='id, name, mimeType'):
+        """
+        gets the metadata of files with batched calls
+
+        :param file_ids: list of file ids
+        :param fields: the fields of the files that are returned
+        :return: list of file dicts, a file that could not be read has
+                 its id and the error
+        """
+        results = self.execute_batch(
+            [self.driveService.files().get(fileId=file_id, fields=fields)
+             for file_id in file_ids])
+        files = []
+        for file_id, (response, error) in zip(file_ids, results):
+            if error is not None:
+                files.append({'id': file_id, 'error': str(error)})
+            else:
+                files.append(response)
+        return files
+
+    def create_dirs(self, directories, parent_id=None):
+        """
+        creates folders with batched calls
+
+        :param directories: list of folder names
+        :param parent_id: the id of the parent folder, None for the root
+        :return: list of folder dicts, a folder that could not be created
+                 has its name and the error
+        """
+        requests = []
+        for directory in directories:
+            file_metadata = {'name': directory,
+                             'mimeType': FOLDER_MIME_TYPE}
+            if parent_id is not None:
+                file_metadata['parents'] = [parent_id]
+            requests.append(self.driveService.files().create(
+                body=file_metadata, fields='id, name, mimeType'))
+        results = self.execute_batch(requests)
+        folders = []
+        for directory, (response, error) in zip(directories, results):
+            if error is not None:
+                folders.append({'name': directory, 'error': str(error)})
+            else:
+                folders.append(response)
+        return folders
+
     def list(self, service='gdrive', source=None, recursive=False):
         if recursive:
-            results = self.driveService.files().list(pageSize=self.limitFiles,
-                                                     fields="nextPageToken, files(id, name,mimeType)").execute()
-            items = results.get('files', [])
-            if not items:
-                print('No files found.')
-            else:
-                return items
+            items = [item for item in self.list_files()]
         else:
-            query_params = "name='" + source + "' and trashed=false"
-            sourceid = self.driveService.files().list(q=query_params,
-                                                      pageSize=self.limitFiles,
-                                                      fields="nextPageToken, files(id)").execute()
-            file_id = sourceid['files'][0]['id']
-            query_params = "'" + file_id + "' in parents"
-            results = self.driveService.files().list(q=query_params,
-                                                     pageSize=self.limitFiles,
-                                                     fields="nextPageToken, files(id, name, mimeType)").execute()
-            items = results.get('files', [])
-            print(items)
-            if not items:
-                print('No files found.')
+            folder = self.find(source)
+            if folder is None:
+                items = []
             else:
-                return items
+                query_params = query_string(folder['id']) + \
+                               " in parents and trashed = false"
+                items = [item for item in self.list_files(q=query_params)]
+        if not items:
+            print('No files found.')
+        else:
+            return items
 
     def search(self, service='gdrive', directory=None, filename=None,
-               recursive=False):
-        if recursive:
-            found = False
-            list_of_files = self.list(recursive=True)
-            print(list_of_files)
-            for file in list_of_files:
-                print(file)
-                if file['name'] == filename:
-                    found = True
-                    break
-                else:
-                    continue
-            return found
+               recursive=False, modified_after=None):
+        """
+        searches a file with a Drive query, only the files with the name
+        are returned by Drive
+
+        :param directory: the name of the folder, for a recursive search
+                          None searches the whole drive
+        :param filename: the name of the file
+        :param recursive: also search the subfolders
+        :param modified_after: only files modified after this RFC 3339
+                               time, e.g. 2019-06-01T12:00:00
+        :return: True if the file is found
+        """
+        q = "name = " + query_string(filename)
+        if modified_after is not None:
+            q += " and modifiedTime > " + query_string(modified_after)
+        if recursive and directory is None:
+            files = self.list_files(q=q + " and trashed = false",
+                                    fields='name', page_size=1)
         else:
-            found = False
-            list_of_files = self.list(source=directory, recursive=False)
-            print(list_of_files)
-            for file in list_of_files:
-                print(file)
-                if file['name'] == filename:
-                    found = True
-                    break
-                else:
-                    continue
-            return found
+            folder = self.find(directory)
+            if folder is None:
+                return False
+            if recursive:
+                files = self.walk(folder['id'], q=q)
+            else:
+                files = self.list_files(
+                    q=query_string(folder['id']) + " in parents and "
+                      "trashed = false and " + q,
+                    fields='name', page_size=1)
+        # stops at the first match
+        return any(file['name'] == filename for file in files)
+
+    def upload_files(self, source, parent_it):
+        """
+        uploads the files of a directory, max_workers files are uploaded
+        at the same time
+
+        :param source: the local directory
+        :param parent_it: the id of the folder the files are uploaded to
+        :return: list of the uploaded files
+        """
+        files = [f for f in os.listdir(source)
+                 if os.path.isfile(os.path.join(source, f))]
+
+        def upload(filename):
+            return self.upload_file(source=source, filename=filename,
+                                    parent_it=parent_it,
+                                    http=self.thread_http())
 
-    def upload_file(self, source, filename, parent_it):
-        file_metadata = {'name': filename, 'parents': [parent_it]}
-        self.driveService = self.driveService
+        with ThreadPoolExecutor(
+                max_workers=self.transfer['max_workers']) as executor:
+            uploads = [executor.submit(upload, f) for f in files]
+            return [upload.result() for upload in uploads]
+
+    def thread_http(self):
+        # Internal function, httplib2 is not thread safe and every thread
+        # needs its own authorized connection
+        if not hasattr(self.local, 'http'):
+            self.local.http = self.credentials.authorize(httplib2.Http())
+        return self.local.http
+
+    def upload_file(self, source, filename, parent_it, http=None):
+        file_metadata = {'name': os.path.basename(filename),
+                         'parents': [parent_it]}
         if source is None:
             filepath = filename
         else:
             filepath = source + '/' + filename
+        if http is None:
+            http = self.http
+        # the cached file of the name may not be the first one anymore
+        self.ids.invalidate(file_metadata['name'])
+        size = os.path.getsize(filepath)
+        chunksize = self.transfer['chunksize']
+        if size <= chunksize:
+            # a single request
+            media = MediaFileUpload(filepath,
+                                    mimetype=mimetypes.guess_type(filename)[0])
+            file = self.driveService.files().create(body=file_metadata,
+                                                    media_body=media,
+                                                    fields='id').execute(
+                http=http)
+            return file
+
         media = MediaFileUpload(filepath,
-                                mimetype=mimetypes.guess_type(filename)[0])
-        file = self.driveService.files().create(body=file_metadata,
-                                                media_body=media,
-                                                fields='id').execute()
+                                mimetype=mimetypes.guess_type(filename)[0],
+                                chunksize=chunksize, resumable=True)
+        request = self.driveService.files().create(body=file_metadata,
+                                                   media_body=media,
+                                                   fields='id')
+
+        stat = os.stat(filepath)
+        checkpoint = {'path': os.path.abspath(filepath), 'size': stat.st_size,
+                      'mtime': stat.st_mtime, 'parent': parent_it}
+        checkpoint_file = checkpoint_path(CHECKPOINT_DIR, checkpoint,
+                                          UPLOAD_CHECKPOINT)
+
+        session_uri = None
+        if os.path.isfile(checkpoint_file):
+            with open(checkpoint_file) as f:
+                session_uri = f.read().strip()
+            progress, file = self.upload_status(http, session_uri, size)
+            if file is not None:
+                os.remove(checkpoint_file)
+                return file
+            if progress is None:
+                # the session has expired, the upload starts again
+                os.remove(checkpoint_file)
+                session_uri = None
+            else:
+                request.resumable_uri = session_uri
+                request.resumable_progress = progress
+
+        file = None
+        while file is None:
+            status, file = request.next_chunk(http=http)
+            if request.resumable_uri != session_uri:
+                # a new session was started
+                session_uri = request.resumable_uri
+                with open(checkpoint_file, 'w') as f:
+                    f.write(session_uri)
+        os.remove(checkpoint_file)
         return file
 
-    def download_file(self, source, file_id, file_name, mime_type):
+    def upload_status(self, http, session_uri, size):
+        """
+        asks an upload session how many bytes it has received
+
+        :param http: the authorized connection
+        :param session_uri: the URI of the resumable upload session
+        :param size: the size of the file
+        :return: (bytes received, None) while the upload is incomplete,
+                 (None, file) if it is complete and (None, None) if the
+                 session has expired
+        """
+        response, content = http.request(
+            session_uri, 'PUT',
+            headers={'Content-Range': 'bytes */{size}'.format(size=size),
+                     'Content-Length': '0'})
+        if response.status in [200, 201]:
+            return None, json.loads(content)
+        if response.status == 308:
+            if 'range' in response:
+                return int(response['range'].split('-')[-1]) + 1, None
+            return 0, None
+        return None, None
+
+    def download_file(self, source, file_id, file_name, mime_type,
+                      progress=None, revision=None):
+        """
+        downloads a file in chunks of chunksize bytes that are written to
+        disk as they arrive. An interrupted download continues with a
+        Range request from the bytes in the partial file if the file is
+        still at the revision the partial file was written from
+
+        :param source: the local directory
+        :param file_id: the id of the file
+        :param file_name: the name of the file
+        :param mime_type: the mime type of the file
+        :param progress: function called as progress(file_name, bytes,
+                         total) after each chunk
+        :param revision: dict with the REVISION_FIELDS of the file, they
+                         are requested if it is None
+        :return: the path of the downloaded file
+        """
         filepath = source + '/' + file_name + mimetypes.guess_extension(mime_type)
+        partial = filepath + DOWNLOAD_PARTIAL
+        revision_file = filepath + DOWNLOAD_REVISION
         request = self.driveService.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print("Download %d%%." % int(status.progress() * 100))
-        with io.open(filepath, 'wb') as f:
-            fh.seek(0)
-            f.write(fh.read())
+        chunksize = self.transfer['chunksize']
+
+        if revision is None:
+            revision = self.driveService.files().get(
+                fileId=file_id, fields=', '.join(REVISION_FIELDS)).execute()
+        revision = {key: revision.get(key) for key in REVISION_FIELDS}
+        if os.path.isfile(partial) and \
+                read_checkpoint(revision_file) == revision:
+            offset = os.path.getsize(partial)
+        else:
+            offset = 0
+            write_checkpoint(revision_file, revision)
+        with open(partial, 'ab' if offset > 0 else 'wb') as f:
+            while True:
+                headers = {'range': 'bytes={start}-{end}'.format(
+                    start=offset, end=offset + chunksize - 1)}
+                response, content = request.http.request(
+                    request.uri, method='GET', headers=headers)
+                if response.status == 416:
+                    # the partial file is complete or longer than the file
+                    total = None
+                    if 'content-range' in response:
+                        total = int(response['content-range'].split('/')[-1])
+                    if offset == total:
+                        break
+                    if offset == 0:
+                        raise HttpError(response, content, uri=request.uri)
+                    f.truncate(0)
+                    offset = 0
+                    continue
+                if response.status not in [200, 206]:
+                    raise HttpError(response, content, uri=request.uri)
+                if response.status == 200:
+                    # the range was ignored and the whole file was sent
+                    f.truncate(0)
+                    offset = 0
+                f.write(content)
+                offset += len(content)
+                if 'content-range' in response:
+                    total = int(response['content-range'].split('/')[-1])
+                else:
+                    total = offset
+                if progress is not None:
+                    progress(file_name, offset, total)
+                if offset >= total:
+                    break
+        os.replace(partial, filepath)
+        os.remove(revision_file)
         return filepath
 
 
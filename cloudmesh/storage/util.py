@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+from concurrent.futures import wait
+
+from cloudmesh.common.util import path_expand
+
+SIZE_UNITS = {
+    '': 1,
+    'B': 1,
+    'KB': 1024,
+    'MB': 1024 ** 2,
+    'GB': 1024 ** 3,
+    'KIB': 1024,
+    'MIB': 1024 ** 2,
+    'GIB': 1024 ** 3,
+}
+
+
+def size_in_bytes(size):
+    """
+    converts a size such as 8388608, "8MB" or "8 MiB" into bytes
+
+    :param size: int or string
+    :return: int
+    """
+    if isinstance(size, int):
+        return size
+    value = str(size).strip().upper()
+    number = value.rstrip('KMGIB ')
+    unit = value[len(number):].strip()
+    if unit not in SIZE_UNITS:
+        raise ValueError("invalid size {size}".format(size=size))
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+def merge_settings(defaults, settings=None):
+    """
+    merges the transfer section of the yaml file or the transfer settings
+    of a single call into the defaults
+
+    :param defaults: dict with all settings
+    :param settings: dict with the settings that are changed or None
+    :return: dict
+    """
+    merged = dict(defaults)
+    for key, value in (settings or {}).items():
+        if key not in defaults:
+            raise ValueError("unknown transfer setting {key}".format(key=key))
+        merged[key] = value
+    return merged
+
+
+def checkpoint_path(directory, source, suffix):
+    """
+    returns the name of the checkpoint file of a transfer. The name is
+    the SHA-1 of the source, so that the same transfer finds it again and
+    a changed source gets a new one
+
+    :param directory: the checkpoint directory, e.g. ~/.cloudmesh/box
+    :param source: dict describing the transfer, e.g. path, size, mtime
+    :param suffix: the suffix of the file
+    :return: the path of the checkpoint file
+    """
+    directory = path_expand(directory)
+    os.makedirs(directory, exist_ok=True)
+    name = hashlib.sha1(json.dumps(source, sort_keys=True).encode())
+    return os.path.join(directory, name.hexdigest() + suffix)
+
+
+def read_checkpoint(checkpoint_file):
+    """
+    reads a JSON checkpoint
+
+    :param checkpoint_file: the checkpoint file
+    :return: the checkpoint, None if it does not exist or is unreadable
+    """
+    try:
+        with open(checkpoint_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_checkpoint(checkpoint_file, checkpoint):
+    """
+    writes a JSON checkpoint. It is written to a temporary file first, so
+    that a crash never leaves a truncated checkpoint behind
+
+    :param checkpoint_file: the checkpoint file
+    :param checkpoint: the JSON serializable checkpoint
+    """
+    with open(checkpoint_file + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def raise_failed(futures):
+    """
+    raises the exception of a failed future, so that a transfer stops
+    early instead of after the whole source has been read
+
+    :param futures: the futures that were not done at the last check
+    :return: set of the futures that are still not done
+    """
+    done, pending = wait(futures, timeout=0)
+    for future in done:
+        future.result()
+    return pending
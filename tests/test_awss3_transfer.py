@@ -0,0 +1,392 @@
+###############################################################
+# pytest -v --capture=no tests/test_awss3_transfer.py
+# pytest -v  tests/test_awss3_transfer.py
+# pytest -v --capture=no -v --nocapture tests/test_awss3_transfer.py:Test_awss3_transfer.<METHIDNAME>
+#
+# The provider runs against an in memory S3 provided by moto, no AWS
+# account is needed
+###############################################################
+import io
+import json
+import os
+import tempfile
+import threading
+
+import boto3
+import botocore
+import pytest
+from moto import mock_aws
+
+import cloudmesh.storage.provider.awss3.Provider
+from cloudmesh.storage.provider.awss3.RemoteFile import RemoteFile
+from cloudmesh.common.util import HEADING
+from cloudmesh.common.util import writefile
+
+BUCKET = "cloudmesh-transfer"
+MB = 1024 ** 2
+
+CONFIG = """
+cloudmesh:
+  storage:
+    awss3:
+      cm:
+        heading: aws
+        host: amazon.aws.com
+        label: aws
+        kind: awsS3
+        version: TBD
+      default:
+        directory: TBD
+      credentials:
+        access_key_id: testing
+        secret_access_key: testing
+        container: {bucket}
+        region: us-east-1
+""".format(bucket=BUCKET)
+
+
+def local_dir():
+    # the provider strips the leading / of local paths, so the temporary
+    # directories are given relative to the working directory
+    return os.path.relpath(tempfile.mkdtemp())
+
+
+class RequestCounter(object):
+    """
+    counts the S3 API calls issued by the clients of a provider and
+    records the Prefix of each listing
+    """
+
+    def __init__(self, *clients):
+        self.calls = {}
+        self.prefixes = []
+        for client in clients:
+            client.meta.events.register('before-call.s3', self.count)
+
+    def count(self, model, params, **kwargs):
+        self.calls[model.name] = self.calls.get(model.name, 0) + 1
+        if model.name == 'ListObjectsV2':
+            self.prefixes.append(params['query_string']['prefix'])
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls = {}
+        self.prefixes = []
+
+
+@pytest.mark.incremental
+class Test_awss3_transfer:
+
+    def setup_class(self):
+        self.mock = mock_aws()
+        self.mock.start()
+
+        self.config = os.path.join(tempfile.mkdtemp(), "cloudmesh4.yaml")
+        writefile(self.config, CONFIG)
+
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        self.p = cloudmesh.storage.provider.awss3.Provider.Provider(
+            service="awss3", config=self.config)
+        self.counter = RequestCounter(self.p.s3_client,
+                                      self.p.s3_resource.meta.client)
+
+    def teardown_class(self):
+        self.mock.stop()
+
+    def names(self, directory, filename, recursive):
+        self.counter.reset()
+        found = self.p.search(self.p.service, directory, filename, recursive)
+        return sorted(entry["fileName"] for entry in found)
+
+    def test_01_search(self):
+        HEADING()
+        for key in ["search/a.txt", "search/b.csv", "search/sub/a.txt",
+                    "search/sub/deep/c.txt", "search/other/a.log"]:
+            self.p.s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+
+        # only the files of the directory, S3 returns the keys that
+        # start with the name
+        assert self.names("/search", "a.txt", False) == ["search/a.txt"]
+        assert self.counter.prefixes == ["search/a.txt"]
+
+        # the files of all subdirectories
+        assert self.names("/search", "a.txt", True) == \
+            ["search/a.txt", "search/sub/a.txt"]
+        assert self.counter.prefixes == ["search/"]
+        assert self.names("/search", "x.txt", True) == []
+
+    def test_02_search_glob(self):
+        HEADING()
+        assert self.names("/search", "*.txt", False) == ["search/a.txt"]
+        assert self.names("/search", "*.txt", True) == \
+            ["search/a.txt", "search/sub/a.txt", "search/sub/deep/c.txt"]
+        assert self.names("/search", "a.*", True) == \
+            ["search/a.txt", "search/other/a.log", "search/sub/a.txt"]
+        assert self.names("/search", "[bc].*", True) == \
+            ["search/b.csv", "search/sub/deep/c.txt"]
+
+    def test_03_search_path(self):
+        HEADING()
+        # a pattern with a / is matched against the path in the directory
+        assert self.names("/search", "sub/*.txt", False) == \
+            ["search/sub/a.txt"]
+        assert self.names("/search", "sub/*.txt", True) == \
+            ["search/sub/a.txt", "search/sub/deep/c.txt"]
+        assert self.counter.prefixes == ["search/sub/"]
+        assert self.names("/search", "sub/deep/c.txt", True) == \
+            ["search/sub/deep/c.txt"]
+        assert self.counter.prefixes == ["search/sub/deep/c.txt"]
+
+    def test_04_search_prefix(self):
+        HEADING()
+        for i in range(1500):
+            self.p.s3_client.put_object(
+                Bucket=BUCKET, Key="prefix/data-{i:04d}.csv".format(i=i),
+                Body=b"x")
+        self.p.s3_client.put_object(Bucket=BUCKET, Key="prefix/readme.txt",
+                                    Body=b"x")
+
+        # the literal part of the pattern is the Prefix, the 1500 data
+        # files are not listed
+        assert self.names("/prefix", "readme*", False) == \
+            ["prefix/readme.txt"]
+        assert self.counter.prefixes == ["prefix/readme"]
+
+        found = self.names("/prefix", "data-0*.csv", False)
+        assert len(found) == 1000
+        assert self.counter.prefixes == ["prefix/data-0"]
+        found = self.names("/prefix", "data-1?[0-4]?.csv", False)
+        assert len(found) == 250
+        assert self.counter.prefixes == ["prefix/data-1"]
+
+        # a recursive search by basename lists the whole directory, a
+        # page has 1000 keys
+        found = self.names("/prefix", "data-*.csv", True)
+        assert len(found) == 1500
+        assert self.counter.prefixes == ["prefix/", "prefix/"]
+
+    def test_05_create_dir(self):
+        HEADING()
+        for i in range(3):
+            self.p.s3_client.put_object(
+                Bucket=BUCKET, Key="dir3/file{i}.txt".format(i=i), Body=b"x")
+        self.counter.reset()
+        created = self.p.create_dir(self.p.service, "/dir3")
+        assert len(created) == 0
+        # a single MaxKeys=1 probe, independent of the size of dir3
+        assert self.counter.total() == 1
+
+    def test_06_put_incremental(self):
+        HEADING()
+        local = local_dir()
+        for i in range(3):
+            writefile(os.path.join(local, "file{i}.txt".format(i=i)),
+                      "x" * 1024)
+        with open(os.path.join(local, "big.bin"), "wb") as f:
+            f.write(os.urandom(12 * MB))
+        # s3transfer raises parts below 5MB to 5MB, the ETag of big.bin
+        # has 3 parts and not 12
+        transfer = {"multipart_threshold": "1MB",
+                    "multipart_chunksize": "1MB"}
+        uploaded = self.p.put(self.p.service, local, "/incremental",
+                              transfer=transfer, incremental=True)
+        etags = {os.path.basename(entry["fileName"]): entry["eTag"]
+                 for entry in uploaded}
+        assert not any(entry["skipped"] for entry in uploaded)
+        assert etags["big.bin"].endswith('-3"')
+
+        # same size, different content
+        writefile(os.path.join(local, "file0.txt"), "y" * 1024)
+        self.counter.reset()
+        contents = self.p.put(self.p.service, local, "/incremental",
+                              transfer=transfer, incremental=True)
+        skipped = {os.path.basename(entry["fileName"]): entry["skipped"]
+                   for entry in contents}
+        assert skipped == {"file0.txt": False, "file1.txt": True,
+                           "file2.txt": True, "big.bin": True}
+        assert self.counter.calls.get("PutObject", 0) == 1
+        assert "CreateMultipartUpload" not in self.counter.calls
+
+    def test_07_get_resume(self):
+        HEADING()
+        data = os.urandom(12 * MB)
+        self.p.s3_client.put_object(Bucket=BUCKET, Key="resume/big.bin",
+                                    Body=data)
+        filename = os.path.join(local_dir(), "big.bin")
+        transfer = {"multipart_threshold": "1MB",
+                    "multipart_chunksize": "1MB",
+                    "max_concurrency": 2}
+
+        # interrupt the download at the fifth range
+        download_range = self.p.download_range
+        calls = []
+        fetched = []
+        lock = threading.Lock()
+
+        def interrupted(*args):
+            with lock:
+                calls.append(args)
+                failed = len(calls) == 5
+            if failed:
+                raise ConnectionError("interrupted")
+            download_range(*args)
+            fetched.append(args)
+
+        self.p.download_range = interrupted
+        try:
+            with pytest.raises(ConnectionError):
+                self.p.get(self.p.service, "/resume/big.bin", filename,
+                           transfer=transfer)
+        finally:
+            del self.p.download_range
+        assert os.path.isfile(filename + ".cmdownload")
+
+        # the ranges that were queued behind the failed one are not
+        # fetched, every range that was fetched is in the checkpoint
+        assert len(calls) < 12
+        with open(filename + ".cmdownload") as f:
+            done = json.load(f)["done"]
+        assert sorted(done) == sorted(args[3] // MB for args in fetched)
+
+        # only the ranges that are not in the checkpoint are fetched
+        self.counter.reset()
+        self.p.get(self.p.service, "/resume/big.bin", filename,
+                   transfer=transfer)
+        assert self.counter.calls["GetObject"] == 12 - len(fetched)
+        assert not os.path.isfile(filename + ".cmdownload")
+        with open(filename, "rb") as f:
+            assert f.read() == data
+
+    def test_08_put_stream(self):
+        HEADING()
+        data = os.urandom(12 * MB)
+        transfer = {"multipart_chunksize": "5MB", "max_concurrency": 2}
+
+        # a file like object in 3 parts
+        self.counter.reset()
+        uploaded = self.p.put_stream("/stream/file.bin", io.BytesIO(data),
+                                     transfer=transfer)
+        assert uploaded[0]["contentLength"] == str(len(data))
+        assert self.counter.calls["UploadPart"] == 3
+        assert b"".join(self.p.get_stream("/stream/file.bin")) == data
+
+        # an iterator of chunks that are smaller than a part
+        chunks = (data[i:i + 100000] for i in range(0, len(data), 100000))
+        self.p.put_stream("/stream/iterator.bin", chunks, transfer=transfer)
+        assert b"".join(self.p.get_stream("/stream/iterator.bin",
+                                          chunksize=MB)) == data
+
+        # a stream that fits into one part is a single PutObject
+        self.counter.reset()
+        self.p.put_stream("/stream/small.bin", iter([b"x" * 1024]))
+        assert self.counter.calls.get("PutObject") == 1
+        assert "CreateMultipartUpload" not in self.counter.calls
+        assert b"".join(self.p.get_stream("/stream/small.bin")) == \
+            b"x" * 1024
+
+    def test_09_put_stream_fail_early(self):
+        HEADING()
+        part = os.urandom(5 * MB)
+        read = []
+
+        def stream():
+            for i in range(20):
+                read.append(i)
+                yield part
+
+        def fail(params, **kwargs):
+            if params["query_string"]["partNumber"] == 2:
+                raise ConnectionError("part 2 failed")
+
+        events = self.p.s3_client.meta.events
+        events.register("before-call.s3.UploadPart", fail)
+        self.counter.reset()
+        try:
+            with pytest.raises(ConnectionError):
+                self.p.put_stream("/stream/failed.bin", stream(),
+                                  transfer={"max_concurrency": 2})
+        finally:
+            events.unregister("before-call.s3.UploadPart", fail)
+        # the failure of part 2 stops reading the stream
+        assert len(read) < 10
+        assert self.counter.calls["AbortMultipartUpload"] == 1
+
+    def test_10_open(self):
+        HEADING()
+        data = os.urandom(10 * MB)
+        self.p.s3_client.put_object(Bucket=BUCKET, Key="open/file.bin",
+                                    Body=data)
+        self.counter.reset()
+        with self.p.open("/open/file.bin", block_size=MB,
+                         readahead=4) as f:
+            # the footer is a single ranged GET
+            f.seek(-8, io.SEEK_END)
+            assert f.read(8) == data[-8:]
+            assert f.requests == 1
+
+            # a seek into the middle of a block
+            f.seek(MB + 10)
+            assert f.tell() == MB + 10
+            assert f.read(100) == data[MB + 10:MB + 110]
+            assert f.requests == 2
+
+            # a sequential read of the whole file fetches block 0, block
+            # 1 is cached and each following request reads ahead 4 blocks
+            f.seek(0)
+            assert f.read() == data
+            assert f.requests == 5
+        assert self.counter.calls == {"HeadObject": 1, "GetObject": 5}
+
+        # the object is overwritten with a shorter one while it is open
+        with self.p.open("/open/file.bin", block_size=MB) as f:
+            assert f.read(MB) == data[:MB]
+            self.p.s3_client.put_object(Bucket=BUCKET, Key="open/file.bin",
+                                        Body=data[:2 * MB + 5])
+            f.seek(5 * MB)
+            with pytest.raises(botocore.exceptions.ClientError) as e:
+                f.read(MB)
+            assert e.value.response["Error"]["Code"] == "PreconditionFailed"
+
+        # an object that is shorter than its size fails instead of hanging
+        f = RemoteFile(self.p, "open/file.bin", 3 * MB, block_size=MB)
+        with pytest.raises(IOError):
+            f.read()
+
+    def test_11_sibling_prefixes(self):
+        HEADING()
+        for key in ["boundary/dir1/a.txt", "boundary/dir10/b.txt",
+                    "boundary/dir1.txt", "boundary/dir1x/c.txt"]:
+            self.p.s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+        siblings = ["boundary/dir1.txt", "boundary/dir10/b.txt",
+                    "boundary/dir1x/c.txt"]
+
+        # keys that only share the prefix of dir1 are not part of it
+        for recursive in [False, True]:
+            contents = self.p.list(self.p.service, "/boundary/dir1",
+                                   recursive)
+            assert [entry["fileName"] for entry in contents] == \
+                ["boundary/dir1/a.txt"]
+        contents = self.p.list(self.p.service, "/boundary/dir1.txt", True)
+        assert [entry["fileName"] for entry in contents] == \
+            ["boundary/dir1.txt"]
+
+        local = local_dir()
+        self.p.get(self.p.service, "/boundary/dir1", local, True)
+        assert os.listdir(local) == ["a.txt"]
+
+        # a trailing slash names the same directory
+        contents = self.p.list(self.p.service, "/boundary/dir1/", False)
+        assert [entry["fileName"] for entry in contents] == \
+            ["boundary/dir1/a.txt"]
+        local = local_dir()
+        self.p.get(self.p.service, "/boundary/dir1/", local, False)
+        assert os.listdir(local) == ["a.txt"]
+
+        deleted = self.p.delete(self.p.service, "/boundary/dir1", True)
+        assert [entry["fileName"] for entry in deleted] == \
+            ["boundary/dir1/a.txt"]
+        remaining = self.p.list(self.p.service, "/boundary", True)
+        assert sorted(entry["fileName"] for entry in remaining) == siblings
@@ -0,0 +1,400 @@
+###############################################################
+# pytest -v --capture=no tests/test_azure_transfer.py
+# pytest -v  tests/test_azure_transfer.py
+# pytest -v --capture=no -v --nocapture tests/test_azure_transfer.py:Test_azure_transfer.<METHIDNAME>
+#
+# The transfers run against an in memory blob service that records
+# the requests of the provider, no Azure account or emulator is needed
+###############################################################
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from datetime import timezone
+
+import pytest
+from azure.common import AzureMissingResourceHttpError
+from azure.storage.blob.models import Blob
+from azure.storage.blob.models import BlobBlock
+from azure.storage.blob.models import BlobBlockList
+from azure.storage.blob.models import BlobPrefix
+from azure.storage.blob.models import ResourceProperties
+
+import cloudmesh.storage.provider.azureblob.Provider
+from cloudmesh.common.util import HEADING
+from cloudmesh.common.util import writefile
+from cloudmesh.storage.util import read_checkpoint
+
+CONTAINER = "cloudmesh-transfer"
+KB = 1024
+
+CONFIG = """
+cloudmesh:
+  storage:
+    azureblob:
+      cm:
+        heading: Azure
+        host: azure.com
+        label: Azure
+        kind: azureblob
+        version: TBD
+      default:
+        directory: TBD
+      credentials:
+        account_name: TBD
+        account_key: TBD
+        container: {container}
+        connection_string: "UseDevelopmentStorage=true"
+""".format(container=CONTAINER)
+
+# small blobs are transferred in blocks and ranges, a single connection
+# per blob makes the order of the requests predictable
+TRANSFER = {
+    'block_size': KB,
+    'single_put_size': 4 * KB,
+    'single_get_size': 4 * KB,
+    'max_connections': 1,
+    'max_workers': 4
+}
+
+
+class FakeBlobService(object):
+    """
+    keeps the blobs of a container in memory and records the calls of
+    the provider as (method, blob name, detail) tuples
+    """
+
+    def __init__(self, **kwargs):
+        self.blobs = {}
+        self.uncommitted = {}
+        self.calls = []
+        self.counts = {}
+        self.fail_at = None
+        self.corrupt = None
+        self.writing = set()
+        self.overlap = False
+        self.lock = threading.Lock()
+        self.request_callback = None
+
+    def call(self, method, name, detail=None):
+        # records a call, the n-th call of fail_at = (method, n) fails.
+        # Like the blob service each call is passed to request_callback
+        if self.request_callback is not None:
+            self.request_callback(None)
+        with self.lock:
+            self.calls.append((method, name, detail))
+            self.counts[method] = self.counts.get(method, 0) + 1
+            failed = self.fail_at == (method, self.counts[method])
+        if failed:
+            raise ConnectionError("{method} interrupted".format(
+                method=method))
+
+    def create(self, name, data, content_md5=None):
+        if content_md5 is None:
+            content_md5 = base64_md5(data)
+        self.blobs[name] = (data, content_md5)
+
+    def blob(self, name, content=None):
+        data, content_md5 = self.blobs[name]
+        blob = Blob(name=name, content=content)
+        blob.properties.content_length = len(data)
+        blob.properties.etag = '"{md5}"'.format(
+            md5=hashlib.md5(data).hexdigest())
+        blob.properties.last_modified = datetime.now(timezone.utc)
+        blob.properties.creation_time = blob.properties.last_modified
+        blob.properties.content_settings.content_md5 = content_md5
+        return blob
+
+    def get_blob_properties(self, container, name):
+        self.call("get_blob_properties", name)
+        if name not in self.blobs:
+            raise AzureMissingResourceHttpError("not found", 404)
+        return self.blob(name)
+
+    def list_blobs(self, container, prefix=None, delimiter=None):
+        self.call("list_blobs", prefix)
+        folders = set()
+        for name in sorted(self.blobs):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter is not None and delimiter in rest:
+                folder = prefix + rest.split(delimiter)[0] + delimiter
+                if folder not in folders:
+                    folders.add(folder)
+                    blob_prefix = BlobPrefix()
+                    blob_prefix.name = folder
+                    yield blob_prefix
+                continue
+            yield self.blob(name)
+
+    def create_blob_from_path(self, container, name, file_path,
+                              max_connections=2):
+        self.call("create_blob_from_path", name, file_path)
+        with open(file_path, "rb") as f:
+            self.create(name, f.read())
+        properties = ResourceProperties()
+        properties.last_modified = datetime.now(timezone.utc)
+        properties.etag = self.blob(name).properties.etag
+        return properties
+
+    def delete_blob(self, container, name):
+        self.call("delete_blob", name)
+        with self.lock:
+            if self.blobs.pop(name, None) is None:
+                raise AzureMissingResourceHttpError("not found", 404)
+
+    def get_blob_to_path(self, container, name, file_path,
+                         max_connections=2):
+        self.call("get_blob_to_path", name, file_path)
+        with self.lock:
+            self.overlap = self.overlap or file_path in self.writing
+            self.writing.add(file_path)
+        data = self.blobs[name][0]
+        with open(file_path, "wb") as f:
+            # a slow transfer, another download of the same path would
+            # write while this one is still open
+            f.write(data[:len(data) // 2])
+            time.sleep(0.1)
+            f.write(data[len(data) // 2:])
+        with self.lock:
+            self.writing.discard(file_path)
+        return self.blob(name)
+
+    def get_blob_to_bytes(self, container, name, start_range=None,
+                          end_range=None, if_match=None,
+                          validate_content=False):
+        self.call("get_blob_to_bytes", name, start_range)
+        content = self.blobs[name][0][start_range:end_range + 1]
+        if self.corrupt == (name, start_range):
+            content = bytes(b ^ 0xff for b in content)
+        return self.blob(name, content=content)
+
+    def get_block_list(self, container, name, block_list_type=None):
+        self.call("get_block_list", name)
+        if name not in self.uncommitted:
+            raise AzureMissingResourceHttpError("not found", 404)
+        block_list = BlobBlockList()
+        block_list.uncommitted_blocks = [
+            BlobBlock(id=block_id, state="Uncommitted")
+            for block_id in self.uncommitted[name]]
+        return block_list
+
+    def put_block(self, container, name, block, block_id,
+                  validate_content=False):
+        self.call("put_block", name, block_id)
+        with self.lock:
+            self.uncommitted.setdefault(name, {})[block_id] = block
+
+    def put_block_list(self, container, name, block_list,
+                       content_settings=None):
+        self.call("put_block_list", name)
+        blocks = self.uncommitted.pop(name)
+        self.create(name, b"".join(blocks[block.id] for block in block_list),
+                    content_md5=content_settings.content_md5)
+        properties = ResourceProperties()
+        properties.last_modified = datetime.now(timezone.utc)
+        properties.etag = self.blob(name).properties.etag
+        return properties
+
+
+def base64_md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+class Test_azure_transfer:
+
+    def setup_method(self):
+        self.config = os.path.join(tempfile.mkdtemp(), "cloudmesh4.yaml")
+        writefile(self.config, CONFIG)
+        self.local = tempfile.mkdtemp()
+        self.checkpoints = tempfile.mkdtemp()
+
+    def provider(self, monkeypatch):
+        module = cloudmesh.storage.provider.azureblob.Provider
+        monkeypatch.setattr(module, "BlockBlobService", FakeBlobService)
+        monkeypatch.setattr(module, "CHECKPOINT_DIR", self.checkpoints)
+        monkeypatch.setattr(module, "RANGE_SIZE", KB)
+        p = module.Provider(service="azureblob", config=self.config)
+        p.transfer.update(TRANSFER)
+        return p, p.storage_service
+
+    def test_01_get_same_name(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        service.create("dup/a/x.txt", b"a" * KB)
+        service.create("dup/b/x.txt", b"b" * KB)
+        service.create("dup/c/y.txt", b"c" * KB)
+
+        contents = p.get(source=self.local, destination="/dup",
+                         recursive=True)
+        assert len(contents) == 3
+        # both blobs are downloaded to x.txt one after another, the last
+        # one of the listing is kept
+        assert not service.overlap
+        assert sorted(os.listdir(self.local)) == ["x.txt", "y.txt"]
+        with open(os.path.join(self.local, "x.txt"), "rb") as f:
+            assert f.read() == b"b" * KB
+
+    def test_02_upload_resume(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        data = os.urandom(10 * KB)
+        path = os.path.join(self.local, "big.bin")
+        with open(path, "wb") as f:
+            f.write(data)
+        block_ids = {"{index:08d}".format(index=i) for i in range(10)}
+
+        # interrupt the upload at the fifth block
+        service.fail_at = ("put_block", 5)
+        with pytest.raises(ConnectionError):
+            p.upload_file(path, "big.bin")
+        received = set(service.uncommitted["big.bin"])
+        assert "00000004" not in received
+        checkpoints = os.listdir(self.checkpoints)
+        assert len(checkpoints) == 1
+        with open(os.path.join(self.checkpoints, checkpoints[0])) as f:
+            assert {line.strip() for line in f} == received
+
+        # a block in the checkpoint that the service no longer has is
+        # sent again, the other received blocks are not
+        del service.uncommitted["big.bin"]["00000001"]
+        service.fail_at = None
+        service.calls = []
+        p.upload_file(path, "big.bin")
+        sent = {block_id for method, name, block_id in service.calls
+                if method == "put_block"}
+        assert sent == block_ids - received | {"00000001"}
+        assert service.blobs["big.bin"] == (data, base64_md5(data))
+        assert os.listdir(self.checkpoints) == []
+
+    def test_03_download_resume(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        data = os.urandom(10 * KB)
+        service.create("big.bin", data)
+        path = os.path.join(self.local, "big.bin")
+
+        # interrupt the download at the fourth range
+        service.fail_at = ("get_blob_to_bytes", 4)
+        with pytest.raises(ConnectionError):
+            p.download_file("big.bin", path)
+        assert read_checkpoint(path + ".cmdownload")["offset"] == 3 * KB
+
+        # bytes written after the checkpoint are truncated, only the
+        # ranges after the offset are read
+        with open(path, "ab") as f:
+            f.write(b"x" * 100)
+        service.fail_at = None
+        service.calls = []
+        p.download_file("big.bin", path)
+        starts = [start for method, name, start in service.calls
+                  if method == "get_blob_to_bytes"]
+        assert starts == list(range(3 * KB, 10 * KB, KB))
+        with open(path, "rb") as f:
+            assert f.read() == data
+        assert not os.path.isfile(path + ".cmdownload")
+
+    def test_04_download_corrupted(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        service.create("bad.bin", os.urandom(10 * KB))
+        service.corrupt = ("bad.bin", 2 * KB)
+        path = os.path.join(self.local, "bad.bin")
+
+        with pytest.raises(ValueError):
+            p.download_file("bad.bin", path)
+        assert not os.path.isfile(path)
+        assert not os.path.isfile(path + ".cmdownload")
+
+    def test_05_list_subfolders(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        for name in ["tree/a.txt", "tree/sub/b.txt", "tree/sub/c/d.txt",
+                     "tree/sub2/e.txt"]:
+            service.create(name, b"x")
+
+        # the subfolders are entries of the result after the blobs
+        contents = p.list(source="/tree")
+        assert [entry["cm"]["name"] for entry in contents] == \
+            ["tree/a.txt", "tree/sub", "tree/sub2"]
+        assert [entry["cm"].get("directory", False)
+                for entry in contents] == [False, True, True]
+
+    def test_06_properties_cache(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        service.create("cache/a.txt", b"a")
+
+        # the listing caches the properties of the blobs, the stat of a
+        # listed blob sends no request
+        assert len(p.list(source="/cache")) == 1
+        p.reset_counters()
+        service.calls = []
+        contents = p.list(source="/cache/a.txt")
+        assert [entry["cm"]["size"] for entry in contents] == [1]
+        assert service.calls == []
+        assert p.requests == 0
+        assert p.cache_hits > 0
+
+        # the properties are requested again when they expired
+        p.cache_ttl = 0.05
+        time.sleep(0.1)
+        p.reset_counters()
+        p.list(source="/cache/a.txt")
+        assert ("get_blob_properties", "cache/a.txt", None) in service.calls
+        assert p.requests == 1
+
+    def test_07_cache_invalidation(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        service.create("cache/a.txt", b"a")
+        assert p.blob_properties("cache/a.txt").properties.content_length \
+            == 1
+
+        # a blob that this process uploads is requested again
+        path = os.path.join(self.local, "a.txt")
+        writefile(path, "new content")
+        p.put(source=path, destination="/cache")
+        service.calls = []
+        blob = p.blob_properties("cache/a.txt")
+        assert blob.properties.content_length == len("new content")
+        assert service.calls == [("get_blob_properties", "cache/a.txt", None)]
+
+        # a deleted blob is not found in the cache
+        p.delete(source="/cache/a.txt")
+        assert "cache/a.txt" not in service.blobs
+        assert p.blob_properties("cache/a.txt") is None
+
+    def test_08_delete_folder(self, monkeypatch):
+        HEADING()
+        p, service = self.provider(monkeypatch)
+        module = cloudmesh.storage.provider.azureblob.Provider
+        monkeypatch.setattr(module, "DELETE_BATCH", 2)
+        names = ["del/{i}.txt".format(i=i) for i in range(4)] + \
+            ["del/sub/4.txt", "keep/5.txt"]
+        for name in names:
+            service.create(name, b"x")
+
+        # every listed blob is deleted in batches of two and removed from
+        # the properties cache
+        deleted = p.delete(source="/del", recursive=True)
+        assert sorted(entry["cm"]["name"] for entry in deleted) == \
+            names[:5]
+        assert not any("error" in entry["cm"] for entry in deleted)
+        assert list(service.blobs) == ["keep/5.txt"]
+        assert not any(name in p.cache for name in names[:5])
+
+        # a blob that is already gone does not stop the other deletes
+        for name in names[:5]:
+            service.create(name, b"x")
+        blobs = list(p.list_folder("del", recursive=True))
+        del service.blobs["del/1.txt"]
+        obj_list, errors = p.delete_blobs(iter(blobs))
+        assert len(obj_list) == 5
+        assert list(errors) == ["del/1.txt"]
+        assert list(service.blobs) == ["keep/5.txt"]
+        assert not any(name in p.cache for name in names[:5])
@@ -0,0 +1,166 @@
+###############################################################
+# pytest -v --capture=no tests/test_benchmark_awss3.py
+# pytest -v  tests/test_benchmark_awss3.py
+# pytest -v --capture=no -v --nocapture tests/test_benchmark_awss3.py:Test_benchmark_awss3.<METHIDNAME>
+#
+# The benchmark runs against an in memory S3 provided by moto, no AWS
+# account is needed. By default it uses 1000 keys so that it is quick
+# enough for a normal test run, the full benchmark is run with
+#
+#   export CLOUDMESH_BENCHMARK_KEYS=100000
+###############################################################
+import os
+import tempfile
+from pprint import pprint
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import cloudmesh.storage.provider.awss3.Provider
+from cloudmesh.common.StopWatch import StopWatch
+from cloudmesh.common.util import HEADING
+from cloudmesh.common.util import writefile
+
+KEYS = int(os.environ.get("CLOUDMESH_BENCHMARK_KEYS", 1000))
+BUCKET = "cloudmesh-benchmark"
+
+CONFIG = """
+cloudmesh:
+  storage:
+    awss3:
+      cm:
+        heading: aws
+        host: amazon.aws.com
+        label: aws
+        kind: awsS3
+        version: TBD
+      default:
+        directory: TBD
+      credentials:
+        access_key_id: testing
+        secret_access_key: testing
+        container: {bucket}
+        region: us-east-1
+""".format(bucket=BUCKET)
+
+
+class RequestCounter(object):
+    """
+    counts the S3 API calls issued by the clients of a provider
+    """
+
+    def __init__(self, *clients):
+        self.calls = {}
+        for client in clients:
+            client.meta.events.register('before-call.s3', self.count)
+
+    def count(self, model, **kwargs):
+        self.calls[model.name] = self.calls.get(model.name, 0) + 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls = {}
+
+
+@pytest.mark.incremental
+class Test_benchmark_awss3:
+
+    def setup_class(self):
+        self.mock = mock_aws()
+        self.mock.start()
+
+        self.config = os.path.join(tempfile.mkdtemp(), "cloudmesh4.yaml")
+        writefile(self.config, CONFIG)
+
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+
+        # 10 directories with KEYS / 10 files each, one of them has an
+        # additional level of subdirectories
+        StopWatch.start("populate")
+        for i in range(KEYS):
+            d = i % 10
+            if d == 0:
+                key = "dir{d}/sub{s}/file{i}.txt".format(d=d, s=i % 7, i=i)
+            else:
+                key = "dir{d}/file{i}.txt".format(d=d, i=i)
+            client.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+        StopWatch.stop("populate")
+
+        self.p = cloudmesh.storage.provider.awss3.Provider.Provider(
+            service="awss3", config=self.config)
+        self.counter = RequestCounter(self.p.s3_client,
+                                      self.p.s3_resource.meta.client)
+
+    def teardown_class(self):
+        self.mock.stop()
+
+    def benchmark(self, name, function, *args, **kwargs):
+        self.counter.reset()
+        StopWatch.start(name)
+        result = function(*args, **kwargs)
+        StopWatch.stop(name)
+        print()
+        print("{name}: {t}s, {n} requests".format(
+            name=name, t=StopWatch.get(name), n=self.counter.total()))
+        pprint(self.counter.calls)
+        return result
+
+    def test_01_populate(self):
+        HEADING()
+        print("{n} keys created in {t}s".format(
+            n=KEYS, t=StopWatch.get("populate")))
+
+    def test_02_list_file(self):
+        HEADING()
+        contents = self.benchmark("list file", self.p.list,
+                                  self.p.service, "/dir1/file1.txt")
+        assert len(contents) == 1
+        assert self.counter.total() == 1
+
+    def test_03_list_directory(self):
+        HEADING()
+        contents = self.benchmark("list directory", self.p.list,
+                                  self.p.service, "/dir1")
+        assert len(contents) == KEYS // 10
+        # one request to detect the directory, then one per 1000 keys
+        assert self.counter.total() <= 2 + len(contents) // 1000
+
+    def test_04_list_subdirectory(self):
+        HEADING()
+        contents = self.benchmark("list subdirectory", self.p.list,
+                                  self.p.service, "/dir0/sub3")
+        assert len(contents) > 0
+        assert self.counter.total() <= 2 + len(contents) // 1000
+
+    def test_05_list_recursive(self):
+        HEADING()
+        contents = self.benchmark("list recursive", self.p.list,
+                                  self.p.service, "/dir0", True)
+        assert len(contents) == KEYS // 10
+        assert self.counter.total() <= 1 + len(contents) // 1000
+
+    def test_06_delete_recursive(self):
+        HEADING()
+        deleted = self.benchmark("delete recursive", self.p.delete,
+                                 self.p.service, "/dir2", True)
+        assert len(deleted) == KEYS // 10
+        # one listing page and one DeleteObjects call per 1000 keys
+        assert self.counter.total() <= 1 + 2 * (len(deleted) // 1000 + 1)
+        assert len(self.p.list(self.p.service, "/dir2", True)) == 0
+
+    def test_07_provider_creation(self):
+        HEADING()
+        StopWatch.start("provider")
+        providers = [cloudmesh.storage.provider.awss3.Provider.Provider(
+            service="awss3", config=self.config) for i in range(10)]
+        for p in providers:
+            p.list(p.service, "/dir1/file1.txt")
+        StopWatch.stop("provider")
+        print("10 providers: {t}s".format(t=StopWatch.get("provider")))
+        # all providers share the client of the registry
+        assert len({id(p.s3_client) for p in providers}) == 1
+        assert providers[0].s3_client is self.p.s3_client
@@ -0,0 +1,202 @@
+###############################################################
+# pytest -v --capture=no tests/test_benchmark_azure.py
+# pytest -v  tests/test_benchmark_azure.py
+# pytest -v --capture=no -v --nocapture tests/test_benchmark_azure.py:Test_benchmark_azure.<METHIDNAME>
+#
+# The benchmark runs against the Azurite emulator, start it with
+#
+#   azurite-blob --loose --skipApiVersionCheck
+#
+# The tests are skipped if the emulator is not reachable. By default it
+# uses 1000 blobs so that it is quick enough for a normal test run, the
+# full benchmark is run with
+#
+#   export CLOUDMESH_BENCHMARK_KEYS=100000
+###############################################################
+import os
+import socket
+import tempfile
+from pprint import pprint
+from urllib.parse import urlparse
+
+import pytest
+
+import cloudmesh.storage.provider.azureblob.Provider
+from cloudmesh.common.StopWatch import StopWatch
+from cloudmesh.common.util import HEADING
+from cloudmesh.common.util import writefile
+
+KEYS = int(os.environ.get("CLOUDMESH_BENCHMARK_KEYS", 1000))
+CONTAINER = "cloudmesh-benchmark"
+
+# the well known development account of the emulator
+AZURITE = "DefaultEndpointsProtocol=http;" \
+          "AccountName=devstoreaccount1;" \
+          "AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UV" \
+          "ErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;" \
+          "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+
+CONNECTION = os.environ.get("AZURITE_CONNECTION_STRING", AZURITE)
+
+CONFIG = """
+cloudmesh:
+  storage:
+    azureblob:
+      cm:
+        heading: Azure
+        host: azure.com
+        label: Azure
+        kind: azureblob
+        version: TBD
+      default:
+        directory: TBD
+      credentials:
+        account_name: devstoreaccount1
+        account_key: TBD
+        container: {container}
+        connection_string: "{connection}"
+""".format(container=CONTAINER,
+           connection=CONNECTION)
+
+
+def reachable(connection):
+    # checks that the blob endpoint of a connection string accepts
+    # connections, a connection string without endpoint uses Azure
+    settings = dict(item.split("=", 1)
+                    for item in connection.split(";") if "=" in item)
+    if "BlobEndpoint" not in settings:
+        return True
+    url = urlparse(settings["BlobEndpoint"])
+    try:
+        socket.create_connection(
+            (url.hostname, url.port or (443 if url.scheme == "https" else 80)),
+            timeout=2).close()
+    except OSError:
+        return False
+    return True
+
+
+@pytest.mark.incremental
+class Test_benchmark_azure:
+
+    def setup_class(self):
+        if not reachable(CONNECTION):
+            pytest.skip("the Azurite emulator is not running")
+
+        self.config = os.path.join(tempfile.mkdtemp(), "cloudmesh4.yaml")
+        writefile(self.config, CONFIG)
+
+        self.p = cloudmesh.storage.provider.azureblob.Provider.Provider(
+            service="azureblob", config=self.config)
+        service = self.p.storage_service
+        service.delete_container(CONTAINER)
+        service.create_container(CONTAINER)
+
+        # 10 folders with KEYS / 10 blobs each, one of them has an
+        # additional level of subfolders
+        StopWatch.start("populate")
+        for i in range(KEYS):
+            d = i % 10
+            if d == 0:
+                name = "dir{d}/sub{s}/file{i}.txt".format(d=d, s=i % 7, i=i)
+            else:
+                name = "dir{d}/file{i}.txt".format(d=d, i=i)
+            service.create_blob_from_bytes(CONTAINER, name, b"x")
+        StopWatch.stop("populate")
+
+    def teardown_class(self):
+        self.p.storage_service.delete_container(CONTAINER)
+
+    def benchmark(self, name, function, *args, **kwargs):
+        self.p.reset_counters()
+        StopWatch.start(name)
+        result = function(*args, **kwargs)
+        StopWatch.stop(name)
+        print()
+        print("{name}: {t}s, {n} requests".format(
+            name=name, t=StopWatch.get(name), n=self.p.requests))
+        return result
+
+    def test_01_populate(self):
+        HEADING()
+        print("{n} blobs created in {t}s".format(
+            n=KEYS, t=StopWatch.get("populate")))
+
+    def test_02_list_folder(self):
+        HEADING()
+        contents = self.benchmark("list folder", self.p.list,
+                                  source="/dir1")
+        assert len(contents) == KEYS // 10
+        # cloud_path and one listing request per 5000 blobs
+        assert self.p.requests <= 2 + len(contents) // 5000
+
+    def test_03_list_subfolder(self):
+        HEADING()
+        contents = self.benchmark("list subfolder", self.p.list,
+                                  source="/dir0/sub3")
+        assert len(contents) > 0
+        assert self.p.requests <= 2 + len(contents) // 5000
+
+    def test_04_list_recursive(self):
+        HEADING()
+        contents = self.benchmark("list recursive", self.p.list,
+                                  source="/dir0", recursive=True)
+        assert len(contents) == KEYS // 10
+        assert self.p.requests <= 2 + len(contents) // 5000
+
+    def test_05_search(self):
+        HEADING()
+        contents = self.benchmark("search", self.p.search,
+                                  directory="/dir0/sub3",
+                                  filename="file10.txt", recursive=True)
+        pprint(contents)
+        assert len(contents) == 1
+        assert self.p.requests <= 1 + KEYS // 10 // 7 // 5000
+
+    def test_06_put_recursive(self):
+        HEADING()
+        local = tempfile.mkdtemp()
+        for i in range(100):
+            path = os.path.join(local, "sub{s}".format(s=i % 3),
+                                "file{i}.txt".format(i=i))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writefile(path, "x" * 1024)
+        contents = self.benchmark("put recursive", self.p.put,
+                                  source=local, destination="/upload",
+                                  recursive=True)
+        assert len(contents) == 100
+        assert all(entry["cm"]["throughput"] is not None
+                   for entry in contents)
+        # the folder structure is kept
+        assert len(self.p.list(source="/upload/sub1")) == 33
+
+    def test_07_get_recursive(self):
+        HEADING()
+        local = tempfile.mkdtemp()
+        contents = self.benchmark("get recursive", self.p.get,
+                                  source=local, destination="/dir0",
+                                  recursive=True, keep_structure=True)
+        assert len(contents) == KEYS // 10
+        assert os.path.isfile(os.path.join(local, "sub3", "file10.txt"))
+
+    def test_08_delete_recursive(self):
+        HEADING()
+        deleted = self.benchmark("delete recursive", self.p.delete,
+                                 source="/dir2", recursive=True)
+        assert len(deleted) == KEYS // 10
+        assert not any("error" in entry["cm"] for entry in deleted)
+        assert len(list(self.p.list_folder("dir2", recursive=True))) == 0
+
+    def test_09_list_file(self):
+        HEADING()
+        # the blob may be cached from the listing of dir1
+        self.p.cache.clear()
+        contents = self.benchmark("list file", self.p.list,
+                                  source="/dir1/file1.txt")
+        assert len(contents) == 1
+        # cloud_path and list share the properties of the blob
+        assert self.p.requests == 1
+        contents = self.benchmark("list cached file", self.p.list,
+                                  source="/dir1/file1.txt")
+        assert len(contents) == 1
+        assert self.p.requests == 0
@@ -0,0 +1,424 @@
+###############################################################
+# pytest -v --capture=no tests/test_box_cache.py
+# pytest -v  tests/test_box_cache.py
+# pytest -v --capture=no -v --nocapture tests/test_box_cache.py:Test_box_cache.<METHIDNAME>
+#
+# The provider runs against an in memory Box client that counts its
+# calls, no Box account is needed
+###############################################################
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+from boxsdk.exception import BoxAPIException
+
+import cloudmesh.storage.provider.box.Provider
+from cloudmesh.common.util import HEADING
+from cloudmesh.common.util import writefile
+from cloudmesh.storage.PathCache import PathCache
+
+
+class FakeItem(object):
+    """
+    a file or folder of the fake client, it is returned by the listings
+    as well as by client.file() and client.folder()
+    """
+
+    def __init__(self, client, item_id, name, item_type, content=b""):
+        self.client = client
+        self.id = item_id
+        self.name = name
+        self.type = item_type
+        self.object_type = item_type
+        self.content = content
+        self.size = len(content)
+
+    def get(self):
+        self.client.call("get")
+        return self
+
+    def get_items(self, limit=None, use_marker=False, fields=None):
+        self.client.call("get_items")
+        self.client.fields.append(fields)
+        time.sleep(self.client.delay)
+        return iter(list(self.client.children[self.id]))
+
+    def upload(self, file_path):
+        with open(file_path, "rb") as f:
+            return self.client.add(self.id, os.path.basename(file_path),
+                                   "file", f.read())
+
+    def update_contents(self, file_path):
+        with open(file_path, "rb") as f:
+            self.content = f.read()
+        self.size = len(self.content)
+        return self
+
+    def create_subfolder(self, name):
+        return self.client.add(self.id, name, "folder")
+
+    def create_upload_session(self, file_size, file_name=None):
+        if self.type == "folder":
+            return self.client.new_session(self.id, None, file_name)
+        return self.client.new_session(None, self.id, self.name)
+
+    def download_to(self, writeable_stream):
+        writeable_stream.write(self.content)
+
+    def delete(self):
+        for children in self.client.children.values():
+            if self in children:
+                children.remove(self)
+
+
+class FakeSession(object):
+    """
+    a chunked upload session of the fake client, the parts are kept
+    until the session is committed
+    """
+
+    def __init__(self, client, session_id, folder_id, file_id, name):
+        self.client = client
+        self.id = session_id
+        self.folder_id = folder_id
+        self.file_id = file_id
+        self.name = name
+        self.part_size = client.part_size
+        self.parts = {}
+        # the number of commits that are answered with None
+        self.processing = 0
+
+    def get(self):
+        return self
+
+    def get_parts(self):
+        return iter([dict(part) for offset, (part, data)
+                     in sorted(self.parts.items())])
+
+    def upload_part_bytes(self, part_bytes, offset, total_size):
+        self.client.call("upload_part_bytes", offset)
+        part = {"part_id": "{offset:08x}".format(offset=offset),
+                "offset": offset, "size": len(part_bytes),
+                "sha1": hashlib.sha1(part_bytes).hexdigest()}
+        with self.client.lock:
+            self.parts[offset] = (part, part_bytes)
+        return part
+
+    def commit(self, content_sha1, parts=None):
+        self.client.call("commit")
+        if self.processing > 0:
+            self.processing -= 1
+            return None
+        assert [part["offset"] for part in parts] == sorted(self.parts)
+        content = b"".join(self.parts[part["offset"]][1] for part in parts)
+        assert hashlib.sha1(content).digest() == content_sha1
+        del self.client.sessions[self.id]
+        if self.file_id is None:
+            return self.client.add(self.folder_id, self.name, "file",
+                                   content)
+        item = self.client.items[self.file_id]
+        item.content = content
+        item.size = len(content)
+        return item
+
+
+class UnknownSession(object):
+    """
+    the answer of the fake client for a session that expired
+    """
+
+    def get(self):
+        raise BoxAPIException(404, code="not_found")
+
+
+class FakeClient(object):
+    """
+    keeps a folder tree in memory, the root folder has the id '0'. The
+    calls are counted, the n-th call of fail_at = (method, n) fails
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.children = {}
+        self.sessions = {}
+        self.part_size = 1024
+        self.calls = {"get_items": 0}
+        self.sent = []
+        self.fields = []
+        self.delay = 0
+        self.fail_at = None
+        self.lock = threading.Lock()
+        self.root = FakeItem(self, "0", "All Files", "folder")
+        self.items["0"] = self.root
+        self.children["0"] = []
+
+    def call(self, method, detail=None):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            failed = self.fail_at == (method, self.calls[method])
+            if not failed and method == "upload_part_bytes":
+                self.sent.append(detail)
+        if failed:
+            raise ConnectionError("{method} interrupted".format(
+                method=method))
+
+    def add(self, parent_id, name, item_type, content=b""):
+        item = FakeItem(self, str(len(self.items)), name, item_type, content)
+        self.items[item.id] = item
+        self.children[parent_id].append(item)
+        if item_type == "folder":
+            self.children[item.id] = []
+        return item
+
+    def new_session(self, folder_id, file_id, name):
+        self.call("create_upload_session")
+        session_id = "session{n}".format(
+            n=self.calls["create_upload_session"])
+        session = FakeSession(self, session_id, folder_id, file_id, name)
+        self.sessions[session.id] = session
+        return session
+
+    def upload_session(self, session_id):
+        return self.sessions.get(session_id, UnknownSession())
+
+    def folder(self, folder_id):
+        return self.items[folder_id]
+
+    def file(self, file_id):
+        return self.items[file_id]
+
+
+class Test_box_cache:
+
+    def setup_method(self):
+        module = cloudmesh.storage.provider.box.Provider
+        # the provider is not authenticated, the calls go to the client
+        self.p = module.Provider.__new__(module.Provider)
+        self.p.client = FakeClient()
+        self.p.paths = PathCache(ttl=60, size=module.CACHE_SIZE)
+        self.p.folders = PathCache(ttl=60, size=module.CACHE_SIZE)
+        self.p.transfer = dict(module.TRANSFER_DEFAULTS)
+
+        client = self.p.client
+        data = client.add("0", "data", "folder")
+        client.add(data.id, "a.txt", "file", b"a")
+        client.add(data.id, "b.txt", "file", b"b")
+        self.local = tempfile.mkdtemp()
+
+    def names(self, source):
+        return sorted(entry["name"] for entry in self.p.list(source=source))
+
+    def test_01_repeated_calls(self):
+        HEADING()
+        client = self.p.client
+        assert self.names("/data") == ["a.txt", "b.txt"]
+        # the root folder and data are listed once
+        assert client.calls["get_items"] == 2
+
+        assert self.names("/data") == ["a.txt", "b.txt"]
+        self.p.get(source="/data/a.txt", destination=self.local)
+        self.p.get(source="/data", destination=self.local, recursive=True)
+        self.p.search(directory="/data", filename="b.txt")
+        assert client.calls["get_items"] == 2
+        with open(os.path.join(self.local, "b.txt"), "rb") as f:
+            assert f.read() == b"b"
+
+    def test_02_put(self):
+        HEADING()
+        client = self.p.client
+        self.p.get(source="/data/a.txt", destination=self.local)
+        assert self.p.paths.get("data/a.txt") is not None
+        calls = client.calls["get_items"]
+
+        # a new file is in the next listing of its folder
+        path = os.path.join(self.local, "c.txt")
+        writefile(path, "c")
+        self.p.put(source=path, destination="/data")
+        assert self.names("/data") == ["a.txt", "b.txt", "c.txt"]
+        assert client.calls["get_items"] == calls + 1
+
+        # the cached item of an updated file is replaced
+        path = os.path.join(self.local, "a.txt")
+        writefile(path, "new content")
+        self.p.put(source=path, destination="/data")
+        assert self.p.paths.get("data/a.txt") is None
+        assert self.p.resolve("/data/a.txt").size == len("new content")
+
+    def test_03_delete_and_create_dir(self):
+        HEADING()
+        client = self.p.client
+        assert self.names("/data") == ["a.txt", "b.txt"]
+        assert self.p.resolve("/data/b.txt") is not None
+        calls = client.calls["get_items"]
+
+        self.p.delete(source="/data/b.txt")
+        assert self.p.paths.get("data/b.txt") is None
+        assert self.p.resolve("/data/b.txt") is None
+        assert self.names("/data") == ["a.txt"]
+
+        self.p.create_dir(directory="/data/sub")
+        assert self.names("/data") == ["a.txt", "sub"]
+        assert self.p.resolve("/data/sub").type == "folder"
+        # data is listed again after each change
+        assert client.calls["get_items"] == calls + 2
+
+    def chunked(self, monkeypatch):
+        # files of 4 KB and more are sent in parts of 1 KB
+        module = cloudmesh.storage.provider.box.Provider
+        self.checkpoints = tempfile.mkdtemp()
+        monkeypatch.setattr(module, "CHECKPOINT_DIR", self.checkpoints)
+        monkeypatch.setattr(module, "COMMIT_DELAY", 0)
+        self.p.transfer.update({"chunked_threshold": 4 * 1024,
+                                "max_connections": 1})
+        path = os.path.join(self.local, "large.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(5 * 1024 + 100))
+        return path
+
+    def content(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_04_chunked_resume(self, monkeypatch):
+        HEADING()
+        client = self.p.client
+        path = self.chunked(monkeypatch)
+        offsets = [n * 1024 for n in range(6)]
+
+        # the third part fails, the checkpoint keeps the session
+        client.fail_at = ("upload_part_bytes", 3)
+        assert self.p.put(source=path, destination="/data") is None
+        assert len(os.listdir(self.checkpoints)) == 1
+        sent = client.sent
+        assert offsets[2] not in sent and len(sent) < 5
+
+        # the restart sends the missing parts to the same session
+        client.fail_at = None
+        client.sent = []
+        self.p.put(source=path, destination="/data")
+        assert client.sent == [offset for offset in offsets
+                               if offset not in sent]
+        assert client.calls["create_upload_session"] == 1
+        assert self.p.resolve("/data/large.bin").content == \
+            self.content(path)
+        assert os.listdir(self.checkpoints) == []
+
+    def test_05_chunked_commit(self, monkeypatch):
+        HEADING()
+        module = cloudmesh.storage.provider.box.Provider
+        client = self.p.client
+        path = self.chunked(monkeypatch)
+        create = FakeClient.new_session
+
+        def processing(client, *args, count=2):
+            session = create(client, *args)
+            session.processing = count
+            return session
+
+        # the session is committed again while it is processed
+        monkeypatch.setattr(FakeClient, "new_session", processing)
+        self.p.put(source=path, destination="/data")
+        assert client.calls["commit"] == 3
+        assert self.p.resolve("/data/large.bin").content == \
+            self.content(path)
+        assert os.listdir(self.checkpoints) == []
+
+        # a session that is still processed keeps its checkpoint
+        monkeypatch.setattr(
+            FakeClient, "new_session",
+            lambda client, *args: processing(
+                client, *args, count=module.COMMIT_RETRIES + 1))
+        file_id = self.p.resolve("/data/large.bin").id
+        with pytest.raises(RuntimeError):
+            self.p.upload_chunked(None, file_id, path)
+        assert len(os.listdir(self.checkpoints)) == 1
+
+    def test_06_chunked_expired_session(self, monkeypatch):
+        HEADING()
+        client = self.p.client
+        path = self.chunked(monkeypatch)
+
+        client.fail_at = ("upload_part_bytes", 3)
+        self.p.put(source=path, destination="/data")
+        # the session expires before the restart
+        client.sessions.clear()
+        client.fail_at = None
+        client.sent = []
+        self.p.put(source=path, destination="/data")
+        assert client.calls["create_upload_session"] == 2
+        assert client.sent == [n * 1024 for n in range(6)]
+        assert self.p.resolve("/data/large.bin").content == \
+            self.content(path)
+        assert os.listdir(self.checkpoints) == []
+
+    def tree(self):
+        # /tree with the files one, two and three in nested folders and
+        # ten empty folders
+        client = self.p.client
+        tree = client.add("0", "tree", "folder")
+        a = client.add(tree.id, "a", "folder")
+        b = client.add(a.id, "b", "folder")
+        client.add(tree.id, "one", "file", b"1")
+        client.add(a.id, "two", "file", b"2")
+        client.add(b.id, "three", "file", b"3")
+        for n in range(10):
+            client.add(tree.id, "empty{n}".format(n=n), "folder")
+        return tree
+
+    def test_07_walk(self):
+        HEADING()
+        module = cloudmesh.storage.provider.box.Provider
+        client = self.p.client
+        tree = self.tree()
+        paths = sorted(path for path, item in self.p.walk(tree.id))
+        assert paths == sorted(["a", "a/b", "a/b/three", "a/two", "one"] +
+                               ["empty{n}".format(n=n) for n in range(10)])
+        # each folder is listed once with the fields of the items, no
+        # item is read again
+        assert client.calls["get_items"] == 13
+        assert client.fields == [module.FIELDS] * 13
+        assert "get" not in client.calls
+
+    def test_08_walk_stops(self):
+        HEADING()
+        client = self.p.client
+        tree = self.tree()
+        self.p.transfer["max_workers"] = 1
+        client.delay = 0.05
+        walk = self.p.walk(tree.id)
+        # the eleven folders of /tree are found while the first one is
+        # listed
+        paths = [next(walk)[0] for n in range(12)]
+        assert paths[-1] == "empty9"
+        walk.close()
+        # the listings that did not start are cancelled
+        assert client.calls["get_items"] <= 3
+
+    def local_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.local)
+                      for root, dirs, files in os.walk(self.local)
+                      for name in files)
+
+    def test_09_download_layout(self):
+        HEADING()
+        client = self.p.client
+        self.tree()
+
+        # only the files of the folder are downloaded
+        downloaded = self.p.get(source="/tree", destination=self.local,
+                                recursive=True)
+        assert [entry["name"] for entry in downloaded] == ["one"]
+        assert self.local_files() == ["one"]
+
+        # the subfolders are recreated
+        self.p.get(source="/tree", destination=self.local, recursive=True,
+                   keep_structure=True)
+        assert self.local_files() == ["a/b/three", "a/two", "one"]
+        with open(os.path.join(self.local, "a", "b", "three"), "rb") as f:
+            assert f.read() == b"3"
+        # the items of the listings are downloaded without reading them
+        # again
+        assert "get" not in client.calls
@@ -0,0 +1,144 @@
+###############################################################
+# pytest -v --capture=no tests/test_gdrive_batch.py
+# pytest -v  tests/test_gdrive_batch.py
+# pytest -v --capture=no -v --nocapture tests/test_gdrive_batch.py:Test_gdrive_batch.<METHIDNAME>
+#
+# The batch requests are answered by an HttpMockSequence, no Google
+# account is needed
+###############################################################
+import json
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+import cloudmesh.storage.provider.gdrive.Provider
+from cloudmesh.common.util import HEADING
+
+BOUNDARY = "batch_cloudmesh"
+
+
+def error_content(status):
+    # the error of a call, 403 and 429 are rate limits
+    reason = "notFound" if status == 404 else "userRateLimitExceeded"
+    return json.dumps({"error": {"code": status,
+                                 "errors": [{"reason": reason}]}})
+
+
+def batch_response(statuses):
+    """
+    returns the answer of the batch endpoint with one part per call
+
+    :param statuses: dict with the HTTP status of each call, the key is
+                     the index of the call in the requests of execute_batch
+    :return: (headers, content) for HttpMockSequence
+    """
+    parts = []
+    for index, status in statuses.items():
+        if status == 204:
+            response = "HTTP/1.1 204 No Content\r\n" \
+                       "Content-Length: 0\r\n\r\n"
+        else:
+            response = "HTTP/1.1 {status} Error\r\n" \
+                       "Content-Type: application/json\r\n\r\n" \
+                       "{content}".format(status=status,
+                                          content=error_content(status))
+        parts.append("--{boundary}\r\n"
+                     "Content-Type: application/http\r\n"
+                     "Content-ID: <response-cloudmesh + {index}>\r\n\r\n"
+                     "{response}\r\n".format(boundary=BOUNDARY,
+                                             index=index,
+                                             response=response))
+    content = "".join(parts) + "--{boundary}--".format(boundary=BOUNDARY)
+    headers = {"status": "200",
+               "content-type": "multipart/mixed; boundary=" + BOUNDARY}
+    return headers, content
+
+
+def batch_error(status, content=None):
+    # the whole batch request failed
+    if content is None:
+        content = error_content(status)
+    return {"status": str(status)}, content
+
+
+class Test_gdrive_batch:
+
+    def provider(self, monkeypatch, *responses):
+        module = cloudmesh.storage.provider.gdrive.Provider
+        self.sleeps = []
+        monkeypatch.setattr(module.time, "sleep", self.sleeps.append)
+        # the provider is not authenticated, the calls go to the mock
+        p = module.Provider.__new__(module.Provider)
+        self.http = HttpMockSequence(list(responses))
+        p.driveService = build("drive", "v3", http=self.http,
+                               static_discovery=True)
+        return p
+
+    def calls(self):
+        # the number of calls in each batch request
+        return [body.count("DELETE ")
+                for uri, method, body, headers in self.http.request_sequence]
+
+    def test_01_errors_per_call(self, monkeypatch):
+        HEADING()
+        p = self.provider(monkeypatch, batch_response({0: 204, 1: 404, 2: 204}))
+        deleted = p.delete_files(["a", "b", "c"])
+        assert [entry["id"] for entry in deleted] == ["a", "b", "c"]
+        assert "error" not in deleted[0]
+        assert "404" in deleted[1]["error"]
+        assert "error" not in deleted[2]
+        assert self.sleeps == []
+
+    def test_02_retry_calls(self, monkeypatch):
+        HEADING()
+        module = cloudmesh.storage.provider.gdrive.Provider
+        p = self.provider(monkeypatch,
+                          batch_response({0: 204, 1: 403, 2: 429}),
+                          batch_response({1: 204, 2: 429}),
+                          batch_response({2: 204}))
+        deleted = p.delete_files(["a", "b", "c"])
+        assert not any("error" in entry for entry in deleted)
+        # only the rate limited calls are sent again
+        assert self.calls() == [3, 2, 1]
+        # the n-th retry waits BACKOFF * 2 ** n and up to a second more
+        assert len(self.sleeps) == 2
+        for attempt, seconds in enumerate(self.sleeps):
+            assert module.BACKOFF * 2 ** attempt <= seconds < \
+                module.BACKOFF * 2 ** attempt + 1
+
+    def test_03_retry_batch(self, monkeypatch):
+        HEADING()
+        module = cloudmesh.storage.provider.gdrive.Provider
+        monkeypatch.setattr(module, "BATCH_SIZE", 2)
+        p = self.provider(monkeypatch,
+                          batch_response({0: 204, 1: 204}),
+                          batch_error(429),
+                          batch_response({2: 204}))
+        deleted = p.delete_files(["a", "b", "c"])
+        assert not any("error" in entry for entry in deleted)
+        # the rate limited batch is sent again, the first one is not
+        assert self.calls() == [2, 1, 1]
+        assert len(self.sleeps) == 1
+
+    def test_04_batch_fails(self, monkeypatch):
+        HEADING()
+        module = cloudmesh.storage.provider.gdrive.Provider
+        monkeypatch.setattr(module, "BATCH_SIZE", 2)
+        monkeypatch.setattr(module, "BATCH_RETRIES", 1)
+        p = self.provider(monkeypatch,
+                          batch_response({0: 204, 1: 204}),
+                          batch_error(500, "backend error"),
+                          batch_error(429),
+                          batch_error(429))
+        # the results of the first batch are kept and the calls of the
+        # failed batch get its error
+        deleted = p.delete_files(["a", "b", "c"])
+        assert [("error" in entry) for entry in deleted] == \
+            [False, False, True]
+        assert "500" in deleted[2]["error"]
+        assert self.sleeps == []
+
+        # a batch that is still rate limited after the last retry
+        deleted = p.delete_files(["d"])
+        assert "429" in deleted[0]["error"]
+        assert len(self.sleeps) == 1
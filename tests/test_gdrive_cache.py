@@ -0,0 +1,122 @@
+###############################################################
+# pytest -v --capture=no tests/test_gdrive_cache.py
+# pytest -v  tests/test_gdrive_cache.py
+# pytest -v --capture=no -v --nocapture tests/test_gdrive_cache.py:Test_gdrive_cache.<METHIDNAME>
+#
+# The queries are answered by an HttpMockSequence, no Google account
+# is needed
+###############################################################
+import json
+import time
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+import cloudmesh.storage.provider.gdrive.Provider
+from cloudmesh.common.util import HEADING
+from cloudmesh.storage.PathCache import PathCache
+
+FOLDER = cloudmesh.storage.provider.gdrive.Provider.FOLDER_MIME_TYPE
+
+
+def folder(file_id):
+    return {"id": file_id, "name": file_id, "mimeType": FOLDER}
+
+
+def text(file_id, name=None):
+    return {"id": file_id, "name": name or file_id, "mimeType": "text/plain"}
+
+
+def listing(*files):
+    # a page of files.list without a next page
+    return {"status": "200"}, json.dumps({"files": list(files)})
+
+
+class SlowHttp(HttpMockSequence):
+    """
+    answers each request after delay seconds
+    """
+
+    delay = 0
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=1, connection_type=None):
+        time.sleep(self.delay)
+        return super(SlowHttp, self).request(uri, method, body, headers,
+                                             redirections, connection_type)
+
+
+class Test_gdrive_cache:
+
+    def provider(self, *responses):
+        module = cloudmesh.storage.provider.gdrive.Provider
+        # the provider is not authenticated, the calls go to the mock
+        p = module.Provider.__new__(module.Provider)
+        self.http = SlowHttp(list(responses))
+        p.http = self.http
+        p.thread_http = lambda: self.http
+        p.driveService = build("drive", "v3", http=self.http,
+                               static_discovery=True)
+        p.transfer = {"chunksize": module.UPLOAD_UNIT, "max_workers": 1}
+        p.ids = PathCache(ttl=60, size=module.CACHE_SIZE)
+        return p
+
+    def queries(self):
+        # the q parameters of the files.list requests
+        return [parse_qs(urlparse(uri).query)["q"][0]
+                for uri, method, body, headers in self.http.request_sequence]
+
+    def test_01_find(self):
+        HEADING()
+        p = self.provider(listing(text("1", "it's")))
+        assert p.find("it's")["id"] == "1"
+        # quotes in names are escaped
+        assert self.queries() == ["name = 'it\\'s' and trashed = false"]
+
+        # the cached file is returned without a request
+        assert p.find("it's")["id"] == "1"
+        assert len(self.http.request_sequence) == 1
+
+    def test_02_walk(self):
+        HEADING()
+        p = self.provider(listing(folder("a"), text("1", "x.txt")),
+                          listing(folder("b")),
+                          listing(text("2", "x.txt")))
+        files = list(p.walk("root", q="name = 'x.txt'"))
+        assert [file["id"] for file in files] == ["a", "1", "b", "2"]
+        # Drive returns the subfolders and the matching files of each
+        # folder
+        folders = " and (mimeType = '{folder}' or (name = 'x.txt'))".format(
+            folder=FOLDER)
+        assert self.queries() == [
+            "'root' in parents and trashed = false" + folders,
+            "'a' in parents and trashed = false" + folders,
+            "'b' in parents and trashed = false" + folders]
+
+    def test_03_search(self):
+        HEADING()
+        p = self.provider(listing(folder("data")),
+                          listing(text("1", "a's.txt")))
+        assert p.search(directory="data", filename="a's.txt")
+        assert self.queries()[1] == \
+            "'data' in parents and trashed = false and name = 'a\\'s.txt'"
+
+        # the whole drive is searched with a single query
+        p = self.provider(listing())
+        assert not p.search(filename="b.txt", recursive=True)
+        assert self.queries() == ["name = 'b.txt' and trashed = false"]
+
+    def test_04_search_stops(self):
+        HEADING()
+        names = ["sub{n}".format(n=n) for n in range(5)]
+        p = self.provider(listing(folder("data")),
+                          listing(*[folder(name) for name in names] +
+                                  [text("1", "a.txt")]),
+                          *[listing() for name in names])
+        self.http.delay = 0.05
+        assert p.search(directory="data", filename="a.txt", recursive=True)
+        # the match stops the walk, the subfolders that are not queried
+        # yet are skipped
+        assert len(self.http.request_sequence) <= 3
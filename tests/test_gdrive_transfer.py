@@ -0,0 +1,253 @@
+###############################################################
+# pytest -v --capture=no tests/test_gdrive_transfer.py
+# pytest -v  tests/test_gdrive_transfer.py
+# pytest -v --capture=no -v --nocapture tests/test_gdrive_transfer.py:Test_gdrive_transfer.<METHIDNAME>
+#
+# The uploads and downloads are answered by an HttpMockSequence, no
+# Google account is needed
+###############################################################
+import json
+import os
+import tempfile
+
+import pytest
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+import cloudmesh.storage.provider.gdrive.Provider
+from cloudmesh.common.util import HEADING
+from cloudmesh.storage.PathCache import PathCache
+from cloudmesh.storage.util import read_checkpoint
+from cloudmesh.storage.util import write_checkpoint
+
+UNIT = cloudmesh.storage.provider.gdrive.Provider.UPLOAD_UNIT
+SESSION = "https://www.googleapis.com/upload/drive/v3/files?upload_id={id}"
+REVISION = {"md5Checksum": "0123", "headRevisionId": "r1"}
+
+
+def started(session_id):
+    # the answer to the request that starts an upload session
+    return {"status": "200", "location": SESSION.format(id=session_id)}, ""
+
+
+def received(end):
+    # the session has the bytes up to end
+    return {"status": "308", "range": "bytes=0-{end}".format(end=end - 1)}, ""
+
+
+def uploaded(file_id, status=200):
+    return {"status": str(status)}, json.dumps({"id": file_id})
+
+
+def error(status):
+    return {"status": str(status)}, json.dumps({"error": {"code": status}})
+
+
+def ranged(data, start, end):
+    # a 206 answer with the bytes start..end - 1 of data
+    return {"status": "206",
+            "content-range": "bytes {start}-{last}/{total}".format(
+                start=start, last=end - 1, total=len(data))}, data[start:end]
+
+
+class Test_gdrive_transfer:
+
+    def setup_method(self):
+        self.local = tempfile.mkdtemp()
+        self.checkpoints = tempfile.mkdtemp()
+
+    def provider(self, monkeypatch, *responses):
+        module = cloudmesh.storage.provider.gdrive.Provider
+        monkeypatch.setattr(module, "CHECKPOINT_DIR", self.checkpoints)
+        # the provider is not authenticated, the calls go to the mock
+        p = module.Provider.__new__(module.Provider)
+        self.http = HttpMockSequence(list(responses))
+        p.http = self.http
+        p.driveService = build("drive", "v3", http=self.http,
+                               static_discovery=True)
+        p.transfer = {"chunksize": UNIT, "max_workers": 1}
+        p.ids = PathCache(ttl=60, size=module.CACHE_SIZE)
+        return p
+
+    def respond(self, *responses):
+        # the next answers of the mock
+        self.http._iterable.extend(responses)
+
+    def requests(self):
+        # (method, Content-Range) of the requests sent to the sessions
+        return [(method, headers.get("Content-Range"))
+                for uri, method, body, headers in self.http.request_sequence
+                if "upload_id" in uri]
+
+    def large_file(self):
+        # two and a half chunks
+        path = os.path.join(self.local, "large.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(2 * UNIT + UNIT // 2))
+        return path, os.path.getsize(path)
+
+    def checkpoint(self):
+        names = os.listdir(self.checkpoints)
+        if len(names) == 0:
+            return None
+        assert len(names) == 1
+        with open(os.path.join(self.checkpoints, names[0])) as f:
+            return f.read()
+
+    def test_01_upload_resume(self, monkeypatch):
+        HEADING()
+        path, size = self.large_file()
+        p = self.provider(monkeypatch, started("a"), received(UNIT),
+                          error(500))
+        # the second chunk fails, the session is kept
+        with pytest.raises(HttpError):
+            p.upload_file(source=None, filename=path, parent_it="folder")
+        assert self.checkpoint() == SESSION.format(id="a")
+
+        # the restart asks the session for its bytes and sends the rest
+        self.http.request_sequence = []
+        self.respond(received(UNIT), received(2 * UNIT), uploaded("large"))
+        file = p.upload_file(source=None, filename=path, parent_it="folder")
+        assert file == {"id": "large"}
+        assert self.requests() == [
+            ("PUT", "bytes */{size}".format(size=size)),
+            ("PUT", "bytes {start}-{end}/{size}".format(
+                start=UNIT, end=2 * UNIT - 1, size=size)),
+            ("PUT", "bytes {start}-{end}/{size}".format(
+                start=2 * UNIT, end=size - 1, size=size))]
+        assert self.checkpoint() is None
+
+    @pytest.mark.parametrize("status", [200, 201])
+    def test_02_upload_complete(self, monkeypatch, status):
+        HEADING()
+        path, size = self.large_file()
+        p = self.provider(monkeypatch, started("a"), received(UNIT),
+                          error(500))
+        with pytest.raises(HttpError):
+            p.upload_file(source=None, filename=path, parent_it="folder")
+
+        # the session received all bytes before the connection was lost,
+        # nothing is sent again
+        self.http.request_sequence = []
+        self.respond(uploaded("large", status=status))
+        file = p.upload_file(source=None, filename=path, parent_it="folder")
+        assert file == {"id": "large"}
+        assert self.requests() == [
+            ("PUT", "bytes */{size}".format(size=size))]
+        assert self.checkpoint() is None
+
+    def test_03_upload_expired(self, monkeypatch):
+        HEADING()
+        path, size = self.large_file()
+        p = self.provider(monkeypatch, started("a"), received(UNIT),
+                          error(500))
+        with pytest.raises(HttpError):
+            p.upload_file(source=None, filename=path, parent_it="folder")
+
+        # the session is gone, a new one starts from the first byte and
+        # replaces the checkpoint
+        self.http.request_sequence = []
+        self.respond(error(404), started("b"), received(UNIT), error(500))
+        with pytest.raises(HttpError):
+            p.upload_file(source=None, filename=path, parent_it="folder")
+        assert self.checkpoint() == SESSION.format(id="b")
+        assert self.requests()[1] == \
+            ("PUT", "bytes 0-{end}/{size}".format(end=UNIT - 1, size=size))
+
+        # the session moves to another URI while the chunks are sent
+        moved = received(2 * UNIT)
+        moved[0]["location"] = SESSION.format(id="c")
+        self.respond(received(UNIT), moved, error(500))
+        with pytest.raises(HttpError):
+            p.upload_file(source=None, filename=path, parent_it="folder")
+        assert self.checkpoint() == SESSION.format(id="c")
+
+        self.respond(received(2 * UNIT), uploaded("large"))
+        p.upload_file(source=None, filename=path, parent_it="folder")
+        assert self.http.request_sequence[-1][0] == SESSION.format(id="c")
+        assert self.checkpoint() is None
+
+    def partial(self, data, revision):
+        # the partial file of an interrupted download of large.txt
+        path = os.path.join(self.local, "large.txt")
+        with open(path + ".cmdownload", "wb") as f:
+            f.write(data)
+        write_checkpoint(path + ".cmrevision", revision)
+        return path
+
+    def ranges(self):
+        # the Range headers of the downloads
+        return [headers["range"]
+                for uri, method, body, headers in self.http.request_sequence
+                if "alt=media" in uri]
+
+    def download(self, p, revision=REVISION):
+        return p.download_file(self.local, "id", "large", "text/plain",
+                               revision=revision)
+
+    def content(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_04_download_resume(self, monkeypatch):
+        HEADING()
+        data = os.urandom(2 * UNIT + UNIT // 2)
+        path = self.partial(data[:UNIT + 10], REVISION)
+        # the revision of the file is requested
+        p = self.provider(monkeypatch,
+                          ({"status": "200"}, json.dumps(REVISION)),
+                          ranged(data, UNIT + 10, 2 * UNIT + 10),
+                          ranged(data, 2 * UNIT + 10, len(data)))
+        assert self.download(p, revision=None) == path
+        assert self.ranges() == [
+            "bytes={start}-{end}".format(start=UNIT + 10,
+                                         end=2 * UNIT + 9),
+            "bytes={start}-{end}".format(start=2 * UNIT + 10,
+                                         end=3 * UNIT + 9)]
+        assert self.content(path) == data
+        assert sorted(os.listdir(self.local)) == ["large.txt"]
+
+    def test_05_download_range_ignored(self, monkeypatch):
+        HEADING()
+        data = os.urandom(UNIT // 2)
+        path = self.partial(b"x" * 100, REVISION)
+        # the whole file is sent, the partial bytes are dropped
+        p = self.provider(monkeypatch, ({"status": "200"}, data))
+        self.download(p)
+        assert self.ranges() == ["bytes=100-{end}".format(end=UNIT + 99)]
+        assert self.content(path) == data
+
+    def test_06_download_complete(self, monkeypatch):
+        HEADING()
+        data = os.urandom(UNIT // 2)
+        path = self.partial(data, REVISION)
+        # the partial file has all bytes of the file
+        p = self.provider(monkeypatch, (
+            {"status": "416",
+             "content-range": "bytes */{total}".format(total=len(data))},
+            ""))
+        self.download(p)
+        assert len(self.ranges()) == 1
+        assert self.content(path) == data
+        assert sorted(os.listdir(self.local)) == ["large.txt"]
+
+    def test_07_download_new_revision(self, monkeypatch):
+        HEADING()
+        data = os.urandom(UNIT // 2)
+        path = self.partial(b"x" * 100, {"md5Checksum": "4567",
+                                         "headRevisionId": "r0"})
+        # the partial file of the old revision is discarded
+        p = self.provider(monkeypatch, ranged(data, 0, len(data)))
+        self.download(p)
+        assert self.ranges() == ["bytes=0-{end}".format(end=UNIT - 1)]
+        assert self.content(path) == data
+
+        # the revision is kept while the download is interrupted
+        p = self.provider(monkeypatch, error(500))
+        path = self.partial(b"x" * 100, {"md5Checksum": "4567",
+                                         "headRevisionId": "r0"})
+        with pytest.raises(HttpError):
+            self.download(p)
+        assert read_checkpoint(path + ".cmrevision") == REVISION
+        assert os.path.getsize(path + ".cmdownload") == 0
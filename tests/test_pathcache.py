@@ -0,0 +1,48 @@
+###############################################################
+# pytest -v --capture=no tests/test_pathcache.py
+# pytest -v  tests/test_pathcache.py
+###############################################################
+import time
+
+from cloudmesh.common.util import HEADING
+from cloudmesh.storage.PathCache import PathCache
+
+
+class Test_pathcache:
+
+    def test_01_get_set(self):
+        HEADING()
+        cache = PathCache(ttl=60, size=10)
+        assert cache.get('a') is None
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_02_ttl(self):
+        HEADING()
+        cache = PathCache(ttl=0.1, size=10)
+        cache.set('a', 1)
+        time.sleep(0.2)
+        assert cache.get('a') is None
+
+    def test_03_lru(self):
+        HEADING()
+        cache = PathCache(ttl=60, size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+    def test_04_invalidate_prefix(self):
+        HEADING()
+        cache = PathCache(ttl=60, size=10)
+        for key in ['data', 'data/2019', 'data/2019/a.txt', 'database']:
+            cache.set(key, key)
+        cache.invalidate_prefix('data')
+        assert cache.get('data/2019/a.txt') is None
+        assert cache.get('data') is None
+        assert cache.get('database') == 'database'
@@ -0,0 +1,56 @@
+###############################################################
+# pytest -v --capture=no tests/test_util.py
+# pytest -v  tests/test_util.py
+###############################################################
+import os
+import tempfile
+
+import pytest
+
+from cloudmesh.common.util import HEADING
+from cloudmesh.storage.util import checkpoint_path
+from cloudmesh.storage.util import merge_settings
+from cloudmesh.storage.util import read_checkpoint
+from cloudmesh.storage.util import size_in_bytes
+from cloudmesh.storage.util import write_checkpoint
+
+
+class Test_util:
+
+    def test_01_size_in_bytes(self):
+        HEADING()
+        assert size_in_bytes(1024) == 1024
+        assert size_in_bytes("8MB") == 8 * 1024 ** 2
+        assert size_in_bytes("1.5 GiB") == 3 * 1024 ** 3 // 2
+        with pytest.raises(ValueError):
+            size_in_bytes("8 parsecs")
+
+    def test_02_merge_settings(self):
+        HEADING()
+        defaults = {"chunksize": "8MB", "max_workers": 4}
+        merged = merge_settings(defaults, {"max_workers": 8})
+        assert merged == {"chunksize": "8MB", "max_workers": 8}
+        assert defaults["max_workers"] == 4
+        assert merge_settings(defaults, None) == defaults
+        with pytest.raises(ValueError):
+            merge_settings(defaults, {"max_worker": 8})
+
+    def test_03_checkpoint(self):
+        HEADING()
+        directory = tempfile.mkdtemp()
+        source = {"path": "/data/a.bin", "size": 10}
+        checkpoint_file = checkpoint_path(directory, source, ".cmupload")
+        assert checkpoint_file == checkpoint_path(directory, dict(source),
+                                                  ".cmupload")
+        assert checkpoint_file != checkpoint_path(
+            directory, dict(source, size=11), ".cmupload")
+
+        assert read_checkpoint(checkpoint_file) is None
+        write_checkpoint(checkpoint_file, {"done": [0, 1]})
+        assert read_checkpoint(checkpoint_file) == {"done": [0, 1]}
+        assert os.listdir(directory) == [os.path.basename(checkpoint_file)]
+
+        # a truncated checkpoint is ignored
+        with open(checkpoint_file, "w") as f:
+            f.write('{"done": [0')
+        assert read_checkpoint(checkpoint_file) is None